@@ -17,6 +17,14 @@ class Main(object):
     def on_bufenter(self, bufnum):
         self.ranger.on_bufenter(int(bufnum))
 
+    @neovim.autocmd('BufWritePost', pattern='*', eval='expand("<afile>:p")', sync=True)
+    def on_bufwrite(self, path):
+        self.ranger.on_bufwrite(path)
+
+    @neovim.autocmd('VimLeave', pattern='*', sync=True)
+    def on_vimleave(self):
+        self.ranger.on_vimleave()
+
     # @neovim.autocmd('BufLeave', pattern='*', eval='expand("<abuf>")', sync=True)
     # def on_bufleave(self, bufnum):
     #     self.ranger.on_bufleave(int(bufnum))
@@ -33,6 +41,34 @@ class Main(object):
     def NETRInvokeMap(self, args):
         self.ranger.invoke_map(args[0])
 
+    @neovim.function('_NETRFilterInput', sync=True)
+    def NETRFilterInput(self, args):
+        self.ranger.filter_input(args[0])
+
     @neovim.command("NETRListRemotes", range='', nargs='*', sync=True)
     def NETRListRemotes(self, args, range):
         self.ranger.listremotes()
+
+    @neovim.command("NETRRemoteRefresh", range='', nargs='*', sync=True)
+    def NETRRemoteRefresh(self, args, range):
+        self.ranger.refresh_remote()
+
+    @neovim.command("NETRCacheStats", range='', nargs='*', sync=True)
+    def NETRCacheStats(self, args, range):
+        self.ranger.cache_stats()
+
+    @neovim.command("NETRLocate", range='', nargs='*', sync=True)
+    def NETRLocate(self, args, range):
+        self.ranger.locate(' '.join(args))
+
+    @neovim.command("NETRJump", range='', nargs='*', sync=True)
+    def NETRJump(self, args, range):
+        self.ranger.jump(' '.join(args))
+
+    @neovim.command("NETRCompare", range='', nargs='*', complete='dir', sync=True)
+    def NETRCompare(self, args, range):
+        self.ranger.compare(' '.join(args))
+
+    @neovim.command("NETRGrep", range='', nargs='*', sync=True)
+    def NETRGrep(self, args, range):
+        self.ranger.grep(' '.join(args))
@@ -0,0 +1,247 @@
+import os
+import hashlib
+import shutil
+import tarfile
+import threading
+import time
+import zipfile
+from netranger.fs import Backend
+from netranger.util import Shell, log
+
+log('')
+
+ArchiveExts = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.xz', '.txz', '.tar.bz2', '.tbz2')
+
+
+def is_archive(path):
+    return path.lower().endswith(ArchiveExts)
+
+
+class ArchiveError(Exception):
+    pass
+
+
+class ArchiveMember(object):
+    def __init__(self, size, mtime, info):
+        self.size = size
+        self.mtime = mtime
+        # ZipInfo/TarInfo used to extract the member
+        self.info = info
+
+
+class ArchiveDir(object):
+    def __init__(self, mtime=0):
+        self.mtime = mtime
+        self.child = {}
+
+
+# The content of an archive as an in-memory tree, read from the central
+# directory of a zip file or from one pass over the headers of a tar file.
+# Members are extracted one at a time, on demand, into the (otherwise empty)
+# local directory `root` mirroring the archive.
+class Archive(object):
+    def __init__(self, path, root):
+        self.path = path
+        self.root = root
+        self.is_zip = path.lower().endswith('.zip')
+        self.tree = ArchiveDir()
+        self.load()
+
+    def load(self):
+        if self.is_zip:
+            with zipfile.ZipFile(self.path) as zf:
+                for info in zf.infolist():
+                    self.add(info.filename, info.is_dir(), info.file_size,
+                             time.mktime(info.date_time + (0, 0, -1)), info)
+        else:
+            with tarfile.open(self.path, 'r:*') as tf:
+                for info in tf:
+                    if info.isdir() or info.isreg():
+                        self.add(info.name, info.isdir(), info.size, info.mtime, info)
+
+    def add(self, name, isdir, size, mtime, info):
+        parts = [p for p in name.split('/') if p not in ('', '.')]
+        # Never map members outside of root
+        if len(parts) == 0 or '..' in parts:
+            return
+        node = self.tree
+        for part in parts[:-1]:
+            if type(node.child.get(part)) is not ArchiveDir:
+                node.child[part] = ArchiveDir()
+            node = node.child[part]
+        if isdir:
+            old = node.child.get(parts[-1])
+            if type(old) is ArchiveDir:
+                old.mtime = mtime
+            else:
+                node.child[parts[-1]] = ArchiveDir(mtime)
+        else:
+            node.child[parts[-1]] = ArchiveMember(size, mtime, info)
+
+    def getNode(self, path):
+        node = self.tree
+        for name in os.path.relpath(path, self.root).split('/'):
+            if name == '.':
+                continue
+            node = node.child[name]
+        return node
+
+    def extract(self, member, dst, count=None):
+        # Streamed to a ".part" file renamed once complete. Only the first
+        # `count` bytes are extracted if given.
+        Shell.mkdir(os.path.dirname(dst))
+        part = dst + '.part'
+        if self.is_zip:
+            with zipfile.ZipFile(self.path) as zf, zf.open(member.info) as src, open(part, 'wb') as f:
+                copy_member(src, f, count)
+        else:
+            with tarfile.open(self.path, 'r:*') as tf:
+                src = tf.extractfile(member.info)
+                with open(part, 'wb') as f:
+                    copy_member(src, f, count)
+        os.replace(part, dst)
+
+
+def copy_member(src, dst, count):
+    if count is None:
+        shutil.copyfileobj(src, dst, 1<<20)
+    else:
+        dst.write(src.read(count))
+
+
+# Read-only backend browsing archives. Each opened archive is mapped to a
+# directory under `cache_dir` named after its path, mtime and size, so that a
+# modified archive gets a fresh tree and extraction cache.
+class ArchiveFS(Backend):
+    fetches = True
+    readonly = True
+    stat_from_listing = True
+
+    def __init__(self, cache_dir, show_hidden=False):
+        Backend.__init__(self, show_hidden)
+        self.cache_dir = cache_dir.rstrip('/')
+        self.archives = {}
+        self.extracting = {}
+        self.lock = threading.Lock()
+        Shell.mkdir(self.cache_dir)
+
+    def open(self, path):
+        st = os.stat(path)
+        key = hashlib.sha1('{}\0{}\0{}'.format(path, st.st_mtime, st.st_size).encode('utf-8', 'surrogateescape'))
+        root = os.path.join(self.cache_dir, '{}-{}'.format(key.hexdigest()[:12], os.path.basename(path)))
+        if root not in self.archives:
+            try:
+                self.archives[root] = Archive(path, root)
+            except (OSError, EOFError, zipfile.BadZipFile, tarfile.TarError) as e:
+                raise ArchiveError('Failed to read {}: {}'.format(path, e))
+            Shell.mkdir(root)
+        return root
+
+    def archive_of(self, path):
+        rel = os.path.relpath(path, self.cache_dir)
+        return self.archives.get(os.path.join(self.cache_dir, rel.split('/')[0]))
+
+    def source(self, path):
+        # Path of the archive file browsed at path
+        archive = self.archive_of(path)
+        return None if archive is None else archive.path
+
+    def owns(self, path):
+        return path.startswith(self.cache_dir+'/') and self.archive_of(path) is not None
+
+    def getNode(self, path):
+        archive = self.archive_of(path)
+        if archive is None:
+            raise KeyError(path)
+        return archive.getNode(path)
+
+    def ls(self, dirname):
+        node = self.getNode(dirname)
+        if type(node) is not ArchiveDir:
+            raise NotADirectoryError(dirname)
+        child = node.child
+        names = [name for name in child if self.show_hidden or name[0] != '.']
+        dirs = sorted(name for name in names if type(child[name]) is ArchiveDir)
+        files = sorted(name for name in names if type(child[name]) is not ArchiveDir)
+        return dirs + files
+
+    def list_with_attrs(self, dirname):
+        return self.attrs(dirname, self.ls(dirname))
+
+    def isdir(self, path):
+        try:
+            return type(self.getNode(path)) is ArchiveDir
+        except KeyError:
+            return False
+
+    def is_root(self, path):
+        # Archives are snapshots, a modified archive is opened as a new one
+        archive = self.archive_of(path)
+        return archive is None or path == archive.root
+
+    def stat_many(self, paths):
+        res = {}
+        for path in paths:
+            try:
+                node = self.getNode(path)
+            except KeyError:
+                res[path] = None
+                continue
+            if type(node) is ArchiveDir:
+                res[path] = (-1, node.mtime, None)
+            else:
+                res[path] = (node.size, node.mtime, None)
+        return res
+
+    def is_fetched(self, path):
+        member = self.getNode(path)
+        try:
+            return os.path.getsize(path) == member.size
+        except OSError:
+            return False
+
+    def fetch_async(self, path, on_done):
+        # on_done(err) is called from the extracting thread
+        with self.lock:
+            if path in self.extracting:
+                self.extracting[path].append(on_done)
+                return
+            self.extracting[path] = [on_done]
+
+        def job():
+            err = None
+            try:
+                self.archive_of(path).extract(self.getNode(path), path)
+            except Exception as e:
+                log('extract failed:', path, e)
+                err = e
+            with self.lock:
+                callbacks = self.extracting.pop(path)
+            for fn in callbacks:
+                fn(err)
+
+        threading.Thread(target=job, daemon=True).start()
+
+    def fetch_head(self, path, count):
+        dst = os.path.join(self.cache_dir, '.head', os.path.relpath(path, self.cache_dir))
+        self.archive_of(path).extract(self.getNode(path), dst, count)
+        return dst
+
+    def extract_many(self, paths):
+        # Extract the members at paths, directories recursively, so that they
+        # can be copied out of the archive as local files
+        for path in paths:
+            node = self.getNode(path)
+            if type(node) is ArchiveDir:
+                Shell.mkdir(path)
+                self.extract_many([os.path.join(path, name) for name in node.child])
+            elif not self.is_fetched(path):
+                try:
+                    self.archive_of(path).extract(node, path)
+                except (OSError, EOFError, zipfile.BadZipFile, tarfile.TarError) as e:
+                    raise ArchiveError('Failed to extract {}: {}'.format(path, e))
+
+    def readonly_error(self, *args, **kwargs):
+        raise ArchiveError('Archives are read-only')
+
+    mv = copy_many = move_many = remove_many = rename_many = readonly_error
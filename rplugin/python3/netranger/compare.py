@@ -0,0 +1,184 @@
+import os
+import hashlib
+import json
+import threading
+from netranger.util import log, process_pool
+
+log('')
+
+# Row codes of a comparison
+Same = '='
+Differ = '!'
+LeftOnly = '<'
+RightOnly = '>'
+Unknown = '?'
+
+
+def hash_file(path, chunk_size=1<<20):
+    # Runs in a worker process
+    h = hashlib.sha1()
+    try:
+        with open(path, 'rb') as f:
+            while True:
+                data = f.read(chunk_size)
+                if not data:
+                    break
+                h.update(data)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+# File hashes keyed by (dev, ino, size, mtime), kept on disk across sessions.
+class HashCache(object):
+    def __init__(self, fname, max_entries=100000):
+        self.fname = fname
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.hashes = {}
+        try:
+            with open(fname, 'r') as f:
+                self.hashes = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def key(st):
+        return '{}:{}:{}:{}'.format(st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+
+    def get(self, st):
+        return self.hashes.get(self.key(st))
+
+    def put(self, st, digest):
+        with self.lock:
+            if len(self.hashes) >= self.max_entries:
+                # drop the oldest half (dicts keep insertion order)
+                keys = list(self.hashes.keys())
+                self.hashes = {k: self.hashes[k] for k in keys[len(keys)//2:]}
+            self.hashes[self.key(st)] = digest
+
+    def save(self):
+        with self.lock:
+            data = json.dumps(self.hashes)
+        tmp = '{}.{}.tmp'.format(self.fname, os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                f.write(data)
+            os.replace(tmp, self.fname)
+        except OSError as e:
+            log('failed to write hash cache:', e)
+
+
+# Compares two directory trees listed through their backends. Files are first
+# compared by size and mtime, only pairs of the same size but different
+# mtimes are hashed (local files only), in a pool of worker processes.
+# The result is a merged tree: a list of [level, name, code, isdir] rows.
+class Comparer(object):
+    def __init__(self, cache_file, max_jobs=4, mtime_tolerance=1):
+        self.hashes = HashCache(cache_file)
+        self.max_jobs = max(max_jobs, 1)
+        self.mtime_tolerance = mtime_tolerance
+
+    def compare(self, left, lfs, right, rfs):
+        rows = []
+        ambiguous = []
+        self.walk(left, lfs, right, rfs, 0, rows, ambiguous)
+        if len(ambiguous) > 0:
+            self.resolve(ambiguous)
+            self.hashes.save()
+        self.set_dir_codes(rows)
+        return rows
+
+    def compare_async(self, left, lfs, right, rfs, on_done):
+        # on_done(rows, err) is called from the comparing thread
+        def job():
+            try:
+                rows = self.compare(left, lfs, right, rfs)
+            except Exception as e:
+                log('compare failed:', left, right, e)
+                on_done(None, e)
+                return
+            on_done(rows, None)
+
+        threading.Thread(target=job, daemon=True).start()
+
+    def walk(self, left, lfs, right, rfs, level, rows, ambiguous):
+        lisdir = {e[0]: e[1] for e in lfs.list_with_attrs(left)}
+        risdir = {e[0]: e[1] for e in rfs.list_with_attrs(right)}
+        names = set(lisdir) | set(risdir)
+        isdir = dict(risdir)
+        isdir.update(lisdir)
+
+        both_files = [name for name in names if name in lisdir and name in risdir
+                      and not lisdir[name] and not risdir[name]]
+        lstats = lfs.stat_many([os.path.join(left, name) for name in both_files])
+        rstats = rfs.stat_many([os.path.join(right, name) for name in both_files])
+        hashable = lfs.local and rfs.local
+
+        for name in sorted(names, key=lambda n: (not isdir[n], n)):
+            lpath, rpath = os.path.join(left, name), os.path.join(right, name)
+            if name not in risdir:
+                rows.append([level, name, LeftOnly, isdir[name]])
+            elif name not in lisdir:
+                rows.append([level, name, RightOnly, isdir[name]])
+            elif isdir[name]:
+                if not risdir[name]:
+                    rows.append([level, name, Differ, True])
+                    continue
+                rows.append([level, name, Same, True])
+                self.walk(lpath, lfs, rpath, rfs, level+1, rows, ambiguous)
+            elif risdir[name]:
+                rows.append([level, name, Differ, False])
+            else:
+                lst, rst = lstats.get(lpath), rstats.get(rpath)
+                row = [level, name, Unknown, False]
+                rows.append(row)
+                if not lst or not rst:
+                    continue
+                if lst[0] != rst[0]:
+                    row[2] = Differ
+                elif abs(lst[1]-rst[1]) <= self.mtime_tolerance:
+                    row[2] = Same
+                elif hashable:
+                    ambiguous.append((row, lpath, rpath))
+
+    def resolve(self, ambiguous):
+        # Hash what's not cached in worker processes, then compare digests
+        stats = {}
+        todo = set()
+        for _, lpath, rpath in ambiguous:
+            for path in (lpath, rpath):
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                stats[path] = st
+                if self.hashes.get(st) is None:
+                    todo.add(path)
+
+        if len(todo) > 0:
+            todo = list(todo)
+            with process_pool(min(self.max_jobs, len(todo)), ['netranger.compare']) as executor:
+                for path, digest in zip(todo, executor.map(hash_file, todo, chunksize=8)):
+                    if digest is not None:
+                        self.hashes.put(stats[path], digest)
+
+        for row, lpath, rpath in ambiguous:
+            if lpath in stats and rpath in stats:
+                ldigest, rdigest = self.hashes.get(stats[lpath]), self.hashes.get(stats[rpath])
+                if ldigest is not None and rdigest is not None:
+                    row[2] = Same if ldigest == rdigest else Differ
+
+    @staticmethod
+    def set_dir_codes(rows):
+        # A directory present on both sides differs if anything below does.
+        # Rows are visited backward, so children come before their parent.
+        changed_below = {}
+        for row in reversed(rows):
+            level, _, code, isdir = row
+            if isdir and code == Same:
+                if changed_below.get(level+1, False):
+                    row[2] = Differ
+                changed_below[level+1] = False
+            if row[2] != Same:
+                changed_below[level] = True
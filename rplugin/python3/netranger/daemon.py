@@ -0,0 +1,434 @@
+import fcntl
+import math
+import os
+import socket
+import socketserver
+import struct
+import subprocess
+import sys
+import threading
+import time
+from collections import OrderedDict
+from netranger.fs import ListingCache, cached_scan
+from netranger.mount import DirtyChecker
+from netranger.remotecache import MetaCache
+from netranger.util import log
+
+log('')
+
+# Requests: op (1 byte) + payload length (4 bytes) + payload
+# Responses: status (1 byte) + payload length (4 bytes) + payload
+Header = struct.Struct('!BI')
+OpList = 1
+OpDirtyMtime = 2
+OpMetaGet = 3
+OpMetaPut = 4
+OpMetaInvalidate = 5
+StatusOk = 0
+StatusError = 1
+
+FtypeCodes = {'dir': 0, 'file': 1, 'exe': 2, 'link': 3}
+FtypeNames = {v: k for k, v in FtypeCodes.items()}
+
+
+class DaemonError(Exception):
+    pass
+
+
+class Writer(object):
+    def __init__(self):
+        self.parts = []
+
+    def str(self, s):
+        data = s.encode('utf-8', 'surrogateescape')
+        self.parts.append(struct.pack('!I', len(data)))
+        self.parts.append(data)
+        return self
+
+    def pack(self, fmt, *args):
+        self.parts.append(struct.pack(fmt, *args))
+        return self
+
+    def bytes(self):
+        return b''.join(self.parts)
+
+
+class Reader(object):
+    def __init__(self, data):
+        self.data = data
+        self.pos = 0
+
+    def str(self):
+        n, = self.unpack('!I')
+        s = self.data[self.pos:self.pos+n].decode('utf-8', 'surrogateescape')
+        self.pos += n
+        return s
+
+    def unpack(self, fmt):
+        res = struct.unpack_from(fmt, self.data, self.pos)
+        self.pos += struct.calcsize(fmt)
+        return res
+
+
+def recv_exact(sock, n):
+    chunks = []
+    while n > 0:
+        chunk = sock.recv(n)
+        if not chunk:
+            raise ConnectionError('connection closed')
+        chunks.append(chunk)
+        n -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_frame(sock):
+    code, n = Header.unpack(recv_exact(sock, Header.size))
+    return code, recv_exact(sock, n)
+
+
+def send_frame(sock, code, payload):
+    sock.sendall(Header.pack(code, len(payload)) + payload)
+
+
+def write_listing(w, entries):
+    w.pack('!I', len(entries))
+    for name, isdir, ftype, _ in entries:
+        w.pack('!B', FtypeCodes.get(ftype, 1)).str(name)
+
+
+def read_listing(r):
+    entries = []
+    for _ in range(r.unpack('!I')[0]):
+        ftype = FtypeNames[r.unpack('!B')[0]]
+        entries.append((r.str(), ftype == 'dir', ftype, None))
+    return entries
+
+
+def write_remote_entries(w, entries):
+    # [name, isdir, size, modtime] as cached by RClone
+    w.pack('!I', len(entries))
+    for name, isdir, size, mtime in entries:
+        w.str(name).pack('!?q', isdir, size).str(mtime)
+
+
+def read_remote_entries(r):
+    entries = []
+    for _ in range(r.unpack('!I')[0]):
+        name = r.str()
+        isdir, size = r.unpack('!?q')
+        entries.append([name, isdir, size, r.str()])
+    return entries
+
+
+# Serves the listing cache of local directories, dirty checks of network
+# mounts and the remote listing metadata to all the neovim instances of a
+# user. It exits once no instance has been connected for `idle_timeout`
+# seconds.
+class Daemon(object):
+    def __init__(self, sock_path, idle_timeout=600, max_remote=1000):
+        self.sock_path = sock_path
+        self.idle_timeout = idle_timeout
+        self.listings = ListingCache(max_dirs=20000)
+        self.checker = DirtyChecker()
+        self.metas = {}
+        # (cache_dir, path) -> (mtime_ns of the meta file, (fetch time,
+        # entries)), least recently used first. The meta files are the
+        # reference: instances not using the daemon write them directly.
+        self.remote = OrderedDict()
+        self.max_remote = max_remote
+        self.lock = threading.Lock()
+        self.clients = 0
+        self.last_seen = time.time()
+
+    def meta(self, cache_dir):
+        with self.lock:
+            if cache_dir not in self.metas:
+                self.metas[cache_dir] = MetaCache(cache_dir)
+            return self.metas[cache_dir]
+
+    def meta_mtime(self, key):
+        try:
+            return os.stat(self.meta(key[0]).fname(key[1])).st_mtime_ns
+        except OSError:
+            return None
+
+    def remote_get(self, key):
+        mtime_ns = self.meta_mtime(key)
+        if mtime_ns is None:
+            with self.lock:
+                self.remote.pop(key, None)
+            return None
+        with self.lock:
+            cached = self.remote.get(key)
+            if cached is not None and cached[0] == mtime_ns:
+                self.remote.move_to_end(key)
+                return cached[1]
+        meta = self.meta(key[0]).get(key[1])
+        if meta is not None:
+            self.remote_put(key, mtime_ns, meta)
+        return meta
+
+    def remote_put(self, key, mtime_ns, meta):
+        with self.lock:
+            self.remote[key] = (mtime_ns, meta)
+            self.remote.move_to_end(key)
+            while len(self.remote) > self.max_remote:
+                self.remote.popitem(last=False)
+
+    def handle(self, op, payload):
+        r = Reader(payload)
+        w = Writer()
+        if op == OpList:
+            mtime_ns, entries = cached_scan(self.listings, r.str())
+            w.pack('!q', mtime_ns)
+            write_listing(w, entries)
+        elif op == OpDirtyMtime:
+            mtime, stale = self.checker.mtime(r.str())
+            w.pack('!d?', math.nan if mtime is None else mtime, stale)
+        elif op == OpMetaGet:
+            meta = self.remote_get((r.str(), r.str()))
+            if meta is None:
+                w.pack('!?', False)
+            else:
+                w.pack('!?d', True, meta[0])
+                write_remote_entries(w, meta[1])
+        elif op == OpMetaPut:
+            key = (r.str(), r.str())
+            entries = read_remote_entries(r)
+            fetch_time = time.time()
+            self.meta(key[0]).put(key[1], entries)
+            mtime_ns = self.meta_mtime(key)
+            if mtime_ns is not None:
+                self.remote_put(key, mtime_ns, (fetch_time, entries))
+        elif op == OpMetaInvalidate:
+            key = (r.str(), r.str())
+            with self.lock:
+                self.remote.pop(key, None)
+            self.meta(key[0]).invalidate(key[1])
+        else:
+            raise DaemonError('unknown op {}'.format(op))
+        return w.bytes()
+
+    def serve(self):
+        # Only one daemon per socket
+        lock = open(self.sock_path + '.lock', 'w')
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            return
+        try:
+            os.remove(self.sock_path)
+        except OSError:
+            pass
+
+        daemon = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                with daemon.lock:
+                    daemon.clients += 1
+                try:
+                    while True:
+                        op, payload = recv_frame(self.request)
+                        try:
+                            res = daemon.handle(op, payload)
+                        except Exception as e:
+                            send_frame(self.request, StatusError, Writer().str(str(e)).bytes())
+                            continue
+                        send_frame(self.request, StatusOk, res)
+                except (ConnectionError, OSError):
+                    pass
+                finally:
+                    with daemon.lock:
+                        daemon.clients -= 1
+                        daemon.last_seen = time.time()
+
+        old_umask = os.umask(0o077)
+        try:
+            server = socketserver.ThreadingUnixStreamServer(self.sock_path, Handler)
+        finally:
+            os.umask(old_umask)
+        server.daemon_threads = True
+        threading.Thread(target=self.exit_when_idle, args=(server,), daemon=True).start()
+        try:
+            server.serve_forever()
+        finally:
+            server.server_close()
+            try:
+                os.remove(self.sock_path)
+            except OSError:
+                pass
+
+    def exit_when_idle(self, server):
+        while True:
+            time.sleep(min(self.idle_timeout, 10))
+            with self.lock:
+                idle = self.clients == 0 and time.time() - self.last_seen > self.idle_timeout
+            if idle:
+                server.shutdown()
+                return
+
+
+# Connection of a neovim instance to the daemon, which is started on demand.
+# Every method returns None when the daemon can't be reached or fails, so
+# that callers fall back to doing the work in-process. The daemon is started
+# in the background, requests made meanwhile are done in-process, and
+# reconnecting is retried every `retry_interval` seconds. A daemon process
+# that failed is not started again. Requests are made from the UI thread, so a
+# daemon not answering within `timeout` seconds is considered dead and isn't
+# used anymore, and a request is not kept waiting for another one in flight.
+class DaemonClient(object):
+    def __init__(self, sock_path, timeout=0.2, retry_interval=30, start_timeout=2):
+        self.sock_path = sock_path
+        self.timeout = timeout
+        self.retry_interval = retry_interval
+        self.start_timeout = start_timeout
+        self.sock = None
+        self.proc = None
+        self.starting = False
+        self.next_try = 0
+        self.dead = False
+        self.lock = threading.Lock()
+
+    def connect(self):
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        try:
+            sock.connect(self.sock_path)
+        except OSError:
+            sock.close()
+            raise
+        return sock
+
+    def spawn(self):
+        if self.proc is not None:
+            code = self.proc.poll()
+            if code is None:
+                # still starting
+                return
+            if code != 0:
+                raise DaemonError('daemon exited with code {}'.format(code))
+        pkg_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(
+            p for p in [pkg_dir, os.environ.get('PYTHONPATH')] if p))
+        self.proc = subprocess.Popen([sys.executable, '-m', 'netranger.daemon', self.sock_path],
+                                     stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL,
+                                     stderr=subprocess.DEVNULL, start_new_session=True, env=env)
+
+    def start(self):
+        # Called with the lock held
+        self.starting = True
+
+        def job():
+            sock = None
+            try:
+                self.spawn()
+                deadline = time.time() + self.start_timeout
+                while sock is None and time.time() < deadline:
+                    try:
+                        sock = self.connect()
+                    except OSError:
+                        time.sleep(0.05)
+                if sock is None:
+                    raise DaemonError('daemon did not start in {} seconds'.format(self.start_timeout))
+            except (OSError, DaemonError) as e:
+                log('daemon unavailable, running in-process:', e)
+            with self.lock:
+                self.starting = False
+                if sock is None:
+                    self.next_try = time.time() + self.retry_interval
+                else:
+                    self.sock = sock
+
+        threading.Thread(target=job, daemon=True).start()
+
+    def ensure_connected(self):
+        if self.sock is not None:
+            return True
+        if self.dead or self.starting or time.time() < self.next_try:
+            return False
+        try:
+            self.sock = self.connect()
+            return True
+        except OSError:
+            self.start()
+            return False
+
+    def request(self, op, payload):
+        if not self.lock.acquire(timeout=self.timeout):
+            return None
+        try:
+            if not self.ensure_connected():
+                return None
+            try:
+                send_frame(self.sock, op, payload)
+                status, res = recv_frame(self.sock)
+            except socket.timeout:
+                log('daemon timed out, running in-process from now on')
+                self.close()
+                self.dead = True
+                return None
+            except (OSError, ConnectionError) as e:
+                log('daemon request failed:', e)
+                self.close()
+                self.next_try = time.time() + self.retry_interval
+                return None
+        finally:
+            self.lock.release()
+        if status != StatusOk:
+            log('daemon error:', Reader(res).str())
+            return None
+        return Reader(res)
+
+    def close(self):
+        if self.sock is not None:
+            self.sock.close()
+            self.sock = None
+
+    def list(self, dirname):
+        # (mtime_ns, entries) of the directory
+        r = self.request(OpList, Writer().str(dirname).bytes())
+        if r is None:
+            return None
+        mtime_ns, = r.unpack('!q')
+        return mtime_ns, read_listing(r)
+
+    def dirty_mtime(self, path):
+        r = self.request(OpDirtyMtime, Writer().str(path).bytes())
+        if r is None:
+            return None
+        mtime, stale = r.unpack('!d?')
+        return (None if math.isnan(mtime) else mtime), stale
+
+
+# MetaCache of RClone going through the daemon, with the on-disk cache as
+# fallback.
+class SharedMetaCache(MetaCache):
+    def __init__(self, client, cache_dir, ttl=None):
+        MetaCache.__init__(self, cache_dir, ttl)
+        self.client = client
+        self.cache_dir = cache_dir
+
+    def get(self, path):
+        r = self.client.request(OpMetaGet, Writer().str(self.cache_dir).str(path).bytes())
+        if r is None:
+            # daemon unavailable or failed
+            return MetaCache.get(self, path)
+        if not r.unpack('!?')[0]:
+            return None
+        fetch_time, = r.unpack('!d')
+        return fetch_time, read_remote_entries(r)
+
+    def put(self, path, entries):
+        w = Writer().str(self.cache_dir).str(path)
+        write_remote_entries(w, entries)
+        if self.client.request(OpMetaPut, w.bytes()) is None:
+            MetaCache.put(self, path, entries)
+
+    def invalidate(self, path):
+        if self.client.request(OpMetaInvalidate, Writer().str(self.cache_dir).str(path).bytes()) is None:
+            MetaCache.invalidate(self, path)
+
+
+if __name__ == '__main__':
+    Daemon(sys.argv[1]).serve()
@@ -2,6 +2,8 @@ import os
 keymap = {
     # non-printable characters (e.g. <cr>) should be in small case for NETRDefaultMapSkip feature
     'NETROpen': (['l','<right>'], "Change directory/open file under cursor"),
+    'NETROpenPicked': (['go'], "Open all picked files, each program once with all its files"),
+    'NETROpenHead': (['gh'], "Open only the head (g:NETRHeadBytes bytes) of the remote or archived file under cursor"),
     'NETRParentDir': (['h','<left>'], "Change to parent directory"),
     'NETRToggleExpand': (['<space>', 'o'], "Toggle expand current directory under cursor"),
     'NETRVimCD': (['<cr>'], "Changing vim's pwd to the directory of the entry under cursor"),
@@ -18,7 +20,13 @@ keymap = {
     'NETRForceDelete': (['X'], "Force delete all picked entries"),
     'NETRForceDeleteSingle': (['XX'], "Force delete the current entry."),
     'NETRTogglePinRoot': (['zp'], "(Toggle) Pin current directory as \"root\""),
+    'NETRFilter': (['f'], "Filter entries of the current directory as you type"),
+    'NETRToggleShowInfo': (['zi'], "(Toggle) Show size/mtime/permissions of entries"),
+    'NETRToggleDiskUsage': (['zu'], "(Toggle) Show the recursive size of directories"),
+    'NETRToggleGitStatus': (['zg'], "(Toggle) Show the git status of entries"),
+    'NETRToggleSort': (['zs'], "Cycle sorting entries by name/size/mtime"),
     'NETRToggleShowHidden': (['zh'], "(Toggle) Show hidden files"),
+    'NETRTogglePreview': (['zv'], "(Toggle) Preview the file/directory under cursor in a split"),
     'NETRBookmarkSet': (['m'], "Jump to bookmark, pending for single character"),
     'NETRBookmarkGo': (["'"], "Bookmark current directory, pending for single character"),
     'NETRBookmarkEdit': (["em"], "Open bookmark file to edit"),
@@ -44,9 +52,29 @@ variables = {
     'NETRDefaultMapSkip': [],
     'NETRTabAutoToFirst': False,
     'NETRHiCWD': 'yellow',
+    'NETRShowInfo': False,
+    'NETRGitStatus': False,
     'NETRRootDir': root_dir,
     'NETRBookmarkFile': root_dir+'bookmark',
     'NETRRifleFile': root_dir+'rifle.conf',
+    'NETRFrecencyFile': root_dir+'frecency',
+    'NETRSessionFile': root_dir+'session',
     'NETRCacheDir': root_dir+'cache',
+    'NETRRcloneRcd': False,
+    'NETRRemoteCacheTTL': {'*': 600},
+    'NETRDownloadJobs': 2,
+    'NETRHeadBytes': 65536,
+    'NETRCacheQuota': 1<<30,
+    'NETRRcloneTransfers': 4,
+    'NETRRcloneCheckers': 8,
+    'NETRPrefetchJobs': 2,
+    'NETRPrefetchBudget': 100,
+    'NETRPrefetchIdle': 200,
+    'NETRPreviewDelay': 100,
+    'NETRPreviewBytes': 16384,
+    'NETRDuJobs': 4,
+    'NETRCompareJobs': 4,
+    'NETRGrepJobs': 4,
+    'NETRDaemon': False,
     '_NETRRegister': [],  # internal use only
 }
@@ -0,0 +1,151 @@
+import os
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from netranger.util import log
+
+log('')
+
+
+# Result of scanning one directory: its mtime, the size of the files directly
+# in it, the hardlinked files in it ((dev, ino) -> size, counted once per
+# computation) and the names of its subdirectories.
+class DirUsage(object):
+    def __init__(self, mtime, size, links, subdirs):
+        self.mtime = mtime
+        self.size = size
+        self.links = links
+        self.subdirs = subdirs
+
+
+# Computes recursive directory sizes in a pool of worker threads, each of them
+# scanning one directory at a time. Scan results are cached by (dev, ino) and
+# reused as long as the directory's mtime didn't change, so computing the size
+# of a tree again only lists the directories modified since.
+class DuEngine(object):
+    def __init__(self, max_jobs=4, progress_interval=0.2):
+        self.executor = ThreadPoolExecutor(max_workers=max(max_jobs, 1))
+        self.progress_interval = progress_interval
+        self.cache = {}
+        self.lock = threading.Lock()
+        self.jobs = {}
+
+    def scan(self, path, st):
+        key = (st.st_dev, st.st_ino)
+        usage = self.cache.get(key)
+        if usage is not None and usage.mtime == st.st_mtime:
+            return usage
+
+        size = 0
+        links = {}
+        subdirs = []
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    est = entry.stat(follow_symlinks=False)
+                except OSError:
+                    continue
+                if stat.S_ISDIR(est.st_mode):
+                    subdirs.append(entry.name)
+                elif est.st_nlink > 1:
+                    links[(est.st_dev, est.st_ino)] = est.st_size
+                else:
+                    size += est.st_size
+        usage = DirUsage(st.st_mtime, size, links, subdirs)
+        self.cache[key] = usage
+        return usage
+
+    def du(self, path, on_progress):
+        # on_progress(path, total, done) is called from worker threads with
+        # partial totals while the tree is being walked and once when done.
+        # A computation already running for path is shared.
+        with self.lock:
+            job = self.jobs.get(path)
+            if job is not None and not job.cancelled:
+                job.callbacks.append(on_progress)
+                return job
+            job = self.jobs[path] = DuJob(self, path, on_progress)
+        job.start()
+        return job
+
+    def cancel(self, path=None):
+        with self.lock:
+            jobs = list(self.jobs.values()) if path is None else [self.jobs.get(path)]
+        for job in jobs:
+            if job is not None:
+                job.cancel()
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False)
+
+
+class DuJob(object):
+    def __init__(self, engine, root, on_progress):
+        self.engine = engine
+        self.root = root
+        self.callbacks = [on_progress]
+        self.lock = threading.Lock()
+        self.total = 0
+        self.pending = 0
+        self.links = set()
+        self.cancelled = False
+        self.last_report = 0
+
+    def start(self):
+        self.submit(self.root)
+
+    def cancel(self):
+        self.cancelled = True
+
+    def submit(self, path):
+        with self.lock:
+            self.pending += 1
+        self.engine.executor.submit(self.run, path)
+
+    def run(self, path):
+        try:
+            if not self.cancelled:
+                self.walk(path)
+        except Exception as e:
+            log('du failed:', path, e)
+        finally:
+            with self.lock:
+                self.pending -= 1
+                done = self.pending == 0
+            if done:
+                self.finish()
+
+    def walk(self, path):
+        try:
+            st = os.lstat(path)
+            usage = self.engine.scan(path, st)
+        except OSError as e:
+            log('du scan failed:', path, e)
+            return
+        with self.lock:
+            size = usage.size
+            for key, link_size in usage.links.items():
+                if key not in self.links:
+                    self.links.add(key)
+                    size += link_size
+            self.total += size
+        for name in usage.subdirs:
+            self.submit(os.path.join(path, name))
+
+        now = time.time()
+        if now - self.last_report > self.engine.progress_interval:
+            self.last_report = now
+            self.report(False)
+
+    def finish(self):
+        with self.engine.lock:
+            if self.engine.jobs.get(self.root) is self:
+                del self.engine.jobs[self.root]
+        if not self.cancelled:
+            self.report(True)
+
+    def report(self, done):
+        for fn in list(self.callbacks):
+            fn(self.root, self.total, done)
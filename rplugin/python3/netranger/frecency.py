@@ -0,0 +1,140 @@
+import os
+import json
+import queue
+import threading
+import time
+from netranger.util import log
+
+log('')
+
+
+# Directory visit history ranked by frecency (visit count weighted by how
+# recently the directory was visited). Visits are kept in memory and appended
+# to a log file by a background thread, so recording one never waits on the
+# disk. Once the log grows over `max_log` lines, it's compacted into the
+# database file, and counts are aged so that the total stays below
+# `max_total` visits.
+class Frecency(object):
+    def __init__(self, db_file, max_log=500, max_total=10000):
+        self.db_file = db_file
+        self.log_file = db_file + '.log'
+        self.max_log = max_log
+        self.max_total = max_total
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.log_lines = 0
+        # Visits numbered up to `logged_seq` are in the database already
+        self.seq = 0
+        self.logged_seq = 0
+        self.load()
+        self.queue = queue.Queue()
+        threading.Thread(target=self._writer, daemon=True).start()
+
+    def load(self):
+        try:
+            with open(self.db_file, 'r') as f:
+                self.entries = {path: list(entry) for path, entry in json.load(f).items()}
+        except (OSError, ValueError) as e:
+            log('frecency db not loaded:', e)
+        try:
+            with open(self.log_file, 'r') as f:
+                for line in f:
+                    visit_time, _, path = line.rstrip('\n').partition('\t')
+                    if len(path) > 0:
+                        self._add(path, float(visit_time))
+                        self.log_lines += 1
+        except (OSError, ValueError) as e:
+            log('frecency log not loaded:', e)
+
+    def _add(self, path, visit_time):
+        entry = self.entries.get(path)
+        if entry is None:
+            self.entries[path] = [1, visit_time]
+        else:
+            entry[0] += 1
+            entry[1] = max(entry[1], visit_time)
+
+    def record(self, path):
+        visit_time = time.time()
+        with self.lock:
+            self._add(path, visit_time)
+            self.seq += 1
+            self.queue.put((self.seq, path, visit_time))
+
+    def forget(self, path):
+        with self.lock:
+            self.entries.pop(path, None)
+        self.flush(wait=False)
+
+    def flush(self, wait=True):
+        done = threading.Event()
+        self.queue.put(done)
+        if wait:
+            done.wait(1)
+
+    def _writer(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if isinstance(item, threading.Event):
+                    self.compact()
+                    item.set()
+                    continue
+                seq, path, visit_time = item
+                if seq <= self.logged_seq:
+                    continue
+                with open(self.log_file, 'a') as f:
+                    f.write('{}\t{}\n'.format(visit_time, path))
+                self.log_lines += 1
+                if self.log_lines >= self.max_log:
+                    self.compact()
+            except OSError as e:
+                log('failed to write frecency log:', e)
+
+    def compact(self):
+        with self.lock:
+            total = sum(entry[0] for entry in self.entries.values())
+            if total > self.max_total:
+                factor = 0.9 * self.max_total / total
+                self.entries = {path: [entry[0]*factor, entry[1]] for path, entry in self.entries.items()
+                                if entry[0]*factor >= 1}
+            data = json.dumps(self.entries)
+            self.logged_seq = self.seq
+        tmp = '{}.{}.tmp'.format(self.db_file, os.getpid())
+        with open(tmp, 'w') as f:
+            f.write(data)
+        os.replace(tmp, self.db_file)
+        # Every visit logged so far is in the database now
+        with open(self.log_file, 'w'):
+            pass
+        self.log_lines = 0
+
+    @staticmethod
+    def score(entry, now):
+        count, last_visit = entry
+        age = now - last_visit
+        if age < 3600:
+            return count * 4
+        elif age < 86400:
+            return count * 2
+        elif age < 604800:
+            return count / 2
+        else:
+            return count / 4
+
+    def query(self, query='', limit=1000):
+        # Every word of the query must appear in the path, directories whose
+        # name starts with the last word come first.
+        terms = query.lower().split()
+        now = time.time()
+        with self.lock:
+            items = list(self.entries.items())
+
+        res = []
+        for path, entry in items:
+            lpath = path.lower()
+            if all(t in lpath for t in terms):
+                prefix = len(terms) > 0 and os.path.basename(lpath).startswith(terms[-1])
+                res.append((prefix, self.score(entry, now), path))
+        res.sort(reverse=True)
+        return [path for _, _, path in res[:limit]]
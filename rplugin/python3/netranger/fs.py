@@ -1,158 +1,537 @@
+import json
 import os
+import re
+from datetime import datetime
 from netranger.util import Shell
 from netranger.util import log
+from netranger.rcd import RcloneRcd, RcdError
+from netranger.remotecache import MetaCache, FileCache
+from netranger.transfer import Downloader
+from netranger.prefetch import Prefetcher
+from netranger.mount import MountTable, DirtyChecker, LOCAL
 import shutil
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
 
 log('')
 
 
-class FS(object):
+def rclone_time(mtime):
+    # e.g. 2017-05-31T16:15:57.034468261+01:00, fromisoformat only handles
+    # up to microseconds
+    if len(mtime) == 0:
+        return 0
+    mtime = re.sub(r'(\.\d{6})\d+', r'\1', mtime.replace('Z', '+00:00'))
+    try:
+        return datetime.fromisoformat(mtime).timestamp()
+    except ValueError:
+        return 0
+
+
+def scan_dir(dirname):
+    # Entries of a local directory, hidden ones included. File types come
+    # from the directory entries, only files need an access check.
+    dirs = []
+    files = []
+    for entry in os.scandir(dirname):
+        if entry.is_dir():
+            dirs.append((entry.name, True, 'dir', None))
+        else:
+            ftype = 'exe' if os.access(entry.path, os.X_OK) else 'file'
+            files.append((entry.name, False, ftype, None))
+    return sorted(dirs) + sorted(files)
+
+
+def cached_scan(listings, dirname):
+    # Directories unchanged since they were last listed are answered from
+    # the listing cache at the cost of one stat. Returns (mtime_ns, entries).
+    mtime_ns = os.stat(dirname).st_mtime_ns
+    entries = listings.get(dirname, mtime_ns)
+    if entries is None:
+        entries = scan_dir(dirname)
+        listings.put(dirname, mtime_ns, entries)
+    return mtime_ns, entries
+
+
+# Listings of local directories (hidden entries included) with the mtime of
+# the directory they were read at, least recently used ones dropped first.
+# Kept across sessions through the session snapshot.
+class ListingCache(object):
+    def __init__(self, max_dirs=2000):
+        self.max_dirs = max_dirs
+        self.lock = threading.Lock()
+        self.listings = OrderedDict()
+
+    def get(self, dirname, mtime_ns):
+        with self.lock:
+            cached = self.listings.get(dirname)
+            if cached is None or cached[0] != mtime_ns:
+                return None
+            self.listings.move_to_end(dirname)
+            return cached[1]
+
+    def put(self, dirname, mtime_ns, entries):
+        # A directory modified within the mtime granularity of the listing
+        # could change again unnoticed
+        if time.time_ns() - mtime_ns <= 2*10**9:
+            return
+        with self.lock:
+            self.listings[dirname] = (mtime_ns, entries)
+            self.listings.move_to_end(dirname)
+            if len(self.listings) > self.max_dirs:
+                self.listings.popitem(last=False)
+
+    def dump(self):
+        with self.lock:
+            return list(self.listings.items())
+
+    def load(self, items):
+        with self.lock:
+            for dirname, cached in items:
+                if dirname not in self.listings:
+                    self.listings[dirname] = cached
+                    self.listings.move_to_end(dirname, last=False)
+            while len(self.listings) > self.max_dirs:
+                self.listings.popitem(last=False)
+
+
+# The interface pages and buffers use to access a filesystem. Entries are
+# listed with their attributes and operations are done in batches, so that
+# each backend can do the cheapest bulk operation it has. Listings are lists
+# of (name, isdir, ftype, stat) entries, stat being (size, mtime, mode) when
+# the backend has it for free (stat_from_listing) and None otherwise.
+class Backend(ABC):
+    # Capabilities
+    # paths are real local paths
+    local = False
+    # listings are fetched over the network, see prefetch
+    remote = False
+    # see list_with_attrs_stream
+    streaming = False
+    # files need to be fetched before being opened, see fetch_async
+    fetches = False
+    # no mutation
+    readonly = False
+    # stat_many is answered from the listing
+    stat_from_listing = False
+
     def __init__(self, show_hidden=False):
         self.show_hidden = show_hidden
 
     def toggle_show_hidden(self):
         self.show_hidden = not self.show_hidden
 
-    def ls(self, dirname):
-        assert os.path.isdir(dirname)
-        ori_cwd = os.getcwd()
-        os.chdir(dirname)
-        dirs = []
-        files = []
-        for f in os.listdir(dirname):
-            if not self.show_hidden and f[0]=='.':
-                continue
-            if os.path.isdir(f):
-                dirs.append(f)
-            else:
-                files.append(f)
-        dirs = sorted(dirs)
-        files = sorted(files)
-        os.chdir(ori_cwd)
-        return dirs + files
+    @abstractmethod
+    def list_with_attrs(self, dirname):
+        # Raises OSError or KeyError if dirname is not a directory
+        pass
+
+    def list_with_attrs_stream(self, dirname):
+        # Iterator of listing chunks, the first one being available quickly
+        yield self.list_with_attrs(dirname)
+
+    @abstractmethod
+    def isdir(self, path):
+        pass
+
+    def ftype(self, path):
+        if self.isdir(path):
+            return 'dir'
+        return 'file'
+
+    def attrs(self, dirname, names):
+        # Listing entries of `names` in `dirname`, for backends listing names
+        paths = [os.path.join(dirname, name) for name in names]
+        stats = self.stat_many(paths) if self.stat_from_listing else {}
+        entries = []
+        for name, path in zip(names, paths):
+            isdir = self.isdir(path)
+            entries.append((name, isdir, 'dir' if isdir else self.ftype(path), stats.get(path)))
+        return entries
+
+    @abstractmethod
+    def stat_many(self, paths):
+        # {path: (size, mtime, mode) or None}
+        pass
+
+    def is_fetched(self, path):
+        return True
+
+    def fetch_async(self, path, on_done):
+        on_done(None)
+
+    def fetch_head(self, path, count):
+        # Path of a local file with (at least) the first `count` bytes of path
+        return path
+
+    def use_fetched(self, path):
+        # Called when a fetched file is opened instead of being fetched again
+        pass
+
+    def is_root(self, path):
+        return path == '/'
 
     def parent_dir(self, cwd):
+        if self.is_root(cwd):
+            return cwd
         return os.path.abspath(os.path.join(cwd, os.pardir))
 
-    def ftype(self, fname):
-        if os.path.islink(fname):
-            catlog = 'link'
-        if os.path.isdir(fname):
-            catlog = 'dir'
-        elif os.access(fname, os.X_OK):
-            catlog = 'exe'
-        else:
-            catlog = 'file'
-        return catlog
+    def mtime(self, path):
+        return 0
+
+    def dirty_mtime(self, path):
+        # (mtime, stale)
+        return 0, False
 
+    @abstractmethod
     def mv(self, src, dst):
-        shutil.move(src, dst)
+        pass
+
+    @abstractmethod
+    def copy_many(self, srcs, dst):
+        pass
+
+    @abstractmethod
+    def move_many(self, srcs, dst):
+        pass
+
+    @abstractmethod
+    def remove_many(self, targets, force=False):
+        pass
+
+    def rename_many(self, pairs):
+        for src, dst in pairs:
+            self.mv(src, dst)
+
+
+class FS(Backend):
+    local = True
+    # shared by all local buffers
+    mounts = MountTable()
+    checker = DirtyChecker()
+    listings = ListingCache()
+    # shared listing cache and dirty checks of netranger.daemon, if enabled
+    daemon = None
+
+    def list_with_attrs(self, dirname):
+        # Listings from the daemon also go into the local listing cache, so
+        # that they are saved in the session
+        entries = None
+        if FS.daemon is not None:
+            entries = FS.listings.get(dirname, os.stat(dirname).st_mtime_ns)
+            if entries is None:
+                res = FS.daemon.list(dirname)
+                if res is not None:
+                    mtime_ns, entries = res
+                    FS.listings.put(dirname, mtime_ns, entries)
+        if entries is None:
+            _, entries = cached_scan(FS.listings, dirname)
+        if not self.show_hidden:
+            entries = [e for e in entries if e[0][0]!='.']
+        return entries
+
+    def isdir(self, path):
+        return os.path.isdir(path)
+
+    def mtime(self, path):
+        return Shell.mtime(path)
+
+    def stat_many(self, paths):
+        res = {}
+        for path in paths:
+            try:
+                st = os.lstat(path)
+                res[path] = (st.st_size, st.st_mtime, st.st_mode)
+            except OSError:
+                res[path] = None
+        return res
+
+    def dirty_mtime(self, path):
+        # Returns (mtime, stale). Stat'ing on network/fuse mounts might hang,
+        # so it is done with a timeout and the last known mtime is returned
+        # (flagged stale) when it doesn't answer in time.
+        if FS.mounts.classify(path) == LOCAL:
+            return Shell.mtime(path), False
+        if FS.daemon is not None:
+            res = FS.daemon.dirty_mtime(path)
+            if res is not None:
+                return res
+        return FS.checker.mtime(path)
 
-    def cp(self, src, dst):
-        if os.path.isdir(src) and src[-1]!='/':
-            src = src+'/'
-        if os.path.isdir(dst) and dst[-1]!='/':
-            dst = dst+'/'
-        Shell.run('cp -r "{}" "{}"'.format(src, dst))
+    def mv(self, src, dst):
+        shutil.move(src, dst)
 
-    def rm(self, target):
-        Shell.run('rm -r {}'.format(target))
+    def copy_many(self, srcs, dst):
+        Shell.run_args(['cp', '-r', '--'] + list(srcs) + [dst])
 
-    def rmf(self, target):
-        Shell.run('rm -r {}'.format(target))
+    def move_many(self, srcs, dst):
+        for src in srcs:
+            self.mv(src, dst)
 
+    def remove_many(self, targets, force=False):
+        Shell.run_args(['rm', '-rf' if force else '-r', '--'] + list(targets))
 
-class RcloneFile(FS):
-    def __init__(self, lpath, path, show_hidden=False):
-        FS.__init__(self, show_hidden)
 
+# A file of a remote listing: where it's (to be) cached locally, its remote
+# path and the remote size/modtime it was listed with
+class RcloneFile(object):
+    def __init__(self, lpath, path, size=-1, mtime=''):
         self.lpath = lpath
         self.path = path
-        self.downloaded = False
-
-        with open(lpath, "w") as f:
-            f.write("")
-
-    def download(self):
-        if self.downloaded:
-            return
-        else:
-            Shell.run('rclone copyto "{}" "{}"'.format(self.path, self.lpath))
-            self.downloaded = True
+        self.size = size
+        self.mtime = mtime
 
 
 class RcloneDir(object):
-    def __init__(self, lpath, path):
-        Shell.mkdir(lpath)
+    def __init__(self, lpath, path, rclone):
         self.lpath = lpath
 
         self.child = {}
         self.cached = False
         self.path = path
+        self.rclone = rclone
+        self.revalidating = False
+        # serializes listing between the ui and prefetching threads
+        self.lock = threading.Lock()
 
-        if path is None:
-            remotes = Shell.run('rclone listremotes').split(':\n')
-            log(remotes)
-            for remote in remotes:
-                if len(remote)==0:
-                    continue
-                self.child[remote] = RcloneDir(os.path.join(lpath, remote), remote+':/')
-            self.cached = True
+    @property
+    def meta_key(self):
+        # The root directory lists remotes, it has no remote path
+        return '' if self.path is None else self.path
 
     @property
     def contentcache(self):
-        return self.child.keys()
-
-    def lsd(self):
-        info = Shell.run('rclone lsd {} --max-depth 1'.format(self.path))
-
-        for line in info.split('\n'):
-            line = line.strip()
-            if len(line)>0:
-                name = line.split()[-1]
-                self.child[name] = RcloneDir(os.path.join(self.lpath, name), os.path.join(self.path, name))
-
-    def lsl(self):
-        info = Shell.run('rclone lsl {} --max-depth 1'.format(self.path))
-
-        for line in info.split('\n'):
-            line = line.strip()
-            if len(line)>0:
-                name = line.split()[-1]
-                self.child[name] = RcloneFile(os.path.join(self.lpath, name), os.path.join(self.path, name))
+        return list(self.child.keys())
+
+    def listremotes(self):
+        rcd = self.rclone.rcd
+        if rcd is not None:
+            try:
+                return [[remote, True, -1, ''] for remote in rcd.listremotes()]
+            except RcdError as e:
+                log('rcd listremotes failed, fallback to cli:', e)
+        remotes = Shell.run('rclone listremotes').split(':\n')
+        return [[remote, True, -1, ''] for remote in remotes if len(remote)>0]
+
+    def lsjson(self):
+        # lsjson prints one entry per line, which lets us parse the listing
+        # while rclone is still producing it
+        for line in Shell.stream(['rclone', 'lsjson', '--max-depth', '1', self.path]):
+            line = line.strip().rstrip(',')
+            if line.startswith('{'):
+                e = json.loads(line)
+                yield [e['Name'], e['IsDir'], e.get('Size', -1), e.get('ModTime', '')]
+
+    def fetch_iter(self):
+        if self.path is None:
+            return iter(self.listremotes())
+
+        rcd = self.rclone.rcd
+        if rcd is not None:
+            try:
+                return iter([[e['Name'], e['IsDir'], e.get('Size', -1), e.get('ModTime', '')] for e in rcd.list(self.path)])
+            except RcdError as e:
+                log('rcd list failed, fallback to cli:', e)
+        return self.lsjson()
+
+    def fetch(self):
+        return list(self.fetch_iter())
+
+    def make_child(self, old, name, isdir, size, mtime):
+        # `old` is the node of the previous listing with the same name, reused
+        # when unchanged
+        if isdir:
+            if type(old) is RcloneDir:
+                return old
+            path = name+':/' if self.path is None else os.path.join(self.path, name)
+            return RcloneDir(os.path.join(self.lpath, name), path, self.rclone)
+        else:
+            if type(old) is RcloneFile and old.size == size and old.mtime == mtime:
+                return old
+            return RcloneFile(os.path.join(self.lpath, name), os.path.join(self.path, name), size, mtime)
+
+    def set_entries(self, entries):
+        child = {}
+        for entry in entries:
+            child[entry[0]] = self.make_child(self.child.get(entry[0]), *entry)
+        self.child = child
+
+    def ls_stream(self, chunk_size):
+        # Build children while the listing is being read and hand their names
+        # out in chunks, so that the first entries can be rendered before
+        # the whole (possibly huge) listing is fetched. The children go into
+        # a new dict, installed before the first chunk so that streamed
+        # entries can be looked up, which drops the entries gone from the
+        # remote. Entries are written to the meta cache as they come in.
+        self.cached = True
+        old = self.child
+        child = {}
+        with self.lock:
+            self.child = child
+        writer = self.rclone.meta.writer(self.meta_key)
+        chunk = []
+        try:
+            for entry in self.fetch_iter():
+                writer.add(entry)
+                child[entry[0]] = self.make_child(old.get(entry[0]), *entry)
+                chunk.append(entry[0])
+                if len(chunk) >= chunk_size:
+                    yield chunk
+                    chunk = []
+        except BaseException:
+            # failed, or the consumer stopped reading
+            writer.abort()
+            self.cached = False
+            raise
+        writer.commit()
+        yield chunk
+
+    def refresh(self):
+        entries = self.fetch()
+        self.rclone.meta.put(self.meta_key, entries)
+        self.set_entries(entries)
+        self.cached = True
+        return entries
+
+    def revalidate(self):
+        # The listing is fetched without holding the lock, only swapping the
+        # children is serialized with the other listings
+        with self.lock:
+            if self.revalidating:
+                return
+            self.revalidating = True
+
+        def job():
+            try:
+                entries = self.fetch()
+                self.rclone.meta.put(self.meta_key, entries)
+                with self.lock:
+                    old = sorted(self.child.keys())
+                    self.set_entries(entries)
+                    self.cached = True
+                    changed = sorted(self.child.keys()) != old
+                if changed:
+                    self.rclone.notify_change(self.lpath)
+            except Exception as e:
+                log('revalidate failed:', self.meta_key, e)
+            finally:
+                with self.lock:
+                    self.revalidating = False
+
+        threading.Thread(target=job, daemon=True).start()
 
     def ls(self):
-        if not self.cached:
-            self.cached = True
-            # files = Shell.run('rclone lsl --max-depth 1')
-            self.lsd()
-            self.lsl()
-            self.cached = True
-        return self.contentcache
+        expired = False
+        with self.lock:
+            if not self.cached:
+                meta = self.rclone.meta.get(self.meta_key)
+                if meta is None:
+                    self.refresh()
+                else:
+                    # stale-while-revalidate: render the cached listing now and
+                    # refetch in the background if it's older than its ttl
+                    fetch_time, entries = meta
+                    self.set_entries(entries)
+                    self.cached = True
+                    expired = self.rclone.meta.expired(self.meta_key, fetch_time)
+            names = self.contentcache
+        if expired:
+            self.revalidate()
+        return names
+
+    def invalidate(self):
+        if self.cached:
+            for child in self.child.values():
+                if type(child) is RcloneDir:
+                    child.invalidate()
+        self.rclone.meta.invalidate(self.meta_key)
+        self.cached = False
+
 
+class RClone(Backend):
+    remote = True
+    streaming = True
+    fetches = True
+    stat_from_listing = True
 
-class RClone(object):
-    def __init__(self, cache_dir):
+    def __init__(self, cache_dir, use_rcd=False, ttl=None, download_jobs=2, quota=1<<30,
+                 transfers=4, checkers=8, prefetch_jobs=2, prefetch_budget=100, meta=None):
+        Backend.__init__(self)
         if cache_dir[-1] == '/':
             cache_dir = cache_dir[:-1]
 
+        # The cli is used until rcd answers
+        self.rcd_client = None
+        if use_rcd:
+            try:
+                self.rcd_client = RcloneRcd()
+            except RcdError as e:
+                log('rclone rcd unavailable, fallback to cli:', e)
+
+        self.meta = MetaCache(cache_dir, ttl) if meta is None else meta
+        self.files = FileCache(cache_dir, quota)
+        self.downloader = Downloader(download_jobs, rcd=lambda: self.rcd)
+        self.prefetcher = Prefetcher(prefetch_jobs, prefetch_budget)
+        self.on_change = None
+        self.cache_dir = cache_dir
+        self.transfers = transfers
+        self.checkers = checkers
         self.rplen = len(cache_dir)+1
-        self.root_dir = RcloneDir(cache_dir, None)
+        Shell.mkdir(cache_dir)
+        self.root_dir = RcloneDir(cache_dir, None, self)
+        self.root_dir.ls()
+
+    def close(self):
+        self.prefetcher.shutdown()
+        self.downloader.stop()
+        self.files.save()
+        if self.rcd_client is not None:
+            self.rcd_client.stop()
+            self.rcd_client = None
+
+    @property
+    def rcd(self):
+        rcd = self.rcd_client
+        if rcd is not None and rcd.ready.is_set() and rcd.alive:
+            return rcd
+        return None
+
+    def notify_change(self, lpath):
+        if self.on_change is not None:
+            self.on_change(lpath)
+
+    def invalidate(self, dirname):
+        node = self.getNode(dirname)
+        if type(node) is RcloneDir:
+            node.invalidate()
 
     @property
     def has_remote(self):
         return len(self.root_dir.child)>0
 
-    def ftype(self, fname):
-        if os.path.islink(fname):
-            catlog = 'link'
-        elif os.path.isdir(fname):
-            catlog = 'dir'
-        elif os.access(fname, os.X_OK):
-            catlog = 'exe'
-        else:
-            catlog = 'file'
-        return catlog
+    def isdir(self, path):
+        try:
+            return type(self.getNode(path)) is RcloneDir
+        except KeyError:
+            return False
+
+    def stat_many(self, paths):
+        # Size and modtime come with the listing, remotes have no mode
+        res = {}
+        for path in paths:
+            try:
+                node = self.getNode(path)
+            except KeyError:
+                res[path] = None
+                continue
+            if type(node) is RcloneDir:
+                res[path] = (-1, 0, None)
+            else:
+                res[path] = (node.size, rclone_time(node.mtime), None)
+        return res
 
     def getNode(self, path):
         curNode = self.root_dir
@@ -163,16 +542,148 @@ class RClone(object):
             curNode = curNode.child[name]
         return curNode
 
+    def getDir(self, dirname):
+        node = self.getNode(dirname)
+        if type(node) is not RcloneDir:
+            raise NotADirectoryError(dirname)
+        return node
+
     def ls(self, dirname):
-        return self.getNode(dirname).ls()
+        return self.getDir(dirname).ls()
+
+    def list_with_attrs(self, dirname):
+        return self.attrs(dirname, self.ls(dirname))
+
+    def ls_stream(self, dirname, chunk_size=500):
+        node = self.getDir(dirname)
+        # Waits for a prefetch of this directory that is already running and
+        # keeps new ones from starting while streaming.
+        with node.lock:
+            streaming = not node.cached and self.meta.get(node.meta_key) is None
+            if streaming:
+                node.cached = True
+        if not streaming:
+            return iter([node.ls()])
+        return node.ls_stream(chunk_size)
+
+    def list_with_attrs_stream(self, dirname):
+        for names in self.ls_stream(dirname):
+            yield self.attrs(dirname, names)
+
+    def prefetch(self, dirname):
+        try:
+            node = self.getNode(dirname)
+        except KeyError:
+            return
+        if type(node) is RcloneDir and not node.cached:
+            self.prefetcher.prefetch(node.lpath, node.ls)
+
+    def download_async(self, fname, on_done=None):
+        def done(rfile, err):
+            if err is None:
+                self.files.add(rfile)
+            if on_done is not None:
+                on_done(rfile, err)
+        rfile = self.getNode(fname)
+        if not self.downloader.is_downloading(rfile.lpath):
+            self.files.miss(rfile)
+        self.downloader.download(rfile, done)
+
+    def is_fetched(self, fname):
+        return self.files.is_cached(self.getNode(fname))
+
+    def use_fetched(self, fname):
+        self.files.hit(self.getNode(fname))
+
+    def fetch_async(self, fname, on_done):
+        self.download_async(fname, lambda rfile, err: on_done(err))
+
+    def fetch_head(self, fname, count):
+        dst = os.path.join(self.cache_dir, '.head', fname[self.rplen:])
+        return Downloader.head(self.getNode(fname), dst, count)
+
+    def is_remote(self, path):
+        return path.startswith(self.cache_dir+'/')
+
+    def rpath(self, path):
+        # Local paths (e.g. pasted from a local buffer) are passed to rclone as is
+        if self.is_remote(path):
+            return self.getNode(path).path
+        return path
+
+    def invalidate_listing(self, dirname):
+        if self.is_remote(dirname) and self.isdir(dirname):
+            self.invalidate(dirname)
+
+    def run_transfer(self, op, src, dst, *args):
+        Shell.run_args(['rclone', op, src, dst,
+                        '--transfers', str(self.transfers),
+                        '--checkers', str(self.checkers)] + list(args))
+
+    def _transfer_many(self, op, srcs, dst):
+        dst_rpath = self.rpath(dst)
+        files = {}
+        for src in srcs:
+            src = src.rstrip('/')
+            parent, name = os.path.split(src)
+            if (self.isdir(src) if self.is_remote(src) else os.path.isdir(src)):
+                # --files-from doesn't recurse into directories, transfer
+                # each of them as a whole
+                if op == 'move':
+                    self.run_transfer(op, self.rpath(src), os.path.join(dst_rpath, name), '--delete-empty-src-dirs')
+                    try:
+                        Shell.run_args(['rclone', 'rmdir', self.rpath(src)])
+                    except Shell.CmdError:
+                        pass
+                else:
+                    self.run_transfer(op, self.rpath(src), os.path.join(dst_rpath, name))
+            else:
+                files.setdefault(parent, []).append(name)
+
+        # All files of the same source directory go in a single invocation
+        for parent, names in files.items():
+            with tempfile.NamedTemporaryFile('w', suffix='.files') as f:
+                f.write('\n'.join(names)+'\n')
+                f.flush()
+                self.run_transfer(op, self.rpath(parent), dst_rpath, '--files-from', f.name)
+
+        self.invalidate_listing(dst)
+        if op == 'move':
+            for src in srcs:
+                self.invalidate_listing(os.path.dirname(src.rstrip('/')))
+
+    def copy_many(self, srcs, dst):
+        self._transfer_many('copy', srcs, dst)
+
+    def move_many(self, srcs, dst):
+        self._transfer_many('move', srcs, dst)
+
+    def remove_many(self, targets, force=False):
+        files = {}
+        for target in targets:
+            target = target.rstrip('/')
+            if self.isdir(target):
+                Shell.run_args(['rclone', 'purge', self.rpath(target)])
+            else:
+                files.setdefault(os.path.dirname(target), []).append(os.path.basename(target))
+        for parent, names in files.items():
+            with tempfile.NamedTemporaryFile('w', suffix='.files') as f:
+                f.write('\n'.join(names)+'\n')
+                f.flush()
+                Shell.run_args(['rclone', 'delete', self.rpath(parent), '--files-from', f.name])
+        for parent in set(os.path.dirname(t.rstrip('/')) for t in targets):
+            self.invalidate_listing(parent)
 
-    def download(self, fname):
-        self.getNode(fname).download()
+    def mv(self, src, dst):
+        if self.isdir(dst):
+            self.move_many([src], dst)
+        else:
+            # rename
+            Shell.run_args(['rclone', 'moveto', self.rpath(src), os.path.join(self.rpath(os.path.dirname(dst)), os.path.basename(dst))])
+            self.invalidate_listing(os.path.dirname(dst))
 
-    def parent_dir(self, cwd):
-        if len(cwd) == self.rplen-1:
-            return cwd
-        return os.path.abspath(os.path.join(cwd, os.pardir))
+    def is_root(self, path):
+        return len(path) == self.rplen-1
 
     @classmethod
     def valid_or_install(cls, vim):
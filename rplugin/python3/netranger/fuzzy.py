@@ -0,0 +1,95 @@
+import heapq
+import threading
+import time
+from itertools import repeat
+from netranger.util import log
+
+log('')
+
+
+def score(query, name):
+    # Higher is better. Rewards matches at the beginning of the name or of a
+    # word and runs of consecutive matched characters, penalizes gaps.
+    pos = name.find(query)
+    if pos >= 0:
+        bonus = 100 if pos == 0 else (50 if not name[pos-1].isalnum() else 20)
+        return 1000 + bonus - len(name)
+
+    total = 0
+    prev = -1
+    for c in query:
+        pos = name.find(c, prev+1)
+        if pos < 0:
+            return -1
+        if pos == prev+1:
+            total += 15
+        elif pos == 0 or not name[pos-1].isalnum():
+            total += 10
+        else:
+            total -= min(pos-prev, 10)
+        prev = pos
+    return total - len(name)//4
+
+
+# Incremental fuzzy filter over a fixed list of names. The matches of each
+# query are cached together with the position right after the (leftmost)
+# match of every matched name, so that typing one more character only scans
+# the previous matches from there on, and deleting characters is free. The
+# positions of one character queries are recorded in the background, while
+# the next character is typed.
+class Filter(object):
+    RANK_LIMIT = 1000
+    CHUNK_SIZE = 4096
+
+    def __init__(self, names):
+        self.names = [n.lower() for n in names]
+        self.results = {'': (list(range(len(names))), None)}
+        self.recorders = {}
+
+    def match(self, query):
+        return self._match(query.lower())[0]
+
+    def _match(self, query):
+        if query in self.results:
+            return self.results[query]
+
+        prefix, c = query[:-1], query[-1]
+        candidates, nexts = self._match(prefix)
+        names = self.names
+        if len(prefix) == 0:
+            # Plain substring test is the cheapest scan of the whole listing
+            res = self.results[query] = ([i for i in candidates if c in names[i]], None)
+            recorder = threading.Thread(target=self._record_positions, args=(query, res[0]), daemon=True)
+            self.recorders[query] = recorder
+            recorder.start()
+            return res
+        else:
+            if nexts is None:
+                self.recorders[prefix].join()
+                candidates, nexts = self.results[prefix]
+            subnames = list(map(names.__getitem__, candidates))
+            pos = list(map(str.find, subnames, repeat(c), nexts))
+            res = ([i for i, p in zip(candidates, pos) if p >= 0],
+                   [p+1 for p in pos if p >= 0])
+        self.results[query] = res
+        return res
+
+    def _record_positions(self, query, matches):
+        # In chunks, letting the ui thread run in between
+        names = self.names
+        nexts = []
+        for i in range(0, len(matches), self.CHUNK_SIZE):
+            chunk = matches[i:i+self.CHUNK_SIZE]
+            nexts += [p+1 for p in map(str.find, map(names.__getitem__, chunk), repeat(query))]
+            time.sleep(0)
+        self.results[query] = (matches, nexts)
+
+    def top(self, query, k):
+        matches = self.match(query)
+        query = query.lower()
+        if len(query) == 0 or len(matches) > self.RANK_LIMIT:
+            # Too many matches to be worth ranking, keep the listing order
+            # until the query gets more selective.
+            return matches[:k]
+        names = self.names
+        return heapq.nlargest(k, matches, key=lambda i: score(query, names[i]))
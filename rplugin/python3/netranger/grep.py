@@ -0,0 +1,191 @@
+import os
+import fnmatch
+import mmap
+import re
+import threading
+from netranger.util import log, process_pool
+
+log('')
+
+SniffSize = 8192
+MmapThreshold = 1<<20
+MaxLineLength = 200
+
+_patterns = {}
+
+
+def compile_pattern(pattern):
+    # Smart case: ignore case unless the pattern has upper case characters
+    if pattern not in _patterns:
+        flags = 0 if pattern != pattern.lower() else re.IGNORECASE
+        _patterns[pattern] = re.compile(pattern.encode('utf-8'), flags | re.MULTILINE)
+    return _patterns[pattern]
+
+
+def search_data(regex, data, max_matches):
+    res = []
+    lineno = 1
+    counted = 0
+    pos = 0
+    while len(res) < max_matches:
+        m = regex.search(data, pos)
+        if m is None:
+            break
+        start = m.start()
+        lineno += data[counted:start].count(b'\n')
+        counted = start
+        line_start = data.rfind(b'\n', 0, start) + 1
+        line_end = data.find(b'\n', start)
+        if line_end < 0:
+            line_end = len(data)
+        line = data[line_start:min(line_end, line_start+MaxLineLength)]
+        res.append((lineno, line.decode('utf-8', 'replace').strip()))
+        # one match per line
+        pos = line_end + 1
+        if pos > len(data):
+            break
+    return res
+
+
+def search_file(regex, path, max_matches):
+    with open(path, 'rb') as f:
+        head = f.read(SniffSize)
+        if b'\0' in head:
+            return []
+        size = os.fstat(f.fileno()).st_size
+        if size < MmapThreshold:
+            return search_data(regex, head + f.read(), max_matches)
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            return search_data(regex, mm, max_matches)
+
+
+def search_files(pattern, paths, max_matches):
+    # Runs in a worker process, returns [(path, lineno, line)]
+    regex = compile_pattern(pattern)
+    res = []
+    for path in paths:
+        try:
+            for lineno, line in search_file(regex, path, max_matches-len(res)):
+                res.append((path, lineno, line))
+        except (OSError, ValueError):
+            continue
+        if len(res) >= max_matches:
+            break
+    return res
+
+
+# One content search over a set of files/directories. Files are found by a
+# walking thread (skipping hidden files unless `show_hidden` and names
+# matching `ignore`) and searched in batches by a pool of worker processes.
+# Matches are passed to on_matches(matches) as batches complete, then
+# on_done(cancelled) is called, both from background threads.
+class Search(object):
+    def __init__(self, pattern, roots, on_matches, on_done, ignore=(), show_hidden=False,
+                 max_jobs=4, batch_size=64, max_matches=10000):
+        # Raises re.error for an invalid pattern
+        compile_pattern(pattern)
+        self.pattern = pattern
+        self.roots = roots
+        self.on_matches = on_matches
+        self.on_done = on_done
+        self.ignore = ignore
+        self.show_hidden = show_hidden
+        self.batch_size = batch_size
+        self.max_matches = max_matches
+        self.executor = process_pool(max(max_jobs, 1), ['netranger.grep'])
+        self.lock = threading.Lock()
+        self.outstanding = 0
+        self.walking = True
+        self.num_matches = 0
+        self.cancelled = False
+        self.finished = False
+
+    def start(self):
+        threading.Thread(target=self.walk, daemon=True).start()
+
+    def cancel(self):
+        self.cancelled = True
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.finish()
+
+    def skip(self, name):
+        if not self.show_hidden and name[0] == '.':
+            return True
+        for ig in self.ignore:
+            if fnmatch.fnmatch(name, ig):
+                return True
+        return False
+
+    def walk(self):
+        batch = []
+        stack = []
+        for root in self.roots:
+            if os.path.isdir(root):
+                stack.append(root)
+            else:
+                batch.append(root)
+        try:
+            while len(stack) > 0 and not self.cancelled:
+                try:
+                    it = os.scandir(stack.pop())
+                except OSError:
+                    continue
+                with it:
+                    for entry in it:
+                        if self.skip(entry.name):
+                            continue
+                        try:
+                            if entry.is_dir(follow_symlinks=False):
+                                stack.append(entry.path)
+                            elif entry.is_file():
+                                batch.append(entry.path)
+                        except OSError:
+                            continue
+                        if len(batch) >= self.batch_size:
+                            self.submit(batch)
+                            batch = []
+            if len(batch) > 0 and not self.cancelled:
+                self.submit(batch)
+        except RuntimeError:
+            # executor shut down by cancel
+            pass
+        finally:
+            with self.lock:
+                self.walking = False
+                done = self.outstanding == 0
+            if done:
+                self.finish()
+
+    def submit(self, batch):
+        with self.lock:
+            self.outstanding += 1
+        future = self.executor.submit(search_files, self.pattern, batch, self.max_matches)
+        future.add_done_callback(self.on_batch_done)
+
+    def on_batch_done(self, future):
+        if not self.cancelled and not future.cancelled():
+            try:
+                matches = future.result()
+            except Exception as e:
+                log('grep batch failed:', e)
+                matches = []
+            with self.lock:
+                matches = matches[:self.max_matches-self.num_matches]
+                self.num_matches += len(matches)
+                if self.num_matches >= self.max_matches:
+                    self.cancelled = True
+            if len(matches) > 0:
+                self.on_matches(matches)
+        with self.lock:
+            self.outstanding -= 1
+            done = self.outstanding == 0 and not self.walking
+        if done:
+            self.finish()
+
+    def finish(self):
+        with self.lock:
+            if self.finished:
+                return
+            self.finished = True
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.on_done(self.cancelled)
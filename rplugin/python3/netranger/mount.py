@@ -0,0 +1,109 @@
+import os
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from netranger.util import log
+
+log('')
+
+LOCAL = 'local'
+NETWORK = 'network'
+FUSE = 'fuse'
+RCLONE = 'rclone'
+
+NETWORK_FSTYPES = set(['nfs', 'nfs4', 'cifs', 'smbfs', 'smb3', '9p', 'afs', 'ceph',
+                       'glusterfs', 'lustre', 'gpfs', 'ncpfs', 'coda', 'davfs'])
+
+
+def unescape(path):
+    # mountinfo escapes space, tab, newline and backslash as \ooo
+    return path.replace('\\040', ' ').replace('\\011', '\t').replace('\\012', '\n').replace('\\134', '\\')
+
+
+# Maps a path to the kind of filesystem it lives on, according to
+# /proc/self/mountinfo. Without mountinfo (non-Linux) everything is local.
+class MountTable(object):
+    def __init__(self, mountinfo='/proc/self/mountinfo', reload_interval=30):
+        self.mountinfo = mountinfo
+        self.reload_interval = reload_interval
+        self.mounts = []
+        self.load_time = 0
+
+    def load(self):
+        mounts = []
+        try:
+            with open(self.mountinfo, 'r') as f:
+                for line in f:
+                    pre, _, post = line.partition(' - ')
+                    pre = pre.split()
+                    post = post.split()
+                    if len(pre) < 5 or len(post) < 1:
+                        continue
+                    mounts.append((unescape(pre[4]), post[0]))
+        except OSError:
+            pass
+        # Longest mount point first so that the first match is the right one
+        self.mounts = sorted(mounts, key=lambda m: len(m[0]), reverse=True)
+        self.load_time = time.time()
+
+    def fstype(self, path):
+        if time.time() - self.load_time > self.reload_interval:
+            self.load()
+        for mountpoint, fstype in self.mounts:
+            if path == mountpoint or path.startswith(mountpoint.rstrip('/')+'/'):
+                return fstype
+        return ''
+
+    def classify(self, path):
+        fstype = self.fstype(path)
+        if fstype == 'fuse.rclone':
+            return RCLONE
+        if fstype.startswith('fuse') or fstype.endswith('sshfs'):
+            return FUSE
+        if fstype in NETWORK_FSTYPES:
+            return NETWORK
+        return LOCAL
+
+
+# Stats directories on slow mounts in worker threads. A caller waits at most
+# `timeout` seconds for the result; on timeout it gets the last known mtime
+# flagged as stale, and the path isn't checked again before an exponentially
+# growing backoff (capped at `max_backoff` seconds) has passed.
+class DirtyChecker(object):
+    def __init__(self, timeout=0.05, max_backoff=60, max_jobs=4):
+        self.timeout = timeout
+        self.max_backoff = max_backoff
+        self.executor = ThreadPoolExecutor(max_workers=max_jobs)
+        self.lock = threading.Lock()
+        self.state = {}
+
+    def mtime(self, path):
+        with self.lock:
+            st = self.state.get(path)
+            if st is None:
+                st = self.state[path] = {'future': None, 'next': 0, 'backoff': 0, 'mtime': None, 'stale': False}
+            if time.time() < st['next']:
+                return st['mtime'], st['stale']
+            if st['future'] is None:
+                st['future'] = self.executor.submit(os.stat, path)
+            future = st['future']
+
+        try:
+            mtime = future.result(self.timeout).st_mtime
+        except TimeoutError:
+            with self.lock:
+                st['backoff'] = min(max(st['backoff']*2, 1), self.max_backoff)
+                st['next'] = time.time() + st['backoff']
+                st['stale'] = True
+            return st['mtime'], True
+        except OSError as e:
+            log('dirty check failed:', path, e)
+            mtime = st['mtime']
+
+        with self.lock:
+            st['future'] = None
+            st['backoff'] = 0
+            st['next'] = 0
+            st['mtime'] = mtime
+            st['stale'] = False
+        return mtime, False
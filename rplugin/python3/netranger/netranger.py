@@ -1,12 +1,28 @@
 import os
 import fnmatch
+import re
+import stat
+import threading
+import time
 from neovim.api.nvim import NvimError
 from netranger.fs import FS, RClone
-from netranger.util import log, VimErrorMsg, Shell
+from netranger.util import log, VimErrorMsg, Shell, sizeof_fmt
 from netranger import default
 from netranger.colortbl import colortbl
-from netranger.ui import BookMarkUI, HelpUI
+from netranger.ui import BookMarkUI, HelpUI, PreviewUI, LocateUI, CompareUI
 from netranger.rifle import Rifle
+from netranger.prefetch import Prefetcher
+from netranger.preview import Previewer
+from netranger.fuzzy import Filter
+from netranger.pathindex import Locator
+from netranger.frecency import Frecency
+from netranger.du import DuEngine
+from netranger.vcs import VcsStatus
+from netranger.archive import ArchiveFS, ArchiveError, is_archive
+from netranger.compare import Comparer
+from netranger.grep import Search
+from netranger.session import Session
+from netranger.daemon import DaemonClient, SharedMetaCache
 from enum import Enum
 
 
@@ -56,6 +72,9 @@ class Node(object):
 class EntryNode(Node):
     def __init__(self, fullpath, name, ftype, level=0):
         self.fullpath = fullpath
+        # (size, mtime, mode) once fetched, () while being fetched or if it
+        # couldn't be
+        self.stat = None
         highlight = default.color[ftype]
         Node.__init__(self, name, highlight, level=level)
         self.ori_highlight = self.highlight
@@ -110,34 +129,167 @@ class EntryNode(Node):
 class DirNode(EntryNode):
     def __init__(self, fullpath, name, ftype, level=0):
         self.expanded = False
+        # (recursive size, done) once its computation started
+        self.du = None
         EntryNode.__init__(self, fullpath, name, ftype, level)
 
 
+def format_stat(st, du=None):
+    if not st:
+        return ''
+    size, mtime, mode = st
+    isdir = size < 0 or (mode is not None and stat.S_ISDIR(mode))
+    if du is not None:
+        # partial totals are marked until the whole tree is walked
+        size = sizeof_fmt(du[0]) + ('' if du[1] else '+')
+    else:
+        size = '-' if isdir else sizeof_fmt(size)
+    res = '{:>7} {:>16}'.format(size, time.strftime('%Y-%m-%d %H:%M', time.localtime(mtime)) if mtime > 0 else '-')
+    if mode is not None:
+        res += ' ' + stat.filemode(mode)
+    return res
+
+
+def node_size(node):
+    if node.isDir:
+        return node.du[0] if node.du else 0
+    return node.stat[0] if node.stat else 0
+
+
+DuResortInterval = 0.5
+
+# Variables read by pages, see NetRangerBuf.load_page_vars
+PageVars = ['NETRIgnore', 'NETRHiCWD']
+
+SortKeys = {
+    'name': lambda n: (not n.isDir, n.name),
+    'size': lambda n: (not n.isDir, -node_size(n), n.name),
+    'mtime': lambda n: (not n.isDir, -n.stat[1] if n.stat else 0, n.name),
+}
+
+
+def sort_nodes(nodes, key):
+    # Sort siblings only, expanded directories keep their children below them
+    groups = []
+    for node in nodes:
+        if len(groups)>0 and node.level > groups[-1][0].level:
+            groups[-1][1].append(node)
+        else:
+            groups.append((node, []))
+    groups.sort(key=lambda g: key(g[0]))
+    res = []
+    for node, children in groups:
+        res.append(node)
+        res += sort_nodes(children, key)
+    return res
+
+
 class Page(object):
-    def __init__(self, vim, cwd, fs, prevcwd=None):
+    def __init__(self, vim, cwd, fs, prevcwd=None, vimvars=None):
+        self.init_state(vim, cwd, fs, vimvars)
+        # Backends supporting it yield the listing in chunks. Only the first
+        # chunk is waited for here, the rest is appended by the buffer.
+        if fs.streaming:
+            self.pending = fs.list_with_attrs_stream(cwd)
+            self.nodes = self.createNodes(cwd, entries=next(self.pending, []))
+        else:
+            self.nodes = self.createNodes(cwd)
+        self.nodes.insert(0, Node(self.cwd, self.vimvars['NETRHiCWD']))
+        self.initClineNo(prevcwd)
+        self.nodes[self.clineNo].cursor_on()
+        self.mtime = fs.mtime(cwd)
+
+    def init_state(self, vim, cwd, fs, vimvars=None):
+        # Fields shared by all kinds of pages, before any node is built
         self.vim = vim
+        # Pages built outside of the main thread can't access vim, they get
+        # a snapshot of the variables they need.
+        self.vimvars = vim.vars if vimvars is None else vimvars
         self.cwd = cwd
         self.fs = fs
-        self.nodes = self.createNodes(cwd)
-        self.nodes.insert(0, Node(self.cwd, self.vim.vars['NETRHiCWD']))
-        self.initClineNo(prevcwd)
-        self.nodes[self.clineNo].cursor_on()
-        self.mtime = Shell.mtime(cwd)
+        self.sort_key = 'name'
+        self.show_info = False
+        self.show_du = False
+        self.vcs = None
+        self.width = 80
+        self.pending = None
+        self.nodes = []
+        self.clineNo = 0
+        self.mtime = 0
+        self.outdated = False
+        self.stale = False
 
-    def createNodes(self, cwd, level=0):
+    def createNodes(self, cwd, level=0, entries=None):
+        if entries is None:
+            entries = self.fs.list_with_attrs(cwd)
         nodes = []
-        for f in self.fs.ls(cwd):
+        for f, isdir, ftype, st in entries:
             shouldIgnore = False
-            for ig in self.vim.vars['NETRIgnore']:
+            for ig in self.vimvars['NETRIgnore']:
                 if fnmatch.fnmatch(f, ig):
                     shouldIgnore = True
                     break
             if not shouldIgnore:
                 fullpath = os.path.join(cwd, f)
-                if os.path.isdir(fullpath):
-                    nodes.append(DirNode(fullpath, f, self.fs.ftype(fullpath), level=level))
+                if isdir:
+                    node = DirNode(fullpath, f, ftype, level=level)
                 else:
-                    nodes.append(EntryNode(fullpath, f, self.fs.ftype(fullpath), level=level))
+                    node = EntryNode(fullpath, f, ftype, level=level)
+                if self.fs.stat_from_listing:
+                    node.stat = st or ()
+                nodes.append(node)
+        if self.sort_key != 'name':
+            self.fetch_stats(nodes)
+            nodes = sort_nodes(nodes, self.sort_key_fn)
+        return nodes
+
+    def fetch_stats(self, nodes):
+        nodes = [n for n in nodes if not n.isHeader and not n.stat]
+        if len(nodes) == 0:
+            return
+        stats = self.fs.stat_many([n.fullpath for n in nodes])
+        for node in nodes:
+            node.stat = stats.get(node.fullpath) or ()
+
+    @property
+    def sort_key_fn(self):
+        return SortKeys[self.sort_key]
+
+    def sort(self, key):
+        # Sorting by size/mtime needs the metadata of every entry, the cached
+        # ones are reused.
+        self.sort_key = key
+        if key != 'name':
+            self.fetch_stats(self.nodes)
+        curNode = self.curNode
+        self.nodes = self.nodes[:1] + sort_nodes(self.nodes[1:], self.sort_key_fn)
+        self.clineNo = self.nodes.index(curNode)
+
+    def line(self, node):
+        if node.isHeader:
+            return node.highlight_content
+        content = node.highlight_content
+        width = node.level*2 + len(node.name)
+        if self.vcs is not None:
+            code = self.vcs.status(node.fullpath)
+            if code is not None:
+                content += ' ' + code
+                width += 2
+        if not self.show_info:
+            return content
+        info = format_stat(node.stat, node.du if self.show_du and node.isDir else None)
+        pad = self.width - width - len(info)
+        return '{}{}{}'.format(content, ' '*max(pad, 1), info)
+
+    def append_entries(self, entries):
+        nodes = self.createNodes(self.cwd, entries=entries)
+        self.nodes += nodes
+        if self.sort_key != 'name':
+            self.sort(self.sort_key)
+        if self.clineNo == 0 and len(nodes)>0:
+            self.nodes[0].cursor_off()
+            self.initClineNo()
+            self.nodes[self.clineNo].cursor_on()
         return nodes
 
     def initClineNo(self, prevcwd=None):
@@ -160,9 +312,9 @@ class Page(object):
         self.nodes[self.clineNo].cursor_on()
         if type(lineNos) is list:
             for l in lineNos:
-                self.vim.current.buffer[l] = self.nodes[l].highlight_content
+                self.vim.current.buffer[l] = self.line(self.nodes[l])
         else:
-            self.vim.current.buffer[lineNos] = self.nodes[lineNos].highlight_content
+            self.vim.current.buffer[lineNos] = self.line(self.nodes[lineNos])
         self.vim.command('setlocal nomodifiable')
 
     def setClineNo(self, newLineNo):
@@ -180,7 +332,7 @@ class Page(object):
 
     @property
     def highlight_content(self):
-        return [n.highlight_content for n in self.nodes]
+        return [self.line(n) for n in self.nodes]
 
     @property
     def plain_content(self):
@@ -188,7 +340,20 @@ class Page(object):
 
     @property
     def is_dirty(self):
-        return Shell.mtime(self.cwd) > self.mtime
+        if self.outdated:
+            return True
+        mtime, stale = self.fs.dirty_mtime(self.cwd)
+        self.set_stale(stale)
+        return mtime is not None and mtime > self.mtime
+
+    def set_stale(self, stale):
+        # Mark the header when the listing could not be checked against the
+        # filesystem (e.g. hung network mount)
+        if stale == self.stale:
+            return False
+        self.stale = stale
+        self.nodes[0].name = self.cwd + (' [stale]' if stale else '')
+        return True
 
     def find_next_ind(self, ind, pred):
         beg_node = self.nodes[ind]
@@ -213,11 +378,35 @@ class Page(object):
         if curNode.expanded:
             endInd = self.next_lesseq_level_ind(self.clineNo)
             self.nodes = self.nodes[:self.clineNo+1] + self.nodes[endInd:]
+            curNode.expanded = False
         else:
-            newNodes = self.createNodes(self.curNode.fullpath, curNode.level+1)
-            if len(newNodes)>0:
-                self.nodes = self.nodes[:self.clineNo+1] + newNodes + self.nodes[self.clineNo+1:]
-        curNode.expanded = not curNode.expanded
+            self.expand_node(self.clineNo)
+
+    def expand_node(self, ind):
+        node = self.nodes[ind]
+        newNodes = self.createNodes(node.fullpath, node.level+1)
+        if len(newNodes)>0:
+            self.nodes = self.nodes[:ind+1] + newNodes + self.nodes[ind+1:]
+        node.expanded = True
+
+    def restore(self, expanded, cursor):
+        # Expand the directories in `expanded` (nested ones included) and put
+        # the cursor on the entry `cursor`, as saved in a session
+        ind = 1
+        while ind < len(self.nodes):
+            node = self.nodes[ind]
+            if node.isDir and not node.expanded and node.fullpath in expanded:
+                try:
+                    self.expand_node(ind)
+                except OSError as e:
+                    log('restore failed:', node.fullpath, e)
+            ind += 1
+        for ind, node in enumerate(self.nodes):
+            if not node.isHeader and node.fullpath == cursor:
+                self.nodes[self.clineNo].cursor_off()
+                self.clineNo = ind
+                node.cursor_on()
+                break
 
     def rename_nodes_from_content(self):
         curBuf = self.vim.current.buffer
@@ -225,21 +414,77 @@ class Page(object):
             curBuf[:] = self.highlight_content
             return False
         else:
+            renames = []
             for i, line in enumerate(curBuf):
                 line = line.strip()
                 if not self.nodes[i].isHeader and line != self.nodes[i].name:
                     oripath = self.nodes[i].rename(line)
-                    self.fs.mv(oripath, self.nodes[i].fullpath)
+                    renames.append((oripath, self.nodes[i].fullpath))
+            if len(renames)>0:
+                self.fs.rename_many(renames)
             curBuf[:] = self.highlight_content
             return True
 
 
+# Results of a content search: one entry per matching line, keyed in the
+# buffer's pages by `grep:<pattern>`. Matches are appended as they come in and
+# keep that order.
+class GrepPage(Page):
+    readonly = True
+
+    def __init__(self, vim, pattern, root, prevcwd, vimvars=None):
+        self.init_state(vim, 'grep:' + pattern, FS(), vimvars)
+        self.pattern = pattern
+        self.root = root
+        self.prevcwd = prevcwd
+        self.nodes = [Node('', self.vimvars['NETRHiCWD'])]
+        self.set_header('searching')
+
+    def set_header(self, status):
+        self.nodes[0].name = '{} /{}/ [{}]'.format(self.root, self.pattern, status)
+
+    def append_matches(self, matches):
+        nodes = []
+        for path, lineno, line in matches:
+            node = EntryNode(path, '{}:{}: {}'.format(os.path.relpath(path, self.root), lineno, line), 'file')
+            node.lineno = lineno
+            nodes.append(node)
+        self.nodes += nodes
+        if self.clineNo == 0 and len(nodes)>0:
+            self.clineNo = 1
+            self.nodes[1].cursor_on()
+        return nodes
+
+    def sort(self, key):
+        self.sort_key = key
+
+    @property
+    def is_dirty(self):
+        return False
+
+
+# Keys mapped in filter mode: printable characters are passed to
+# _NETRFilterInput by their code, the other keys by their name.
+FilterSpecialKeys = {' ': '<space>', '|': '<bar>', '\\': '<bslash>', '<': '<lt>'}
+FilterKeys = [(FilterSpecialKeys.get(chr(c), chr(c)), c) for c in range(32, 127)] + \
+    [('<bs>', "'BS'"), ('<cr>', "'CR'"), ('<esc>', "'Esc'"),
+     ('<down>', "'Down'"), ('<c-j>', "'Down'"), ('<up>', "'Up'"), ('<c-k>', "'Up'")]
+
+
 class NetRangerBuf(object):
-    def __init__(self, vim, keymaps, cwd, fs, rifle):
+    def __init__(self, vim, keymaps, cwd, fs, rifle, prefetcher=None, previewer=None, history=None, du=None, vcs=None):
         self.vim = vim
         self.fs = fs
         self.rifle = rifle
         self.keymaps = keymaps
+        self.prefetcher = prefetcher
+        self.previewer = previewer
+        self.history = history
+        self.du = du
+        self.show_du = False
+        self.du_resort_timer = None
+        self.vcs = vcs
+        self.show_vcs = vcs is not None and self.vim.vars['NETRGitStatus']
 
         self.pages = {}
         self.picked_lines = []
@@ -249,11 +494,22 @@ class NetRangerBuf(object):
         self.pinnedRoot = None
         self.source_page_wd = None
         self.isEditing = False
+        self.filter = None
+        self.search = None
+        # page states of a restored session, applied when the page is built
+        self.saved_pages = {}
+        self.show_info = self.vim.vars['NETRShowInfo']
+        self.sort_key = 'name'
+        # variables read by pages, shared by all of them and read again when
+        # the buffer is entered
+        self.page_vars = {}
+        self.load_page_vars()
 
         if self.vim.vars['NETRTabAutoToFirst']:
             self.vim.command('tabmove 0')
 
         self.cwd = None
+        self.buf = self.vim.current.buffer
         self.setBufOption()
         self.map_keys()
         self.set_cwd(cwd)
@@ -282,17 +538,109 @@ class NetRangerBuf(object):
         self.render_lock = True
         self.vim.command('setlocal modifiable')
 
-        self.vim.current.buffer[:] = self.curPage.highlight_content
-        self.vim.command('call cursor({}, 1)'.format(self.curPage.clineNo+1))
+        page = self.curPage
+        page.show_info = self.show_info
+        page.show_du = self.show_du
+        page.vcs = self.vcs if self.show_vcs else None
+        if page.vcs is not None and type(page) is not GrepPage:
+            page.vcs.update(page.cwd)
+        page.width = self.vim.current.window.width-1
+        if page.sort_key != self.sort_key:
+            page.sort(self.sort_key)
+        self.vim.current.buffer[:] = page.highlight_content
+        self.vim.command('call cursor({}, 1)'.format(page.clineNo+1))
 
         self.vim.command('setlocal nomodifiable')
         self.render_lock = False
+        self.fetch_visible_stats()
+        self.start_du()
+
+    def fetch_visible_stats(self):
+        # Metadata columns are only filled for the rows in the window, in a
+        # background thread since stat might be slow (e.g. network mounts)
+        page = self.curPage
+        if not page.show_info:
+            return
+        top, bot = self.vim.eval("[line('w0'), line('w$')]")
+        nodes = [n for n in page.nodes[top-1:bot] if not n.isHeader and n.stat is None]
+        if len(nodes) == 0:
+            return
+        for node in nodes:
+            node.stat = ()
+
+        def job():
+            try:
+                stats = self.fs.stat_many([n.fullpath for n in nodes])
+            except Exception as e:
+                log('stat failed:', page.cwd, e)
+                return
+            self.vim.async_call(self.on_stats_fetched, page, nodes, stats)
+
+        threading.Thread(target=job, daemon=True).start()
+
+    def on_stats_fetched(self, page, nodes, stats):
+        for node in nodes:
+            node.stat = stats.get(node.fullpath) or ()
+        self.refresh_nodes(page, nodes)
+
+    def start_du(self):
+        # Recursive sizes of all directories of the page are computed in the
+        # background and rendered as partial totals come in
+        page = self.curPage
+        if not page.show_du:
+            return
+        for node in page.nodes:
+            if node.isDir and node.du is None:
+                node.du = (0, False)
+                self.du.du(node.fullpath, lambda path, total, done, node=node:
+                           self.vim.async_call(self.on_du_progress, page, node, total, done))
+
+    def on_du_progress(self, page, node, total, done):
+        if node.du is None or node.du[1]:
+            return
+        node.du = (total, done)
+        self.refresh_nodes(page, [node])
+        # Pages sorted by size are re-sorted at most once per
+        # DuResortInterval, not for each finished directory
+        if done and page.sort_key == 'size' and self.du_resort_timer is None:
+            self.du_resort_timer = threading.Timer(DuResortInterval, self.vim.async_call,
+                                                   (self.on_du_resort, page))
+            self.du_resort_timer.daemon = True
+            self.du_resort_timer.start()
+
+    def on_du_resort(self, page):
+        self.du_resort_timer = None
+        if page.sort_key == 'size' and page is self.pages.get(self.cwd) \
+                and self.vim.current.buffer == self.buf and not self.isEditing and self.filter is None:
+            page.sort('size')
+            self.render()
+
+    def refresh_nodes(self, page, nodes):
+        if page is not self.pages.get(self.cwd) or self.isEditing or self.filter is not None:
+            return
+        if self.vim.current.buffer != self.buf:
+            return
+        nodes = set(nodes)
+        top, bot = self.vim.eval("[line('w0'), line('w$')]")
+        lineNos = [i for i in range(top-1, min(bot, len(page.nodes))) if page.nodes[i] in nodes]
+        if len(lineNos)>0:
+            self.render_lock = True
+            page.refresh_lines(lineNos)
+            self.render_lock = False
+
+    def load_page_vars(self):
+        self.page_vars.update({k: self.vim.vars[k] for k in PageVars})
 
     def update_dirty_pages(self):
         log('update')
+        if self.filter is not None:
+            return
+        stale = self.curPage.stale
         dirty_page_wds = [wd for wd, page in self.pages.items() if page.is_dirty]
         for wd in dirty_page_wds:
             self.refresh_page(wd)
+        if self.cwd not in dirty_page_wds and stale != self.curPage.stale:
+            self.curPage.refresh_lines(0)
 
     @property
     def curPage(self):
@@ -303,24 +651,33 @@ class NetRangerBuf(object):
         return self.curPage.curNode
 
     def set_cwd(self, cwd, isParentOfPrev=False):
-        if not os.path.isdir(cwd):
-            return
+        # Directories are told apart by listing them: the page is built
+        # before leaving the current one
+        page = self.pages.get(cwd)
+        if page is None or page.is_dirty:
+            if page is not None and self.show_vcs:
+                self.vcs.invalidate(cwd)
+            try:
+                page = Page(self.vim, cwd, self.fs, prevcwd=self.cwd if isParentOfPrev else None,
+                            vimvars=self.page_vars)
+            except (OSError, KeyError) as e:
+                log('failed to list:', cwd, e)
+                return
+            self.restore_page(page, cursor=not isParentOfPrev)
         self.finalizeCutCopy()
-
-        if cwd in self.pages and self.pages[cwd].is_dirty:
-            self.refresh_page(cwd)
-
-        if cwd not in self.pages:
-            if isParentOfPrev:
-                page = Page(self.vim, cwd, self.fs, prevcwd=self.cwd)
-            else:
-                page = Page(self.vim, cwd, self.fs)
-            self.pages[cwd] = page
+        if self.prefetcher is not None:
+            self.prefetcher.cancel()
+        if self.pages.get(cwd) is not page:
+            self.add_page(page)
 
         self.cwd = cwd
+        if self.history is not None:
+            self.history.record(cwd)
         self.set_buf_name(cwd)
         self.render()
-        self.vim.command('cd '+cwd)
+        # Remote directories are not materialized locally until needed
+        if self.fs.local:
+            self.vim.command('cd '+cwd)
 
     def set_buf_name(self, cwd):
         succ = False
@@ -341,63 +698,267 @@ class NetRangerBuf(object):
         if wd is None:
             wd = self.cwd
 
+        if type(self.pages.get(wd)) is GrepPage:
+            if wd == self.cwd:
+                self.render()
+            return
+        if self.show_vcs:
+            self.vcs.invalidate(wd)
         if wd == self.cwd:
             log('update cwd {}'.format(self.cwd))
-            self.pages[wd] = Page(self.vim, wd, self.fs)
+            self.new_page(wd)
             self.render()
         else:
             log('update {}'.format(wd))
             self.pages[wd] = None
             del self.pages[wd]
 
+    def new_page(self, cwd, prevcwd=None):
+        return self.add_page(Page(self.vim, cwd, self.fs, prevcwd=prevcwd, vimvars=self.page_vars))
+
+    def add_page(self, page):
+        self.pages[page.cwd] = page
+        if page.pending is not None:
+            self.stream_page(page)
+        return page
+
+    def stream_page(self, page):
+        pending, page.pending = page.pending, None
+
+        def job():
+            try:
+                for entries in pending:
+                    if len(entries)>0:
+                        self.vim.async_call(self.on_page_chunk, page, entries)
+            except Exception as e:
+                log('listing failed:', page.cwd, e)
+
+        threading.Thread(target=job, daemon=True).start()
+
+    def on_page_chunk(self, page, entries):
+        if self.pages.get(page.cwd) is not page:
+            return
+        clineNo = page.clineNo
+        nodes = page.append_entries(entries)
+        if page.cwd != self.cwd or self.isEditing or self.filter is not None:
+            return
+        self.render_lock = True
+        self.buf.options['modifiable'] = True
+        if clineNo != page.clineNo or page.sort_key != 'name':
+            self.buf[:] = page.highlight_content
+            if self.vim.current.buffer == self.buf:
+                self.vim.command('call cursor({}, 1)'.format(page.clineNo+1))
+        else:
+            self.buf.append([page.line(n) for n in nodes])
+        self.buf.options['modifiable'] = False
+        self.render_lock = False
+
+    def on_fs_change(self, wd, is_curbuf):
+        if wd not in self.pages:
+            return
+        if wd == self.cwd and is_curbuf and not self.isEditing and self.filter is None:
+            self.refresh_page()
+        else:
+            self.pages[wd].outdated = True
+
     def on_cursormoved(self):
-        if self.isEditing:
+        if self.isEditing or self.filter is not None:
             return
         if self.render_lock:
             return
         lineNo = self.vim.eval("line('.')") - 1
         self.curPage.setClineNo(lineNo)
+        self.fetch_visible_stats()
+        self.preview()
+        if self.fs.remote:
+            self.prefetch_visible()
+        elif self.prefetcher is not None:
+            self.prefetcher.touch()
+            self.prefetch_pages()
+
+    def preview(self):
+        if self.previewer is None or not self.previewer.enabled:
+            return
+        if self.curNode.isHeader:
+            self.previewer.cancel()
+        else:
+            self.previewer.schedule(self.curNode.fullpath, self.fs)
+
+    def prefetch_pages(self):
+        # Build the pages for `l` (directory under cursor) and `h` (parent
+        # directory) while the user is idle.
+        if type(self.curPage) is GrepPage:
+            return
+        node = self.curNode
+        if node.isDir:
+            self.prefetch_page(node.fullpath)
+        pdir = self.fs.parent_dir(self.cwd)
+        if pdir != self.cwd and self.cwd != self.pinnedRoot:
+            self.prefetch_page(pdir, prevcwd=self.cwd)
+
+    def prefetch_page(self, cwd, prevcwd=None):
+        key = (id(self), cwd)
+        if cwd in self.pages or self.prefetcher.is_queued(key):
+            return
+        def job():
+            page = Page(self.vim, cwd, self.fs, prevcwd=prevcwd, vimvars=self.page_vars)
+            self.vim.async_call(self.on_page_prefetched, page, prevcwd is None)
+
+        self.prefetcher.prefetch(key, job)
+
+    def on_page_prefetched(self, page, restore_cursor):
+        if page.cwd not in self.pages:
+            self.restore_page(page, cursor=restore_cursor)
+            self.pages[page.cwd] = page
+
+    def prefetch_visible(self):
+        # Start listing the directory under the cursor first, then the other
+        # directories visible in the window.
+        page = self.curPage
+        top, bottom = self.vim.eval("[line('w0'), line('w$')]")
+        if page.curNode.isDir:
+            self.fs.prefetch(page.curNode.fullpath)
+        for node in page.nodes[top-1:bottom]:
+            if node.isDir and node is not page.curNode:
+                self.fs.prefetch(node.fullpath)
 
     def NETROpen(self):
         if self.curNode.isHeader:
             return
-        fullpath = self.curNode.fullpath
         if self.curNode.isDir:
-            self.set_cwd(fullpath)
+            self.set_cwd(self.curNode.fullpath)
         else:
-            if type(self.fs) is RClone:
-                self.fs.download(fullpath)
-            cmd = self.rifle.decide_open_cmd(fullpath)
-            # TODO: fix white space in fullpath issue
-            if not cmd:
-                if self.vim.vars['NETROpenInBuffer']:
-                    self.vim.command('edit {}'.format(fullpath))
-                else:
-                    self.vim.command('tab drop {}'.format(fullpath))
+            lineno = getattr(self.curNode, 'lineno', None)
+            self.fetch_then([self.curNode.fullpath], lambda paths: self.open_file(paths[0], lineno=lineno))
+
+    def fetch_then(self, paths, fn):
+        # Files not available locally yet are fetched in the background, fn
+        # is called with the files available once all fetches are done
+        missing = []
+        for path in paths:
+            if not self.fs.fetches:
+                break
+            if self.fs.is_fetched(path):
+                self.fs.use_fetched(path)
             else:
-                Shell.spawn('{} {}'.format(cmd, fullpath))
+                missing.append(path)
+        if len(missing) == 0:
+            fn(paths)
+            return
+
+        pending = set(missing)
+        failed = set()
+
+        def on_fetched(path, err):
+            pending.discard(path)
+            if err is not None:
+                failed.add(path)
+                VimErrorMsg(self.vim, 'Failed to fetch {}: {}'.format(path, err))
+            if len(pending) == 0:
+                fetched = [p for p in paths if p not in failed]
+                if len(fetched) > 0:
+                    fn(fetched)
+
+        if len(missing) == 1:
+            self.vim.command('echo "Fetching {} in the background"'.format(os.path.basename(missing[0])))
+        else:
+            self.vim.command('echo "Fetching {} files in the background"'.format(len(missing)))
+        for path in missing:
+            self.fs.fetch_async(path, lambda err, path=path: self.vim.async_call(on_fetched, path, err))
+
+    def NETROpenPicked(self):
+        # Open all picked files, each external program being started once
+        # with all the files it opens
+        nodes = [self.curPage.nodes[i] for i in self.picked_lines]
+        if len(nodes) == 0:
+            self.NETROpen()
+            return
+        paths = [node.fullpath for node in nodes if not node.isDir]
+        for i in self.picked_lines:
+            self.curPage.nodes[i].reset_state()
+        self.curPage.refresh_lines(self.picked_lines)
+        self.picked_lines = []
+        if len(paths) > 0:
+            self.fetch_then(paths, self.open_files)
+
+    def open_files(self, paths):
+        cmds = {}
+        for path in paths:
+            cmd = self.rifle.decide_open_cmd(path)
+            if cmd:
+                cmds.setdefault(cmd, []).append(path)
+            else:
+                self.open_file(path, use_rifle=False)
+        for cmd, paths in cmds.items():
+            try:
+                Shell.spawn(cmd, paths)
+            except (OSError, ValueError) as e:
+                VimErrorMsg(self.vim, 'Failed to run {}: {}'.format(cmd, e))
+
+    def open_file(self, fullpath, use_rifle=True, lineno=None):
+        # Search results always open in vim, at the matching line
+        cmd = self.rifle.decide_open_cmd(fullpath) if use_rifle and lineno is None else None
+        if not cmd:
+            jump = '' if lineno is None else '+{} '.format(lineno)
+            fname = self.vim.call('fnameescape', fullpath)
+            if self.vim.vars['NETROpenInBuffer']:
+                self.vim.command('edit {}{}'.format(jump, fname))
+            else:
+                self.vim.command('tab drop {}{}'.format(jump, fname))
+        else:
+            try:
+                Shell.spawn(cmd, [fullpath])
+            except (OSError, ValueError) as e:
+                VimErrorMsg(self.vim, 'Failed to run {}: {}'.format(cmd, e))
+
+    def NETROpenHead(self):
+        if self.curNode.isHeader or self.curNode.isDir:
+            return
+        fullpath = self.curNode.fullpath
+        if self.fs.is_fetched(fullpath):
+            self.fs.use_fetched(fullpath)
+        else:
+            try:
+                fullpath = self.fs.fetch_head(fullpath, self.vim.vars['NETRHeadBytes'])
+            except Exception as e:
+                VimErrorMsg(self.vim, e)
+                return
+        self.open_file(fullpath, use_rifle=False)
 
     def NETRParentDir(self):
         log('open cwd: ', self.cwd)
         log(self.pages)
 
+        if type(self.curPage) is GrepPage:
+            self.set_cwd(self.curPage.prevcwd)
+            return
         if self.cwd == self.pinnedRoot:
             return
         pdir = self.fs.parent_dir(self.cwd)
         self.set_cwd(pdir, isParentOfPrev=True)
 
     def NETRVimCD(self):
-        curName = self.curNode.fullpath
-        if os.path.isdir(curName):
-            self.vim.command('cd {}'.format(curName))
+        if self.curNode.isHeader:
+            curName = self.cwd
+        elif self.curNode.isDir:
+            curName = self.curNode.fullpath
         else:
-            self.vim.command('cd {}'.format(os.path.dirname(curName)))
+            curName = os.path.dirname(self.curNode.fullpath)
+        Shell.mkdir(curName)
+        self.vim.command('cd {}'.format(curName))
 
     def NETRToggleExpand(self):
         self.curPage.toggle_expand()
         self.render()
 
+    @property
+    def readonly(self):
+        return self.fs.readonly or getattr(self.curPage, 'readonly', False)
+
     def NETREdit(self):
+        if self.readonly:
+            VimErrorMsg(self.vim, 'This directory is read-only.')
+            return
         self.isEditing = True
         self.vim.command('startinsert')
         for fn, keys in self.keymaps.items():
@@ -420,15 +981,233 @@ class NetRangerBuf(object):
         if not succ:
             VimErrorMsg(self.vim, 'Edit mode can not add/delete files!')
 
+    def NETRFilter(self):
+        nodes = self.curPage.nodes[1:]
+        if len(nodes) == 0:
+            return
+        for fn, keys in self.keymaps.items():
+            for k in keys:
+                self.vim.command("nunmap <buffer> {}".format(k))
+        for k, arg in FilterKeys:
+            self.vim.command("nnoremap <buffer> <silent> {} :call _NETRFilterInput({})<CR>".format(k, arg))
+        self.filter = Filter([n.name for n in nodes])
+        self.filter_nodes = nodes
+        self.filter_query = ''
+        self.filter_sel = 0
+        self.curNode.cursor_off()
+        self.render_filter()
+
+    def filter_input(self, key):
+        if self.filter is None:
+            return
+        if key == 'CR':
+            self.stop_filter(accept=True)
+            return
+        elif key == 'Esc':
+            self.stop_filter(accept=False)
+            return
+        elif key == 'Down':
+            self.filter_sel += 1
+        elif key == 'Up':
+            self.filter_sel = max(self.filter_sel-1, 0)
+        elif key == 'BS':
+            self.filter_query = self.filter_query[:-1]
+            self.filter_sel = 0
+        else:
+            self.filter_query += chr(key)
+            self.filter_sel = 0
+        self.render_filter()
+
+    def render_filter(self):
+        # Only the matches fitting in the window are ranked and drawn
+        height = max(self.vim.current.window.height-1, 1)
+        shown = self.filter.top(self.filter_query, height)
+        self.filter_sel = min(self.filter_sel, max(len(shown)-1, 0))
+        self.filter_shown = shown
+
+        header = Node('{} /{} [{}]'.format(self.cwd, self.filter_query, len(self.filter.match(self.filter_query))),
+                      self.page_vars['NETRHiCWD'])
+        content = [header.highlight_content]
+        for i, ind in enumerate(shown):
+            node = self.filter_nodes[ind]
+            if i == self.filter_sel:
+                node.cursor_on()
+                content.append(node.highlight_content)
+                node.cursor_off()
+            else:
+                content.append(node.highlight_content)
+
+        self.render_lock = True
+        self.vim.command('setlocal modifiable')
+        self.vim.current.buffer[:] = content
+        self.vim.command('call cursor({}, 1)'.format(self.filter_sel+2 if len(shown)>0 else 1))
+        self.vim.command('setlocal nomodifiable')
+        self.render_lock = False
+
+    def stop_filter(self, accept):
+        selected = None
+        if accept and len(self.filter_shown)>0:
+            selected = self.filter_nodes[self.filter_shown[self.filter_sel]]
+        self.filter = None
+        self.filter_nodes = None
+        self.filter_shown = None
+        for k, _ in FilterKeys:
+            self.vim.command("nunmap <buffer> {}".format(k))
+        self.map_keys()
+
+        page = self.curPage
+        if selected is not None and selected in page.nodes:
+            page.clineNo = page.nodes.index(selected)
+        page.nodes[page.clineNo].cursor_on()
+        self.render()
+
+    def jump_to(self, path):
+        if path == '':
+            return
+        if os.path.isdir(path):
+            self.set_cwd(path)
+            return
+        self.set_cwd(os.path.dirname(path))
+        name = os.path.basename(path)
+        for i, node in enumerate(self.curPage.nodes):
+            if not node.isHeader and node.level == 0 and node.name == name:
+                self.curPage.setClineNo(i)
+                self.vim.command('call cursor({}, 1)'.format(i+1))
+                break
+
+    def grep(self, pattern):
+        # Search the picked entries, or the cwd without any, into a results
+        # page. A search still running is cancelled.
+        if not self.fs.local:
+            VimErrorMsg(self.vim, 'Content search is only available for local directories.')
+            return
+        if self.search is not None:
+            self.search.cancel()
+        page = self.curPage
+        roots = [page.nodes[i].fullpath for i in self.picked_lines]
+        if len(roots) == 0:
+            roots = [page.root if type(page) is GrepPage else self.cwd]
+        root = os.path.commonpath(roots)
+        if not os.path.isdir(root):
+            root = os.path.dirname(root)
+
+        prevcwd = page.prevcwd if type(page) is GrepPage else self.cwd
+        self.finalizeCutCopy()
+        # Only the latest results are kept
+        self.pages = {wd: p for wd, p in self.pages.items() if type(p) is not GrepPage}
+        page = GrepPage(self.vim, pattern, root, prevcwd, self.page_vars)
+        try:
+            self.search = Search(pattern, roots,
+                                 lambda matches: self.vim.async_call(self.on_grep_matches, page, matches),
+                                 lambda cancelled: self.vim.async_call(self.on_grep_done, page, cancelled),
+                                 ignore=list(self.page_vars['NETRIgnore']), show_hidden=self.fs.show_hidden,
+                                 max_jobs=self.vim.vars['NETRGrepJobs'])
+        except re.error as e:
+            VimErrorMsg(self.vim, 'Invalid pattern {}: {}'.format(pattern, e))
+            self.search = None
+            return
+        self.pages[page.cwd] = page
+        self.cwd = page.cwd
+        self.set_buf_name('grep')
+        self.render()
+        self.search.start()
+
+    def on_grep_matches(self, page, matches):
+        if self.pages.get(page.cwd) is not page:
+            return
+        clineNo = page.clineNo
+        nodes = page.append_matches(matches)
+        if page.cwd != self.cwd or self.isEditing or self.filter is not None:
+            return
+        self.render_lock = True
+        self.buf.options['modifiable'] = True
+        self.buf.append([page.line(n) for n in nodes])
+        if clineNo != page.clineNo:
+            self.buf[clineNo] = page.line(page.nodes[clineNo])
+            self.buf[page.clineNo] = page.line(page.curNode)
+            if self.vim.current.buffer == self.buf:
+                self.vim.command('call cursor({}, 1)'.format(page.clineNo+1))
+        self.buf.options['modifiable'] = False
+        self.render_lock = False
+
+    def on_grep_done(self, page, cancelled):
+        page.set_header('{} matches{}'.format(len(page.nodes)-1, ', stopped' if cancelled else ''))
+        if page is not self.pages.get(self.cwd) or self.isEditing or self.filter is not None:
+            return
+        if self.vim.current.buffer != self.buf:
+            return
+        self.render_lock = True
+        page.refresh_lines(0)
+        self.render_lock = False
+
+    def snapshot(self):
+        # The expanded directories and cursor of every directory page, the
+        # saved ones not built since the restore included
+        cwd = self.curPage.prevcwd if type(self.curPage) is GrepPage else self.cwd
+        if cwd not in self.pages:
+            return None
+        pages = dict(self.saved_pages)
+        for wd, page in self.pages.items():
+            if type(page) is GrepPage:
+                continue
+            pages[wd] = {'expanded': [n.fullpath for n in page.nodes if n.isDir and n.expanded],
+                         'cursor': None if page.curNode.isHeader else page.curNode.fullpath}
+        return {'cwd': cwd, 'pinned': self.pinnedRoot, 'pages': pages}
+
+    def restore(self, state):
+        self.pinnedRoot = state['pinned']
+        self.saved_pages = dict(state['pages'])
+        self.restore_page(self.curPage)
+        self.render()
+
+    def restore_page(self, page, cursor=True):
+        saved = self.saved_pages.pop(page.cwd, None)
+        if saved is not None:
+            page.restore(set(saved['expanded']), saved['cursor'] if cursor else None)
+
     def NETRTogglePinRoot(self):
         if self.pinnedRoot is not None:
             self.pinnedRoot = None
         else:
             self.pinnedRoot = self.cwd
 
+    def NETRToggleShowInfo(self):
+        self.show_info = not self.show_info
+        self.render()
+
+    def NETRToggleDiskUsage(self):
+        if self.du is None:
+            VimErrorMsg(self.vim, 'Disk usage is only available for local directories.')
+            return
+        self.show_du = not self.show_du
+        if self.show_du:
+            self.show_info = True
+        else:
+            self.du.cancel()
+            for page in self.pages.values():
+                for node in page.nodes:
+                    if node.isDir and node.du is not None and not node.du[1]:
+                        node.du = None
+        self.render()
+
+    def NETRToggleGitStatus(self):
+        if self.vcs is None:
+            VimErrorMsg(self.vim, 'Git status is only available for local directories.')
+            return
+        self.show_vcs = not self.show_vcs
+        self.render()
+
+    def NETRToggleSort(self):
+        keys = list(SortKeys.keys())
+        self.sort_key = keys[(keys.index(self.sort_key)+1) % len(keys)]
+        self.render()
+        self.vim.command('echo "Sort by {}"'.format(self.sort_key))
+
     def NETRToggleShowHidden(self):
+        if self.prefetcher is not None:
+            self.prefetcher.cancel()
         self.fs.toggle_show_hidden()
-        self.pages = {}
+        self.pages = {wd: page for wd, page in self.pages.items() if type(page) is GrepPage}
         self.refresh_page()
 
     def NETRTogglePick(self):
@@ -477,16 +1256,43 @@ class NetRangerBuf(object):
         self.cut_lines = []
         self.copy_lines = []
 
+    @property
+    def has_pending_paste(self):
+        return len(self.cut_path)+len(self.copy_path)+len(self.cut_lines)+len(self.copy_lines)>0
+
+    def take_register(self):
+        # Hand over cut/copied paths to another buffer. This buffer is not the
+        # current one, so its page is only marked outdated instead of being
+        # re-rendered.
+        page = self.curPage
+        cut_path = self.cut_path + [page.nodes[i].fullpath for i in self.cut_lines]
+        copy_path = self.copy_path + [page.nodes[i].fullpath for i in self.copy_lines]
+        for i in self.picked_lines + self.cut_lines + self.copy_lines:
+            page.nodes[i].reset_state()
+        page.outdated = True
+        if self.source_page_wd in self.pages:
+            self.pages[self.source_page_wd].outdated = True
+
+        self.picked_lines = []
+        self.cut_path, self.copy_path = [], []
+        self.cut_lines, self.copy_lines = [], []
+        self.source_page_wd = None
+        return cut_path, copy_path
+
     def NETRPaste(self):
         if len(self.copy_path)<len(self.copy_lines) or len(self.cut_path)< len(self.cut_lines):
             self.finalizeCutCopy()
+        self.paste(self.cut_path, self.copy_path, self.fs)
 
+    def paste(self, cut_path, copy_path, fs):
+        if self.readonly:
+            VimErrorMsg(self.vim, 'This directory is read-only.')
+            return
         try:
-            for path in self.cut_path:
-                self.fs.mv(path, self.cwd)
-
-            for path in self.copy_path:
-                self.fs.cp(path, self.cwd)
+            if len(cut_path)>0:
+                fs.move_many(cut_path, self.cwd)
+            if len(copy_path)>0:
+                fs.copy_many(copy_path, self.cwd)
         except Exception as e:
             VimErrorMsg(self.vim, e)
 
@@ -497,26 +1303,32 @@ class NetRangerBuf(object):
         if self.source_page_wd is not None:
             del self.pages[self.source_page_wd]
         self.refresh_page(self.source_page_wd)
+        self.source_page_wd = None
         self.refresh_page()
         self.render()
 
-    def NETRDelete(self):
-        for i in self.picked_lines:
-            self.fs.rm(self.curPage.nodes[i].fullpath)
+    def _delete(self, force):
+        if self.readonly:
+            VimErrorMsg(self.vim, 'This directory is read-only.')
+            self.picked_lines = []
+            return
+        try:
+            self.fs.remove_many([self.curPage.nodes[i].fullpath for i in self.picked_lines], force=force)
+        except Exception as e:
+            VimErrorMsg(self.vim, e)
         self.picked_lines = []
         self.refresh_page()
         self.render()
 
+    def NETRDelete(self):
+        self._delete(force=False)
+
     def NETRDeleteSingle(self):
         self.picked_lines.append(self.curPage.clineNo)
         self.NETRDelete()
 
     def NETRForceDelete(self):
-        for i in self.picked_lines:
-            self.fs.rmf(self.curPage.nodes[i].fullpath)
-        self.picked_lines = []
-        self.refresh_page()
-        self.render()
+        self._delete(force=True)
 
     def NETRForceDeleteSingle(self):
         self.picked_lines.append(self.curPage.clineNo)
@@ -547,11 +1359,32 @@ class Netranger(object):
         self.rclone = None
         self.bookmarkUI = None
         self.helpUI = None
+        self.locateUI = None
+        self.compareUI = None
+        self.locate_query = None
         self.isEditing = False
         self.onuiquit = None
         self.onuiquitNumArgs = 0
         Shell.mkdir(default.variables['NETRRootDir'])
         self.rifle = Rifle(self.vim, self.vim.vars['NETRRifleFile'])
+        self.prefetcher = Prefetcher(self.vim.vars['NETRPrefetchJobs'], None,
+                                     self.vim.vars['NETRPrefetchIdle']/1000.0)
+        self.previewer = Previewer(self.vim, PreviewUI(self.vim),
+                                   self.vim.vars['NETRPreviewDelay']/1000.0,
+                                   self.vim.vars['NETRPreviewBytes'])
+        self.history = Frecency(self.vim.vars['NETRFrecencyFile'])
+        self.du = DuEngine(self.vim.vars['NETRDuJobs'])
+        self.vcs = VcsStatus(self.on_vcs_update)
+        self.archive = ArchiveFS(os.path.join(self.vim.vars['NETRRootDir'], 'archive'))
+        self.comparer = Comparer(os.path.join(self.vim.vars['NETRRootDir'], 'hashes'),
+                                 self.vim.vars['NETRCompareJobs'])
+        self.locator = Locator(os.path.join(self.vim.vars['NETRRootDir'], 'index'),
+                               list(self.vim.vars['NETRIgnore']))
+        self.session = Session(self.vim.vars['NETRSessionFile'])
+        self.daemon = None
+        if self.vim.vars['NETRDaemon']:
+            self.daemon = DaemonClient(os.path.join(self.vim.vars['NETRRootDir'], 'daemon.sock'))
+            FS.daemon = self.daemon
 
     def initVimVariables(self):
         for k,v in default.variables.items():
@@ -588,20 +1421,44 @@ class Netranger(object):
                 self.vim.command('setlocal buftype=nofile')
 
                 if(bufname.startswith(self.vim.vars['NETRCacheDir'])):
-                    self.bufs[bufnum] = NetRangerBuf(self.vim, self.keymaps, os.path.abspath(bufname), self.rclone, self.rifle)
+                    self.bufs[bufnum] = NetRangerBuf(self.vim, self.keymaps, os.path.abspath(bufname), self.rclone, self.rifle, previewer=self.previewer)
+                elif self.archive.owns(os.path.abspath(bufname)):
+                    self.bufs[bufnum] = NetRangerBuf(self.vim, self.keymaps, os.path.abspath(bufname), self.archive, self.rifle, previewer=self.previewer)
                 else:
-                    self.bufs[bufnum] = NetRangerBuf(self.vim, self.keymaps, os.path.abspath(bufname), FS(), self.rifle)
+                    self.bufs[bufnum] = NetRangerBuf(self.vim, self.keymaps, os.path.abspath(bufname), FS(), self.rifle, self.prefetcher, self.previewer, self.history, self.du, self.vcs)
+                    state = self.session.take(self.bufs[bufnum].cwd)
+                    if state is not None:
+                        self.bufs[bufnum].restore(state)
         else:
+            self.curBuf.load_page_vars()
             self.curBuf.update_dirty_pages()
             if self.onuiquit is not None:
-                if len(self.vim.vars['_NETRRegister']) == self.onuiquitNumArgs:
-                    if type(self.onuiquit) is str:
-                        getattr(self.curBuf, self.onuiquit)(*self.vim.vars['_NETRRegister'])
-                    else:
-                        self.onuiquit(*self.vim.vars['_NETRRegister'])
+                # reset first, the callback might enter another buffer
+                fn, numArgs, args = self.onuiquit, self.onuiquitNumArgs, self.vim.vars['_NETRRegister']
                 self.onuiquit = None
                 self.vim.vars['_NETRRegister'] = []
                 self.onuiquitNumArgs = 0
+                if len(args) == numArgs:
+                    if type(fn) is str:
+                        getattr(self.curBuf, fn)(*args)
+                    else:
+                        fn(*args)
+
+    def on_vimleave(self):
+        if not self.inited:
+            return
+        self.prefetcher.shutdown()
+        self.du.shutdown()
+        for buf in self.bufs.values():
+            if buf.search is not None:
+                buf.search.cancel()
+        states = [buf.snapshot() for buf in self.bufs.values() if buf.fs.local]
+        self.session.save([state for state in states if state is not None])
+        self.history.flush()
+        if self.rclone is not None:
+            self.rclone.close()
+        if self.daemon is not None:
+            self.daemon.close()
 
     def pend_onuiquit(self, fn, numArgs=0):
         self.onuiquit = fn
@@ -629,11 +1486,73 @@ class Netranger(object):
 
     def invoke_map(self, fn):
         log('invoke_map', fn)
+        if self.inited:
+            self.prefetcher.touch()
         if hasattr(self, fn):
             getattr(self, fn)()
         else:
             getattr(self.curBuf, fn)()
 
+    def filter_input(self, key):
+        if self.isInNETRBuf:
+            self.prefetcher.touch()
+            self.curBuf.filter_input(key)
+
+    def NETROpen(self):
+        # Archives are opened as directories in a new netranger buffer
+        curBuf = self.curBuf
+        node = curBuf.curNode
+        if node.isHeader or node.isDir or not curBuf.fs.local or not is_archive(node.fullpath):
+            curBuf.NETROpen()
+            return
+        try:
+            root = self.archive.open(node.fullpath)
+        except ArchiveError as e:
+            VimErrorMsg(self.vim, e)
+            return
+        root = self.vim.call('fnameescape', root)
+        if self.vim.vars['NETROpenInBuffer']:
+            self.vim.command('edit {}'.format(root))
+        else:
+            self.vim.command('tabe {}'.format(root))
+
+    def NETRParentDir(self):
+        # At the root of an archive, go back to the directory containing it
+        curBuf = self.curBuf
+        path = self.archive.source(curBuf.cwd) if curBuf.fs is self.archive else None
+        if path is None or curBuf.cwd == curBuf.pinnedRoot or not self.archive.is_root(curBuf.cwd):
+            curBuf.NETRParentDir()
+            return
+        self.vim.command('edit {}'.format(self.vim.call('fnameescape', os.path.dirname(path))))
+        if self.isInNETRBuf:
+            self.curBuf.jump_to(path)
+
+    def NETRPaste(self):
+        curBuf = self.curBuf
+        if not curBuf.has_pending_paste:
+            # Paste entries cut/copied in another buffer, e.g. from a local
+            # buffer into a remote one. Transfers involving a remote go
+            # through rclone in one batch.
+            for buf in self.bufs.values():
+                if buf is not curBuf and buf.has_pending_paste:
+                    cut_path, copy_path = buf.take_register()
+                    if buf.fs.readonly and len(cut_path) > 0:
+                        VimErrorMsg(self.vim, 'Cannot move entries out of a read-only directory.')
+                        return
+                    if buf.fs is self.archive:
+                        # Copied archive members are extracted first
+                        try:
+                            self.archive.extract_many(copy_path)
+                        except (ArchiveError, KeyError) as e:
+                            VimErrorMsg(self.vim, e)
+                            return
+                    fs = curBuf.fs
+                    if self.rclone is not None and self.rclone in (buf.fs, curBuf.fs):
+                        fs = self.rclone
+                    curBuf.paste(cut_path, copy_path, fs)
+                    return
+        curBuf.NETRPaste()
+
     def _NETRBookmarkSet(self, mark):
         self.bookmarkUI._set(mark)
 
@@ -657,13 +1576,212 @@ class Netranger(object):
         else:
             self.helpUI.show()
 
+    def NETRTogglePinRoot(self):
+        curBuf = self.curBuf
+        curBuf.NETRTogglePinRoot()
+        if curBuf.pinnedRoot is not None and curBuf.fs is not self.rclone:
+            self.locator.refresh([curBuf.pinnedRoot])
+
+    def locate_roots(self):
+        # The pinned root of the current buffer and the directories bookmarked
+        # by the user (not the '/' placeholder of a new bookmark file)
+        roots = []
+        if self.isInNETRBuf and self.curBuf.pinnedRoot is not None and self.curBuf.fs.local:
+            roots.append(self.curBuf.pinnedRoot)
+        if self.bookmarkUI is None:
+            self.bookmarkUI = BookMarkUI(self.vim, self)
+        for mark, path in self.bookmarkUI.mark_dict.items():
+            if mark in self.bookmarkUI.valid_mark and os.path.isdir(path) and path not in roots:
+                roots.append(path)
+        return roots
+
+    def locate(self, query):
+        if not self.isInNETRBuf:
+            VimErrorMsg(self.vim, 'Only applicable in a netranger buffer.')
+            return
+        roots = self.locate_roots()
+        if len(roots) == 0:
+            VimErrorMsg(self.vim, 'Pin a root (zp) or bookmark a directory to locate files.')
+            return
+
+        # Results come from the current index, which is brought up to date in
+        # the background. A query without results is rerun once it's done.
+        self.locator.refresh(roots, self.on_index_refreshed)
+        res = self.locator.query(roots, query)
+        if len(res) == 0 and self.locator.is_scanning(roots):
+            self.locate_query = query
+            self.vim.command('echo "Indexing, results will show up when done."')
+            return
+        self.show_locate_results(res)
+
+    def on_index_refreshed(self, index, changed):
+        self.vim.async_call(self._on_index_refreshed)
+
+    def _on_index_refreshed(self):
+        if self.locate_query is None:
+            return
+        roots = self.locate_roots()
+        if self.locator.is_scanning(roots):
+            return
+        query, self.locate_query = self.locate_query, None
+        res = self.locator.query(roots, query)
+        if len(res) == 0:
+            self.vim.command('echo "No match for {}"'.format(query.replace('"', '\\"')))
+            return
+        self.show_locate_results(res)
+
+    def jump_to(self, path):
+        # Located and visited paths are local, they are opened in a local
+        # buffer from remote and archive buffers
+        if not self.curBuf.fs.local:
+            dirname = path if os.path.isdir(path) else os.path.dirname(path)
+            self.vim.command('edit {}'.format(self.vim.call('fnameescape', dirname)))
+            if not self.isInNETRBuf:
+                return
+        self.curBuf.jump_to(path)
+
+    def jump(self, query):
+        # Jump straight to the best match of the query, or list all visited
+        # directories by frecency without one.
+        if not self.isInNETRBuf:
+            VimErrorMsg(self.vim, 'Only applicable in a netranger buffer.')
+            return
+        if len(query.strip()) == 0:
+            self.show_locate_results(self.history.query())
+            return
+        for path in self.history.query(query):
+            if path == self.curBuf.cwd:
+                continue
+            if os.path.isdir(path):
+                self.jump_to(path)
+                return
+            self.history.forget(path)
+        VimErrorMsg(self.vim, 'No visited directory matches {}'.format(query))
+
+    def compare(self, other):
+        # Compare the cwd of the current buffer with `other`, or with the cwd
+        # of another netranger buffer in the current tab
+        if not self.isInNETRBuf:
+            VimErrorMsg(self.vim, 'Only applicable in a netranger buffer.')
+            return
+        curBuf = self.curBuf
+        if len(other) > 0:
+            right, rfs = os.path.abspath(os.path.expanduser(other)), FS()
+            if not os.path.isdir(right):
+                VimErrorMsg(self.vim, '{} is not a directory'.format(other))
+                return
+        else:
+            bufs = [self.bufs[w.buffer.number] for w in self.vim.current.tabpage.windows
+                    if w.buffer.number in self.bufs and self.bufs[w.buffer.number] is not curBuf]
+            if len(bufs) == 0:
+                VimErrorMsg(self.vim, 'Open another netranger buffer in this tab or pass a directory.')
+                return
+            right, rfs = bufs[0].cwd, bufs[0].fs
+
+        left = curBuf.cwd
+        self.vim.command('echo "Comparing {} and {}"'.format(left, right))
+        self.comparer.compare_async(left, curBuf.fs, right, rfs,
+                                    lambda rows, err: self.vim.async_call(self.on_compared, left, right, rows, err))
+
+    def on_compared(self, left, right, rows, err):
+        if err is not None:
+            VimErrorMsg(self.vim, 'Compare failed: {}'.format(err))
+            return
+        if self.compareUI is None:
+            self.compareUI = CompareUI(self.vim)
+        self.compareUI.show_rows(left, right, rows)
+
+    def grep(self, pattern):
+        if not self.isInNETRBuf:
+            VimErrorMsg(self.vim, 'Only applicable in a netranger buffer.')
+            return
+        if len(pattern) == 0:
+            VimErrorMsg(self.vim, 'Usage: NETRGrep {pattern}')
+            return
+        self.curBuf.grep(pattern)
+
+    def show_locate_results(self, res):
+        if self.locateUI is None:
+            self.locateUI = LocateUI(self.vim, self)
+        self.locateUI.show_results(res)
+
+    def NETRTogglePreview(self):
+        if self.previewer.enabled:
+            self.previewer.cancel()
+            self.previewer.ui.close()
+        else:
+            self.previewer.ui.open()
+            self.curBuf.preview()
+
     def valid_rclone_or_install(self):
         if self.rclone is not None:
             return
         RClone.valid_or_install(self.vim)
 
         self.vim.vars['NETRCacheDir'] = os.path.expanduser(self.vim.vars['NETRCacheDir'])
-        self.rclone = RClone(self.vim.vars['NETRCacheDir'])
+        self.rclone = RClone(self.vim.vars['NETRCacheDir'],
+                             self.vim.vars['NETRRcloneRcd'],
+                             self.vim.vars['NETRRemoteCacheTTL'],
+                             self.vim.vars['NETRDownloadJobs'],
+                             self.vim.vars['NETRCacheQuota'],
+                             self.vim.vars['NETRRcloneTransfers'],
+                             self.vim.vars['NETRRcloneCheckers'],
+                             self.vim.vars['NETRPrefetchJobs'],
+                             self.vim.vars['NETRPrefetchBudget'],
+                             self.remote_meta())
+        self.rclone.on_change = lambda lpath: self.vim.async_call(self.on_remote_change, lpath)
+        self.rclone.downloader.on_progress = lambda rfile, received: self.vim.async_call(self.on_download_progress, rfile, received)
+
+    def on_vcs_update(self, root):
+        self.vim.async_call(self._on_vcs_update, root)
+
+    def _on_vcs_update(self, root):
+        if not self.isInNETRBuf:
+            return
+        curBuf = self.curBuf
+        if curBuf.show_vcs and not curBuf.isEditing and curBuf.filter is None \
+                and (curBuf.cwd+'/').startswith(root.rstrip('/')+'/'):
+            curBuf.render()
+
+    def on_bufwrite(self, path):
+        if self.inited:
+            self.vcs.invalidate(path)
+
+    def on_download_progress(self, rfile, received):
+        if rfile.size > 0:
+            self.vim.command('echo "Downloading {}: {}%"'.format(os.path.basename(rfile.lpath), received*100//rfile.size))
+        else:
+            self.vim.command('echo "Downloading {}: {} bytes"'.format(os.path.basename(rfile.lpath), received))
+
+    def on_remote_change(self, lpath):
+        curBuf = self.bufs.get(self.vim.current.buffer.number)
+        for buf in self.bufs.values():
+            if buf.fs is self.rclone:
+                buf.on_fs_change(lpath, buf is curBuf)
+
+    def cache_stats(self):
+        self.valid_rclone_or_install()
+        self.vim.command('echo "{}"'.format(self.rclone.files.report()))
+
+    def refresh_remote(self):
+        if not self.isInNETRBuf or self.curBuf.fs is not self.rclone:
+            VimErrorMsg(self.vim, 'Only applicable in a remote netranger buffer.')
+            return
+        cwd = self.curBuf.cwd
+        self.rclone.invalidate(cwd)
+        for buf in self.bufs.values():
+            if buf.fs is not self.rclone:
+                continue
+            for wd in list(buf.pages.keys()):
+                if wd == cwd or wd.startswith(cwd+'/'):
+                    buf.on_fs_change(wd, buf is self.curBuf)
+
+    def remote_meta(self):
+        # Remote listings are shared through the daemon if enabled
+        if self.daemon is None:
+            return None
+        cache_dir = self.vim.vars['NETRCacheDir'].rstrip('/')
+        return SharedMetaCache(self.daemon, cache_dir, self.vim.vars['NETRRemoteCacheTTL'])
 
     def listremotes(self):
         self.valid_rclone_or_install()
@@ -0,0 +1,194 @@
+import os
+import fnmatch
+import hashlib
+import pickle
+import threading
+from array import array
+from netranger.util import Shell, log
+
+log('')
+
+
+def trigrams(s):
+    return set(s[i:i+3] for i in range(len(s)-2))
+
+
+# A locate-like index of all paths under `root`, stored in a single file under
+# `index_dir`. It keeps the sorted list of paths (relative to root), the
+# trigram postings of their lowercased names and, for the incremental scan,
+# the mtime and entries of every directory: a directory is only listed again
+# when its mtime changed since the last scan. Mount points below root are
+# indexed but not entered.
+class PathIndex(object):
+    def __init__(self, index_dir, root, ignore=()):
+        self.root = root
+        self.ignore = ignore
+        self.fname = os.path.join(index_dir, hashlib.sha1(root.encode('utf-8', 'surrogateescape')).hexdigest())
+        self.lock = threading.Lock()
+        self.paths = []
+        self.postings = {}
+        self.dirs = {}
+        self.loaded = False
+        self.scanning = False
+
+    def load(self):
+        try:
+            with open(self.fname, 'rb') as f:
+                data = pickle.load(f)
+            if data['root'] == self.root:
+                with self.lock:
+                    self.paths, self.postings, self.dirs = data['paths'], data['postings'], data['dirs']
+        except (OSError, ValueError, KeyError, EOFError, pickle.UnpicklingError) as e:
+            log('path index not loaded:', self.root, e)
+        self.loaded = True
+
+    def save(self):
+        tmp = '{}.{}.tmp'.format(self.fname, os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                pickle.dump({'root': self.root, 'paths': self.paths, 'postings': self.postings,
+                             'dirs': self.dirs}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.fname)
+        except OSError as e:
+            log('failed to write path index:', self.root, e)
+
+    def ignored(self, name):
+        for ig in self.ignore:
+            if fnmatch.fnmatch(name, ig):
+                return True
+        return False
+
+    def scan(self):
+        dirs = {}
+        changed = False
+        stack = ['']
+        root_dev = None
+        while stack:
+            rel = stack.pop()
+            try:
+                st = os.stat(os.path.join(self.root, rel))
+            except OSError:
+                changed = True
+                continue
+            mtime = st.st_mtime
+            if root_dev is None:
+                root_dev = st.st_dev
+
+            entry = self.dirs.get(rel)
+            if st.st_dev != root_dev:
+                if entry != (mtime, [], []):
+                    changed = True
+                entry = (mtime, [], [])
+            elif entry is None or entry[0] != mtime:
+                changed = True
+                subdirs, files = [], []
+                try:
+                    with os.scandir(os.path.join(self.root, rel)) as it:
+                        for e in it:
+                            if self.ignored(e.name):
+                                continue
+                            if e.is_dir(follow_symlinks=False):
+                                subdirs.append(e.name)
+                            else:
+                                files.append(e.name)
+                except OSError as e:
+                    log('path index scan failed:', rel, e)
+                entry = (mtime, subdirs, files)
+            dirs[rel] = entry
+            stack.extend(os.path.join(rel, d) for d in entry[1])
+
+        if not changed and len(dirs) == len(self.dirs):
+            return False
+
+        paths = sorted(os.path.join(rel, name) for rel, (_, subdirs, files) in dirs.items()
+                       for name in subdirs+files)
+        postings = {}
+        for i, path in enumerate(paths):
+            for t in trigrams(os.path.basename(path).lower()):
+                if t not in postings:
+                    postings[t] = array('I')
+                postings[t].append(i)
+
+        with self.lock:
+            self.paths, self.postings, self.dirs = paths, postings, dirs
+        self.save()
+        return True
+
+    def refresh_async(self, on_done=None):
+        if self.scanning:
+            return
+        self.scanning = True
+
+        def job():
+            changed = False
+            try:
+                if not self.loaded:
+                    self.load()
+                changed = self.scan()
+            except Exception as e:
+                log('path index refresh failed:', self.root, e)
+            finally:
+                self.scanning = False
+            if on_done is not None:
+                on_done(self, changed)
+
+        threading.Thread(target=job, daemon=True).start()
+
+    def query(self, query, limit=1000):
+        # The part of the last term after its last '/' must appear in the
+        # entry name, every term must appear in the path (case insensitive).
+        terms = query.lower().split()
+        if len(terms) == 0:
+            return []
+        name = terms[-1].rsplit('/', 1)[-1]
+        with self.lock:
+            paths, postings = self.paths, self.postings
+
+        if len(name) >= 3:
+            # The shortest posting list is small enough to be verified directly
+            candidates = min((postings.get(t, ()) for t in trigrams(name)), key=len)
+        else:
+            candidates = range(len(paths))
+
+        res = []
+        for i in candidates:
+            path = paths[i]
+            lpath = path.lower()
+            if name in os.path.basename(lpath) and all(t in lpath for t in terms):
+                res.append(os.path.join(self.root, path))
+                if len(res) >= limit:
+                    break
+        return res
+
+
+# Keeps one PathIndex per root directory.
+class Locator(object):
+    def __init__(self, index_dir, ignore=()):
+        self.index_dir = index_dir
+        self.ignore = ignore
+        self.indexes = {}
+        Shell.mkdir(index_dir)
+
+    def index(self, root):
+        if root not in self.indexes:
+            self.indexes[root] = PathIndex(self.index_dir, root, self.ignore)
+        return self.indexes[root]
+
+    def refresh(self, roots, on_done=None):
+        for root in roots:
+            self.index(root).refresh_async(on_done)
+
+    def is_scanning(self, roots):
+        return any(self.index(root).scanning for root in roots)
+
+    def query(self, roots, query, limit=1000):
+        res = []
+        seen = set()
+        for root in roots:
+            for path in self.index(root).query(query, limit):
+                if path not in seen:
+                    seen.add(path)
+                    res.append(path)
+            if len(res) >= limit:
+                break
+        return res[:limit]
@@ -0,0 +1,65 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from netranger.util import log
+
+log('')
+
+
+# Runs listing jobs in the background ahead of navigation. At most `max_jobs`
+# jobs run concurrently, a key is never queued twice at the same time and at
+# most `budget` (None for unlimited) jobs are run per session. Jobs only start
+# once there was no user activity (see `touch`) for `idle` seconds, and
+# `cancel` drops all jobs that haven't started yet.
+class Prefetcher(object):
+    def __init__(self, max_jobs=2, budget=100, idle=0):
+        self.executor = ThreadPoolExecutor(max_workers=max(max_jobs, 1))
+        self.budget = budget
+        self.idle = idle
+        self.queued = set()
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.last_activity = 0
+
+    def touch(self):
+        self.last_activity = time.time()
+
+    def cancel(self):
+        with self.lock:
+            self.generation += 1
+            self.queued = set()
+
+    def is_queued(self, key):
+        return key in self.queued
+
+    def prefetch(self, key, fn):
+        with self.lock:
+            if key in self.queued or (self.budget is not None and self.budget <= 0):
+                return False
+            self.queued.add(key)
+            generation = self.generation
+        self.executor.submit(self._run, key, fn, generation)
+        return True
+
+    def _run(self, key, fn, generation):
+        while True:
+            wait = self.last_activity + self.idle - time.time()
+            if wait <= 0 or generation != self.generation:
+                break
+            time.sleep(wait)
+
+        with self.lock:
+            if generation != self.generation:
+                return
+            if self.budget is not None:
+                self.budget -= 1
+        try:
+            fn()
+        except Exception as e:
+            log('prefetch failed:', key, e)
+        finally:
+            with self.lock:
+                self.queued.discard(key)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
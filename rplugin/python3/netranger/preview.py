@@ -0,0 +1,100 @@
+import os
+import threading
+from collections import OrderedDict
+from netranger.util import log, sizeof_fmt
+
+log('')
+
+
+def read_head(path, nbytes):
+    # Bounded read, no matter how large the file is
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        return os.pread(fd, nbytes, 0)
+    finally:
+        os.close(fd)
+
+
+def is_binary(data):
+    return b'\0' in data[:8192]
+
+
+# Shows the head of the file (or the listing of the directory) under the cursor
+# in a preview window. Loading is debounced by `delay` seconds and done in a
+# timer thread; a load whose cursor position was left in the meantime is
+# dropped. Results are kept in a small LRU keyed by (path, mtime, size).
+class Previewer(object):
+    def __init__(self, vim, ui, delay=0.1, nbytes=16384, cache_size=64):
+        self.vim = vim
+        self.ui = ui
+        self.delay = delay
+        self.nbytes = nbytes
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.lock = threading.Lock()
+        self.generation = 0
+        self.timer = None
+
+    @property
+    def enabled(self):
+        return self.ui.is_open
+
+    def schedule(self, path, fs):
+        self.generation += 1
+        if self.timer is not None:
+            self.timer.cancel()
+        self.timer = threading.Timer(self.delay, self._load, (self.generation, path, fs))
+        self.timer.daemon = True
+        self.timer.start()
+
+    def cancel(self):
+        self.generation += 1
+        if self.timer is not None:
+            self.timer.cancel()
+
+    def _load(self, generation, path, fs):
+        if generation != self.generation:
+            return
+        try:
+            content = self.get(path, fs)
+        except Exception as e:
+            content = ['{}'.format(e)]
+        if generation == self.generation:
+            self.vim.async_call(self._show, generation, content)
+
+    def get(self, path, fs):
+        try:
+            st = os.stat(path)
+        except OSError:
+            # e.g. remote entries that are not downloaded yet
+            return ['(not available locally)']
+
+        key = (path, st.st_mtime, st.st_size)
+        with self.lock:
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                return self.cache[key]
+
+        content = self.render(path, fs, st)
+        with self.lock:
+            self.cache[key] = content
+            if len(self.cache) > self.cache_size:
+                self.cache.popitem(last=False)
+        return content
+
+    def render(self, path, fs, st):
+        if os.path.isdir(path):
+            return [name + ('/' if isdir else '') for name, isdir, _, _ in fs.list_with_attrs(path)]
+        data = read_head(path, self.nbytes)
+        if is_binary(data):
+            return ['(binary file, {})'.format(sizeof_fmt(st.st_size))]
+        lines = data.decode('utf-8', 'replace').splitlines()
+        if st.st_size > len(data) and len(lines) > 1:
+            # the last line is probably cut
+            lines = lines[:-1]
+        return lines
+
+    def _show(self, generation, content):
+        if generation != self.generation or not self.ui.is_open:
+            return
+        self.ui.set_content(content)
@@ -0,0 +1,164 @@
+import base64
+import http.client
+import json
+import os
+import secrets
+import socket
+import subprocess
+import time
+import threading
+from netranger.util import log
+
+log('')
+
+
+class RcdError(Exception):
+    pass
+
+
+# 'remote:/a/b' -> ('remote:', 'a/b') as expected by the rc API
+def split_remote(path):
+    ind = path.find(':')
+    return path[:ind+1], path[ind+1:].strip('/')
+
+
+# Client of a `rclone rcd` daemon started once per neovim session. Requests
+# go through a small pool of keep-alive connections so that listing and
+# downloading don't pay rclone's start-up and authentication on every call.
+# The daemon is started in the background, `ready` is set once it answers.
+# Other local users can reach its port, so it requires a (user, password)
+# generated at start, passed to rclone through its environment rather than
+# its command line.
+class RcloneRcd(object):
+    def __init__(self, host='127.0.0.1', port=None, pool_size=4, start=True, auth=None):
+        self.host = host
+        self.port = port
+        self.auth = auth
+        self.proc = None
+        self.pool = []
+        self.pool_size = pool_size
+        self.pool_lock = threading.Lock()
+        self.ready = threading.Event()
+        if start:
+            self.start()
+        else:
+            self.ready.set()
+
+    @classmethod
+    def free_port(cls, host):
+        s = socket.socket()
+        s.bind((host, 0))
+        port = s.getsockname()[1]
+        s.close()
+        return port
+
+    def start(self, timeout=5):
+        if self.port is None:
+            self.port = RcloneRcd.free_port(self.host)
+        self.auth = (secrets.token_hex(8), secrets.token_urlsafe(24))
+        env = dict(os.environ, RCLONE_RC_USER=self.auth[0], RCLONE_RC_PASS=self.auth[1])
+        try:
+            self.proc = subprocess.Popen(['rclone', 'rcd',
+                                          '--rc-addr', '{}:{}'.format(self.host, self.port)],
+                                         env=env,
+                                         stdin=subprocess.DEVNULL,
+                                         stdout=subprocess.DEVNULL,
+                                         stderr=subprocess.DEVNULL)
+        except OSError as e:
+            raise RcdError(str(e))
+        threading.Thread(target=self.wait_ready, args=(self.proc, timeout), daemon=True).start()
+
+    def wait_ready(self, proc, timeout):
+        deadline = time.time() + timeout
+        while time.time() < deadline and proc is self.proc:
+            if proc.poll() is not None:
+                log('rclone rcd exited with code {}'.format(proc.returncode))
+                return
+            try:
+                self.call('rc/noop')
+                self.ready.set()
+                return
+            except RcdError:
+                time.sleep(0.05)
+        log('rclone rcd did not respond in {} seconds'.format(timeout))
+        if proc is self.proc:
+            self.stop()
+
+    def stop(self):
+        if self.proc is not None and self.proc.poll() is None:
+            try:
+                self.call('core/quit')
+            except RcdError:
+                pass
+            try:
+                self.proc.wait(1)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        self.proc = None
+        self.ready.clear()
+        with self.pool_lock:
+            for conn in self.pool:
+                conn.close()
+            self.pool = []
+
+    @property
+    def alive(self):
+        return self.proc is None or self.proc.poll() is None
+
+    def _acquire(self):
+        with self.pool_lock:
+            if len(self.pool)>0:
+                return self.pool.pop()
+        return http.client.HTTPConnection(self.host, self.port, timeout=60)
+
+    def _release(self, conn):
+        with self.pool_lock:
+            if len(self.pool)<self.pool_size:
+                self.pool.append(conn)
+                return
+        conn.close()
+
+    def call(self, method, **params):
+        body = json.dumps(params)
+        headers = {'Content-Type': 'application/json'}
+        if self.auth is not None:
+            token = base64.b64encode('{}:{}'.format(*self.auth).encode('utf-8')).decode('ascii')
+            headers['Authorization'] = 'Basic ' + token
+        # A pooled connection might have been closed by the server since its
+        # last use. Retry once on a fresh connection in that case.
+        for trial in range(2):
+            conn = self._acquire()
+            try:
+                conn.request('POST', '/'+method, body, headers)
+                resp = conn.getresponse()
+                data = resp.read()
+            except (OSError, http.client.HTTPException) as e:
+                conn.close()
+                if trial == 1:
+                    raise RcdError('{}: {}'.format(method, e))
+                continue
+
+            self._release(conn)
+            try:
+                res = json.loads(data.decode('utf-8')) if len(data)>0 else {}
+            except ValueError:
+                raise RcdError('{}: invalid response'.format(method))
+            if resp.status != 200:
+                raise RcdError('{}: {}'.format(method, res.get('error', resp.status)))
+            return res
+
+    def listremotes(self):
+        return self.call('config/listremotes').get('remotes') or []
+
+    def list(self, path):
+        fs, remote = split_remote(path)
+        res = self.call('operations/list', fs=fs, remote=remote)
+        if 'list' not in res:
+            raise RcdError('operations/list: invalid response')
+        return res['list']
+
+    def copyfile(self, src, dst):
+        # src is a remote path, dst a local path
+        fs, remote = split_remote(src)
+        self.call('operations/copyfile', srcFs=fs, srcRemote=remote,
+                  dstFs='/', dstRemote=dst.lstrip('/'))
@@ -0,0 +1,223 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from netranger.util import Shell, log, sizeof_fmt
+
+log('')
+
+
+# On-disk cache of remote directory listings. Each listed directory is stored
+# in its own file (named by the hash of its remote path) together with the
+# time it was fetched, so that the listing survives across sessions and can be
+# checked against a per-remote time-to-live.
+class MetaCache(object):
+    def __init__(self, cache_dir, ttl=None):
+        self.meta_dir = os.path.join(cache_dir, '.meta')
+        Shell.mkdir(self.meta_dir)
+        if ttl is None:
+            ttl = {}
+        self.ttl = ttl
+
+    def fname(self, path):
+        return os.path.join(self.meta_dir, hashlib.sha1(path.encode('utf-8')).hexdigest())
+
+    def get(self, path):
+        try:
+            with open(self.fname(path), 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if meta.get('path') != path:
+            return None
+        return meta['time'], meta['entries']
+
+    def put(self, path, entries):
+        writer = self.writer(path)
+        for entry in entries:
+            writer.add(entry)
+        writer.commit()
+
+    def writer(self, path):
+        return MetaWriter(self, path)
+
+    def invalidate(self, path):
+        try:
+            os.remove(self.fname(path))
+        except OSError:
+            pass
+
+    def ttl_of(self, path):
+        remote = path.split(':')[0]
+        return self.ttl.get(remote, self.ttl.get('*', 0))
+
+    def expired(self, path, fetch_time):
+        return time.time() - fetch_time > self.ttl_of(path)
+
+
+# Writes the listing of `path` into the meta cache entry by entry, so that a
+# streamed listing doesn't have to be kept in memory to be cached. The entry
+# is only replaced on commit.
+class MetaWriter(object):
+    def __init__(self, meta, path):
+        self.path = path
+        self.fname = meta.fname(path)
+        self.tmp = '{}.{}.{}.tmp'.format(self.fname, os.getpid(), threading.get_ident())
+        self.sep = ''
+        self.f = None
+        try:
+            self.f = open(self.tmp, 'w')
+            self.f.write('{{"path": {}, "time": {}, "entries": ['.format(json.dumps(path), time.time()))
+        except OSError as e:
+            log('failed to write meta cache:', path, e)
+            self.abort()
+
+    def add(self, entry):
+        if self.f is None:
+            return
+        try:
+            self.f.write(self.sep + json.dumps(entry))
+            self.sep = ', '
+        except OSError as e:
+            log('failed to write meta cache:', self.path, e)
+            self.abort()
+
+    def commit(self):
+        if self.f is None:
+            return
+        try:
+            self.f.write(']}')
+            self.f.close()
+            self.f = None
+            os.replace(self.tmp, self.fname)
+        except OSError as e:
+            log('failed to write meta cache:', self.path, e)
+            self.abort()
+
+    def abort(self):
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+        try:
+            os.remove(self.tmp)
+        except OSError:
+            pass
+
+
+# Tracks the files materialized in the local cache directory (local size, last
+# access time and the remote size/modtime they were downloaded from). Copies of
+# an older remote version are dropped when the file is downloaded again, and
+# the least recently used files are evicted once the total size exceeds
+# `quota` bytes. The index is written at most every `save_interval` seconds
+# and on close.
+class FileCache(object):
+    def __init__(self, cache_dir, quota=1<<30, save_interval=30):
+        self.index_file = os.path.join(cache_dir, '.meta', 'files')
+        self.quota = quota
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        self.files = {}
+        self.total_size = 0
+        self.stats = {'hits': 0, 'misses': 0, 'bytes_saved': 0, 'evicted': 0}
+        self.dirty = False
+        self.last_save = time.time()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.index_file, 'r') as f:
+                data = json.load(f)
+            self.files = data['files']
+            self.stats.update(data['stats'])
+        except (OSError, ValueError, KeyError):
+            pass
+        self.total_size = sum(info[0] for info in self.files.values())
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            data = json.dumps({'files': self.files, 'stats': self.stats})
+            self.dirty = False
+            self.last_save = time.time()
+        tmp = '{}.{}.tmp'.format(self.index_file, os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                f.write(data)
+            os.replace(tmp, self.index_file)
+        except OSError as e:
+            log('failed to write file cache index:', e)
+
+    def save_later(self):
+        if time.time() - self.last_save > self.save_interval:
+            self.save()
+
+    def is_cached(self, rfile):
+        info = self.files.get(rfile.lpath)
+        return info is not None and info[2] == rfile.size and info[3] == rfile.mtime \
+            and os.path.isfile(rfile.lpath)
+
+    def hit(self, rfile):
+        # The cached copy is used instead of downloading the file
+        with self.lock:
+            info = self.files.get(rfile.lpath)
+            if info is None:
+                return
+            info[1] = time.time()
+            self.stats['hits'] += 1
+            self.stats['bytes_saved'] += info[0]
+            self.dirty = True
+        self.save_later()
+
+    def miss(self, rfile):
+        # The file is being downloaded, a copy of an older remote version is
+        # dropped
+        with self.lock:
+            self.stats['misses'] += 1
+            self.dirty = True
+            if rfile.lpath in self.files:
+                self._drop(rfile.lpath)
+
+    def add(self, rfile):
+        try:
+            size = os.path.getsize(rfile.lpath)
+        except OSError:
+            return
+        with self.lock:
+            if rfile.lpath in self.files:
+                self.total_size -= self.files[rfile.lpath][0]
+            self.files[rfile.lpath] = [size, time.time(), rfile.size, rfile.mtime]
+            self.total_size += size
+            self._evict(keep=rfile.lpath)
+            self.dirty = True
+        self.save_later()
+
+    def _evict(self, keep):
+        if self.total_size <= self.quota:
+            return
+        for lpath, info in sorted(self.files.items(), key=lambda kv: kv[1][1]):
+            if self.total_size <= self.quota:
+                break
+            if lpath == keep:
+                continue
+            self._drop(lpath)
+            self.stats['evicted'] += 1
+
+    def _drop(self, lpath):
+        self.total_size -= self.files.pop(lpath)[0]
+        self._remove(lpath)
+
+    def _remove(self, lpath):
+        try:
+            os.remove(lpath)
+        except OSError:
+            pass
+
+    def report(self):
+        hits, misses = self.stats['hits'], self.stats['misses']
+        rate = 100*hits//(hits+misses) if hits+misses>0 else 0
+        return 'hits: {} misses: {} hit rate: {}% saved: {} evicted: {} cached: {} files, {}/{}'.format(
+            hits, misses, rate, sizeof_fmt(self.stats['bytes_saved']), self.stats['evicted'],
+            len(self.files), sizeof_fmt(self.total_size), sizeof_fmt(self.quota))
+
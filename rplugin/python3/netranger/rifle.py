@@ -9,29 +9,95 @@ class Rule(object):
     def __init__(self, arg):
         self.arg = arg
 
-    def __call__(self, fname):
+    def __call__(self, fname, ctx):
         pass
 
 
 class ext(Rule):
-    def __call__(self, fname):
-        return re.search(self.arg, fname) is not None
+    def __init__(self, arg):
+        Rule.__init__(self, arg)
+        self.regex = re.compile(arg)
+        # Plain alternatives of literal extensions (e.g. "mp4|mkv") are
+        # looked up from the rule index instead of being matched
+        parts = arg.split('|')
+        if all(re.match(r'^\w+$', p) for p in parts):
+            self.exts = parts
+        else:
+            self.exts = None
+
+    def __call__(self, fname, ctx):
+        if self.exts is not None:
+            return ctx.ext in self.exts
+        return self.regex.search(fname) is not None
 
 
 class has(Rule):
-    def __call__(self, fname):
-        return Shell.isinPATH(self.arg)
+    def __call__(self, fname, ctx):
+        return ctx.exes.has(self.arg)
+
+
+# Results of looking up executables in $PATH. Dropped when $PATH or the
+# mtime of one of its directories changes (something got (un)installed).
+class ExeCache(object):
+    def __init__(self):
+        self.path = None
+        self.mtimes = None
+        self.found = {}
+
+    def validate(self):
+        path = os.environ.get('PATH', '')
+        mtimes = []
+        for d in path.split(os.pathsep):
+            try:
+                mtimes.append(os.stat(d).st_mtime)
+            except OSError:
+                mtimes.append(None)
+        if path != self.path or mtimes != self.mtimes:
+            self.path = path
+            self.mtimes = mtimes
+            self.found = {}
+
+    def has(self, exe):
+        if exe not in self.found:
+            self.found[exe] = Shell.isinPATH(exe)
+        return self.found[exe]
+
+
+class Context(object):
+    def __init__(self, fname, exes):
+        base = os.path.basename(fname)
+        self.ext = base[base.rfind('.')+1:] if '.' in base else None
+        self.exes = exes
 
 
+# rifle.conf compiled into rules indexed by extension: rules whose `ext` test
+# is a literal extension are only tried for files having it, the other rules
+# for every file. The file is compiled again when its mtime changes.
 class Rifle(object):
     def __init__(self, vim, path):
         self.vim = vim
-        self.rules = []
+        self.path = path
+        self.mtime = None
+        self.exes = ExeCache()
 
         if not os.path.isfile(path):
             Shell.cp('{}/../../../config/rifle.conf'.format(os.path.dirname(__file__)), path)
+        self.reload()
+
+    def reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime == self.mtime:
+            return
+        self.mtime = mtime
+        self.rules = []
+        self.by_ext = {}
+        self.generic = []
+        self.candidates = {}
 
-        with open(path, 'r') as f:
+        with open(self.path, 'r') as f:
             for i, line in enumerate(f):
                 line = line.strip()
                 if len(line)==0 or line[0] == '#':
@@ -42,17 +108,41 @@ class Rifle(object):
                     continue
 
                 tests = []
-                for test in sp[0].strip().split(','):
-                    testSp = [e for e in test.split(' ') if e!='']
-                    tests.append(globals()[testSp[0]](testSp[1]))
-                command = sp[1].strip()
-                self.rules.append((tests, command))
+                try:
+                    for test in sp[0].strip().split(','):
+                        testSp = [e for e in test.split(' ') if e!='']
+                        tests.append(globals()[testSp[0]](testSp[1]))
+                except (KeyError, IndexError, re.error):
+                    VimErrorMsg(self.vim, 'invalid rule: rifle.conf line {}'.format(i+1))
+                    continue
+                # cheap extension tests first
+                tests.sort(key=lambda t: type(t) is not ext)
+                self.add_rule(tests, sp[1].strip())
+
+    def add_rule(self, tests, command):
+        ind = len(self.rules)
+        self.rules.append((tests, command))
+        exts = None
+        for test in tests:
+            if type(test) is ext and test.exts is not None:
+                exts = test.exts if exts is None else [e for e in exts if e in test.exts]
+        if exts is None:
+            self.generic.append(ind)
+        else:
+            for e in exts:
+                self.by_ext.setdefault(e, []).append(ind)
+
+    def rules_for(self, ext):
+        # Rules to try for an extension, in rifle.conf order
+        if ext not in self.candidates:
+            self.candidates[ext] = sorted(self.by_ext.get(ext, []) + self.generic)
+        return self.candidates[ext]
 
     def decide_open_cmd(self, fname):
-        for tests, command in self.rules:
-            succ = True
-            for test in tests:
-                if not test(fname):
-                    succ = False
-            if succ:
+        self.reload()
+        self.exes.validate()
+        ctx = Context(fname, self.exes)
+        for ind in self.rules_for(ctx.ext):
+            tests, command = self.rules[ind]
+            if all(test(fname, ctx) for test in tests):
                 return command
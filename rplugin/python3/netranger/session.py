@@ -0,0 +1,55 @@
+import os
+import pickle
+from collections import OrderedDict
+from netranger.fs import FS
+from netranger.util import log
+
+log('')
+
+
+# Snapshot of the local buffers written at VimLeave: for each buffer its cwd,
+# pinned root and the expanded directories and cursor entry of each of its
+# pages, plus the cached listings of local directories. Listings are only reused while the mtime of
+# their directory is unchanged, so restoring a buffer relists only the
+# directories modified since.
+class Session(object):
+    Version = 2
+
+    def __init__(self, fname, max_bufs=50):
+        self.fname = fname
+        self.max_bufs = max_bufs
+        self.bufs = OrderedDict()
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.fname, 'rb') as f:
+                data = pickle.load(f)
+            if data['version'] != Session.Version:
+                return
+            self.bufs = OrderedDict(data['bufs'])
+            FS.listings.load(data['listings'])
+        except (OSError, ValueError, KeyError, TypeError, EOFError, pickle.UnpicklingError) as e:
+            log('session not loaded:', e)
+
+    def take(self, cwd):
+        # The state of a buffer is restored once, in the first buffer
+        # opened on its cwd
+        return self.bufs.pop(cwd, None)
+
+    def save(self, states):
+        # States not restored in this session are kept, older first
+        for state in states:
+            self.bufs.pop(state['cwd'], None)
+            self.bufs[state['cwd']] = state
+        while len(self.bufs) > self.max_bufs:
+            self.bufs.popitem(last=False)
+
+        tmp = '{}.{}.tmp'.format(self.fname, os.getpid())
+        try:
+            with open(tmp, 'wb') as f:
+                pickle.dump({'version': Session.Version, 'bufs': list(self.bufs.items()),
+                             'listings': FS.listings.dump()}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, self.fname)
+        except OSError as e:
+            log('failed to write session:', e)
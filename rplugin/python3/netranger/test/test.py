@@ -3,7 +3,9 @@ from netranger.util import Shell
 from netranger import default
 from netranger.colortbl import colortbl
 from neovim import attach
+import json
 import re
+import threading
 import time
 
 
@@ -193,12 +195,1341 @@ def test_misc():
     assert_num_content_line(2)
 
 
+def test_rcd():
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from netranger.rcd import RcloneRcd, RcdError
+
+    calls = []
+    auth = None
+
+    class FakeRcHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def do_POST(self):
+            params = json.loads(self.rfile.read(int(self.headers['Content-Length'])).decode('utf-8'))
+            calls.append((self.path, params))
+            if self.headers['Authorization'] != auth:
+                res = {'error': 'unauthorized'}
+            elif self.path == '/config/listremotes':
+                res = {'remotes': ['gdrive']}
+            elif self.path == '/operations/list' and params['remote'] == 'sub':
+                res = {'list': [{'Name': 'dir', 'IsDir': True}, {'Name': 'a', 'IsDir': False}]}
+            else:
+                res = {}
+            data = json.dumps(res).encode('utf-8')
+            self.send_response(401 if 'error' in res else 200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = HTTPServer(('127.0.0.1', 0), FakeRcHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    rcd = RcloneRcd(port=server.server_address[1], start=False)
+    assert rcd.listremotes() == ['gdrive']
+    assert [e['Name'] for e in rcd.list('gdrive:/sub')] == ['dir', 'a']
+    assert calls[-1] == ('/operations/list', {'fs': 'gdrive:', 'remote': 'sub'})
+    # an unexpected reply is an error, not a KeyError
+    try:
+        rcd.list('gdrive:/other')
+        assert False, 'expected RcdError'
+    except RcdError:
+        pass
+    rcd.copyfile('gdrive:/sub/a', '/tmp/a')
+    assert calls[-1] == ('/operations/copyfile', {'srcFs': 'gdrive:', 'srcRemote': 'sub/a', 'dstFs': '/', 'dstRemote': 'tmp/a'})
+    # all calls reuse the same keep-alive connection
+    assert len(rcd.pool) == 1
+    rcd.stop()
+
+    # requests are authenticated
+    auth = 'Basic dTpw'
+    try:
+        rcd.listremotes()
+        assert False, 'expected RcdError'
+    except RcdError:
+        pass
+    rcd = RcloneRcd(port=server.server_address[1], start=False, auth=('u', 'p'))
+    assert rcd.listremotes() == ['gdrive']
+
+    rcd.stop()
+    server.shutdown()
+    print('== test_rcd success ==')
+
+
+def test_vcs():
+    import tempfile
+    from netranger.vcs import VcsStatus
+
+    updated = threading.Event()
+    vcs = VcsStatus(lambda root: updated.set())
+
+    def git(*args):
+        Shell.run_args(['git', '-C', repo] + list(args))
+
+    def update(dirname):
+        updated.clear()
+        vcs.update(dirname)
+        assert updated.wait(5)
+
+    repo = tempfile.mkdtemp()
+    git('init', '-q')
+    Shell.mkdir(os.path.join(repo, 'src/sub'))
+    Shell.mkdir(os.path.join(repo, 'build'))
+    for fname in ['src/sub/a', 'src/b', 'c', 'build/out', '.gitignore']:
+        with open(os.path.join(repo, fname), 'w') as f:
+            f.write('build\n' if fname == '.gitignore' else fname)
+    git('add', 'src', '.gitignore')
+    git('-c', 'user.name=t', '-c', 'user.email=t@t', 'commit', '-q', '-m', 'init')
+
+    update(os.path.join(repo, 'src'))
+    assert vcs.status(os.path.join(repo, 'src/b')) is None
+    assert vcs.status(os.path.join(repo, 'c')) == '?'
+    assert vcs.status(os.path.join(repo, 'build')) == '!'
+    assert vcs.status(os.path.join(repo, 'build/out')) == '!'
+
+    # a staged change touches the index, which triggers a new status
+    with open(os.path.join(repo, 'src/sub/a'), 'a') as f:
+        f.write('change')
+    git('add', 'src/sub/a')
+    time.sleep(0.01)
+    update(os.path.join(repo, 'src'))
+    assert vcs.status(os.path.join(repo, 'src/sub/a')) == 'M'
+    assert vcs.status(os.path.join(repo, 'src/sub')) == 'M'
+    assert vcs.status(os.path.join(repo, 'src')) == 'M'
+
+    # unstaged changes need an explicit invalidation
+    with open(os.path.join(repo, 'src/b'), 'a') as f:
+        f.write('change')
+    updated.clear()
+    vcs.invalidate(os.path.join(repo, 'src/b'))
+    assert updated.wait(5)
+    assert vcs.status(os.path.join(repo, 'src/b')) == 'M'
+
+    # nothing is redrawn when the statuses didn't change
+    updated.clear()
+    vcs.invalidate(os.path.join(repo, 'src/b'))
+    assert not updated.wait(0.5)
+    assert not vcs.repos[repo].running
+
+    # a directory outside any repository is checked again once expired
+    from netranger import vcs as vcsmod
+    plain = tempfile.mkdtemp()
+    ttl = vcsmod.NoRootTTL
+    vcsmod.NoRootTTL = 0
+    assert vcs.find_root(plain) is None
+    Shell.run_args(['git', '-C', plain, 'init', '-q'])
+    time.sleep(0.01)
+    assert vcs.find_root(plain) == plain
+    vcsmod.NoRootTTL = ttl
+
+    Shell.run('rm -rf {} {}'.format(repo, plain))
+    print('== test_vcs success ==')
+
+
+def test_session():
+    import tempfile
+    from netranger.fs import FS, ListingCache, cached_scan
+    from netranger.netranger import Page
+    from netranger.session import Session
+
+    root = tempfile.mkdtemp()
+    Shell.mkdir(os.path.join(root, 'a/b'))
+    Shell.mkdir(os.path.join(root, 'c'))
+    Shell.touch(os.path.join(root, 'a/f'))
+    # listings of directories modified in the last 2 seconds are not cached
+    past = time.time() - 10
+    for d in ['', 'a', 'a/b', 'c']:
+        os.utime(os.path.join(root, d), (past, past))
+
+    listings = ListingCache(max_dirs=2)
+    mtime_ns, entries = cached_scan(listings, root)
+    assert [e[0] for e in entries] == ['a', 'c']
+    assert listings.get(root, mtime_ns) == entries
+    assert listings.get(root, mtime_ns+1) is None
+    cached_scan(listings, os.path.join(root, 'a'))
+    cached_scan(listings, os.path.join(root, 'c'))
+    assert listings.get(root, mtime_ns) is None
+    Shell.touch(os.path.join(root, 'c/new'))
+    mtime_ns, entries = cached_scan(listings, os.path.join(root, 'c'))
+    assert [e[0] for e in entries] == ['new']
+    assert listings.get(os.path.join(root, 'c'), mtime_ns) is None
+    Shell.rm(os.path.join(root, 'c/new'))
+    os.utime(os.path.join(root, 'c'), (past, past))
+
+    vimvars = {'NETRIgnore': [], 'NETRHiCWD': default.variables['NETRHiCWD']}
+    page = Page(None, root, FS(), vimvars=vimvars)
+    page.restore({os.path.join(root, 'a'), os.path.join(root, 'a/b')}, os.path.join(root, 'a/f'))
+    assert [(n.name, n.level) for n in page.nodes[1:]] == [('a', 0), ('b', 1), ('f', 1), ('c', 0)]
+    assert page.curNode.fullpath == os.path.join(root, 'a/f')
+
+    ori_listings = FS.listings
+    fname = os.path.join(tempfile.mkdtemp(), 'session')
+    FS.listings = ListingCache()
+    FS().list_with_attrs(root)
+    state = {'cwd': root, 'pinned': root,
+             'pages': {root: {'expanded': [os.path.join(root, 'a')], 'cursor': os.path.join(root, 'c')}}}
+    Session(fname).save([state])
+    FS.listings = ListingCache()
+    session = Session(fname)
+    assert FS.listings.get(root, os.stat(root).st_mtime_ns) is not None
+    assert session.take(root) == state
+    assert session.take(root) is None
+    FS.listings = ori_listings
+
+    Shell.run('rm -rf {} {}'.format(root, os.path.dirname(fname)))
+    print('== test_session success ==')
+
+
+def test_daemon():
+    import tempfile
+    from netranger import daemon
+    from netranger.daemon import Daemon, DaemonClient, DaemonError, SharedMetaCache, Reader, Writer
+    from netranger.remotecache import MetaCache
+
+    w = Writer().str('a\udcff').pack('!?q', True, -1).str('')
+    r = Reader(w.bytes())
+    assert r.str() == 'a\udcff'
+    assert r.unpack('!?q') == (True, -1)
+    assert r.str() == ''
+
+    listing = [('d', True, 'dir', None), ('x', False, 'exe', None), ('f', False, 'file', None)]
+    w = Writer()
+    daemon.write_listing(w, listing)
+    assert daemon.read_listing(Reader(w.bytes())) == listing
+    entries = [['d', True, -1, ''], ['f', False, 3, '2020-01-01T00:00:00Z']]
+    w = Writer()
+    daemon.write_remote_entries(w, entries)
+    assert daemon.read_remote_entries(Reader(w.bytes())) == entries
+
+    root = tempfile.mkdtemp()
+    Shell.mkdir(os.path.join(root, 'dir/sub'))
+    Shell.touch(os.path.join(root, 'dir/a'))
+    cache_dir = os.path.join(root, 'cache')
+    d = Daemon(os.path.join(root, 'sock'), idle_timeout=1, max_remote=2)
+
+    r = Reader(d.handle(daemon.OpList, Writer().str(os.path.join(root, 'dir')).bytes()))
+    assert r.unpack('!q')[0] == os.stat(os.path.join(root, 'dir')).st_mtime_ns
+    assert daemon.read_listing(r) == [('sub', True, 'dir', None), ('a', False, 'file', None)]
+    r = Reader(d.handle(daemon.OpDirtyMtime, Writer().str(root).bytes()))
+    mtime, stale = r.unpack('!d?')
+    assert mtime == os.stat(root).st_mtime and not stale
+
+    def meta_get(path):
+        r = Reader(d.handle(daemon.OpMetaGet, Writer().str(cache_dir).str(path).bytes()))
+        if not r.unpack('!?')[0]:
+            return None
+        r.unpack('!d')
+        return daemon.read_remote_entries(r)
+
+    assert meta_get('gd:/a') is None
+    w = Writer().str(cache_dir).str('gd:/a')
+    daemon.write_remote_entries(w, entries)
+    d.handle(daemon.OpMetaPut, w.bytes())
+    assert meta_get('gd:/a') == entries
+    # instances not using the daemon write the meta files directly
+    time.sleep(0.01)
+    MetaCache(cache_dir).put('gd:/a', entries[:1])
+    assert meta_get('gd:/a') == entries[:1]
+    for path in ['gd:/b', 'gd:/c']:
+        MetaCache(cache_dir).put(path, [])
+        assert meta_get(path) == []
+    assert len(d.remote) == 2
+    d.handle(daemon.OpMetaInvalidate, Writer().str(cache_dir).str('gd:/a').bytes())
+    assert meta_get('gd:/a') is None
+    try:
+        d.handle(42, b'')
+        assert False, 'expected DaemonError'
+    except DaemonError:
+        pass
+
+    # requests through the socket, daemon errors fall back to the disk
+    threading.Thread(target=d.serve, daemon=True).start()
+    client = DaemonClient(d.sock_path)
+    assert_fs(lambda: os.path.exists(d.sock_path))
+    assert client.list(os.path.join(root, 'dir'))[1] == [('sub', True, 'dir', None), ('a', False, 'file', None)]
+    meta = SharedMetaCache(client, cache_dir)
+    meta.put('gd:/d', entries)
+    assert meta.get('gd:/d')[1] == entries
+    assert MetaCache(cache_dir).get('gd:/d')[1] == entries
+
+    def fail(key):
+        raise OSError('failed')
+    d.remote_get = fail
+    assert meta.get('gd:/d')[1] == entries
+    client.close()
+
+    # a daemon not answering in time isn't used anymore, listings are done
+    # in-process
+    import socket
+    from netranger.fs import FS, ListingCache
+    hung = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    hung.bind(os.path.join(root, 'hung'))
+    hung.listen(1)
+    client = DaemonClient(os.path.join(root, 'hung'))
+    start = time.time()
+    assert client.list(os.path.join(root, 'dir')) is None
+    assert time.time() - start < 1 and client.dead
+    ori_daemon, ori_listings = FS.daemon, FS.listings
+    FS.daemon, FS.listings = client, ListingCache()
+    assert [e[0] for e in FS().list_with_attrs(os.path.join(root, 'dir'))] == ['sub', 'a']
+    FS.daemon, FS.listings = ori_daemon, ori_listings
+    # nor does a request wait for another one in flight
+    client = DaemonClient(d.sock_path)
+    with client.lock:
+        assert client.list(os.path.join(root, 'dir')) is None
+    assert client.list(os.path.join(root, 'dir')) is not None
+    client.close()
+    hung.close()
+
+    Shell.run('rm -rf {}'.format(root))
+    print('== test_daemon success ==')
+
+
+def test_rifle():
+    import tempfile
+    from netranger.rifle import Rifle, ExeCache, ext
+
+    # plain alternatives are exact extensions, anything else is a regex
+    assert ext('mp4|mkv').exts == ['mp4', 'mkv']
+    assert ext(r'tar\.gz$').exts is None
+
+    conf = os.path.join(tempfile.mkdtemp(), 'rifle.conf')
+    with open(conf, 'w') as f:
+        f.write('# comment\n'
+                'ext pdf = viewpdf\n'
+                'has sh, ext mp4|mkv = play\n'
+                'ext tar\\.gz$ = untar\n'
+                'ext mkv, has no-such-exe-netranger = never\n'
+                'has sh = fallback\n')
+    rifle = Rifle(None, conf)
+    assert sorted(rifle.by_ext) == ['mkv', 'mp4', 'pdf']
+    assert rifle.by_ext['mkv'] == [1, 3]
+    assert rifle.generic == [2, 4]
+    assert rifle.rules_for('mkv') == [1, 2, 3, 4]
+    assert rifle.rules_for('txt') == [2, 4]
+    # extension tests are moved first
+    assert type(rifle.rules[1][0][0]) is ext
+
+    assert rifle.decide_open_cmd('/a/b.pdf') == 'viewpdf'
+    assert rifle.decide_open_cmd('/a/b.PDF') == 'fallback'
+    assert rifle.decide_open_cmd('/a/pdf') == 'fallback'
+    assert rifle.decide_open_cmd('/a/b.pdf.txt') == 'fallback'
+    assert rifle.decide_open_cmd('/a/mypdf') == 'fallback'
+    assert rifle.decide_open_cmd('/a/b.mkv') == 'play'
+    assert rifle.decide_open_cmd('/a/b.tar.gz') == 'untar'
+
+    # compiled again once rifle.conf changes
+    with open(conf, 'w') as f:
+        f.write('ext txt = edit\n')
+    future = time.time() + 10
+    os.utime(conf, (future, future))
+    assert rifle.decide_open_cmd('/a/b.txt') == 'edit'
+    assert rifle.decide_open_cmd('/a/b.pdf') is None
+    assert rifle.generic == []
+
+    exes = ExeCache()
+    exes.validate()
+    assert exes.has('sh')
+    assert not exes.has('no-such-exe-netranger')
+    assert exes.found == {'sh': True, 'no-such-exe-netranger': False}
+    exes.validate()
+    assert len(exes.found) == 2
+    ori_path = os.environ['PATH']
+    os.environ['PATH'] = ori_path + os.pathsep + os.path.dirname(conf)
+    exes.validate()
+    assert exes.found == {}
+    os.environ['PATH'] = ori_path
+
+    Shell.run('rm -rf {}'.format(os.path.dirname(conf)))
+    print('== test_rifle success ==')
+
+
+# Serves listings of remote directories {remote path: [entry]} in place of
+# rclone rcd
+class FakeRcd(object):
+    def __init__(self, listings):
+        self.listings = listings
+        self.ready = threading.Event()
+        self.ready.set()
+        self.alive = True
+
+    def listremotes(self):
+        return [path[:-2] for path in self.listings if path.endswith(':/')]
+
+    def list(self, path):
+        return [{'Name': e[0], 'IsDir': e[1], 'Size': e[2], 'ModTime': e[3]} for e in self.listings[path]]
+
+    def stop(self):
+        pass
+
+
+def make_rclone(listings, ttl=None):
+    import tempfile
+    from netranger.fs import RClone
+    from netranger.remotecache import MetaCache
+
+    cache_dir = tempfile.mkdtemp()
+    ttl = dict(ttl or {})
+    ttl.setdefault('*', 3600)
+    rcd = FakeRcd(listings)
+    meta = MetaCache(cache_dir, ttl)
+    meta.put('', [[remote, True, -1, ''] for remote in rcd.listremotes()])
+    rclone = RClone(cache_dir, meta=meta)
+    rclone.rcd_client = rcd
+    return rclone
+
+
+def test_metacache():
+    import tempfile
+    from netranger.remotecache import MetaCache
+
+    cache_dir = tempfile.mkdtemp()
+    meta = MetaCache(cache_dir, {'gd': 10, '*': 60})
+    assert meta.get('gd:/a') is None
+    meta.put('gd:/a', [['f', False, 1, '']])
+    fetch_time, entries = meta.get('gd:/a')
+    assert entries == [['f', False, 1, '']]
+    assert not meta.expired('gd:/a', fetch_time)
+    assert meta.expired('gd:/a', time.time()-11)
+    assert not meta.expired('other:/a', time.time()-11)
+    assert meta.expired('other:/a', time.time()-61)
+    # aborted writes keep the previous entry
+    writer = meta.writer('gd:/a')
+    writer.add(['g', False, 1, ''])
+    writer.abort()
+    assert meta.get('gd:/a')[1] == entries
+    meta.invalidate('gd:/a')
+    assert meta.get('gd:/a') is None
+    Shell.run('rm -rf {}'.format(cache_dir))
+
+    # expired listings are shown, then refetched in the background
+    rclone = make_rclone({'gd:/': [['a', False, 1, ''], ['c', False, 1, '']]}, ttl={'gd': 0})
+    rclone.meta.put('gd:/', [['a', False, 1, ''], ['b', False, 1, '']])
+    changed = threading.Event()
+    rclone.on_change = lambda lpath: changed.set()
+    gd = os.path.join(rclone.cache_dir, 'gd')
+    time.sleep(0.01)
+    assert sorted(rclone.ls(gd)) == ['a', 'b']
+    assert changed.wait(5)
+    assert sorted(rclone.ls(gd)) == ['a', 'c']
+    assert [e[0] for e in rclone.meta.get('gd:/')[1]] == ['a', 'c']
+    # fresh listings are not refetched
+    rclone.meta.ttl['gd'] = 3600
+    rclone.invalidate(gd)
+    rclone.meta.put('gd:/', [['a', False, 1, '']])
+    changed.clear()
+    assert rclone.ls(gd) == ['a']
+    assert not changed.wait(0.1)
+    rclone.close()
+    Shell.run('rm -rf {}'.format(rclone.cache_dir))
+    print('== test_metacache success ==')
+
+
+def test_downloader():
+    import shutil
+    import sys
+    import tempfile
+    from netranger.fs import RcloneFile
+    from netranger.transfer import Downloader
+
+    # a fake rclone serving `gd:/<path>` from a local directory and logging
+    # its arguments
+    tmp = tempfile.mkdtemp()
+    remote = os.path.join(tmp, 'remote')
+    Shell.mkdir(remote)
+    calls = os.path.join(tmp, 'calls')
+    with open(os.path.join(tmp, 'rclone'), 'w') as f:
+        f.write('#!{}\n'
+                'import os, sys\n'
+                'args = sys.argv[1:]\n'
+                'with open({!r}, "a") as f:\n'
+                '    f.write(" ".join(args) + "\\n")\n'
+                'offset = int(args[args.index("--offset")+1]) if "--offset" in args else 0\n'
+                'count = int(args[args.index("--count")+1]) if "--count" in args else -1\n'
+                'with open(os.path.join({!r}, args[-1][4:]), "rb") as f:\n'
+                '    f.seek(offset)\n'
+                '    sys.stdout.buffer.write(f.read(count))\n'.format(sys.executable, calls, remote))
+    os.chmod(os.path.join(tmp, 'rclone'), 0o755)
+    ori_path = os.environ['PATH']
+    os.environ['PATH'] = tmp + os.pathsep + ori_path
+
+    content = bytes(range(256)) * 40
+    with open(os.path.join(remote, 'f'), 'wb') as f:
+        f.write(content)
+    local = os.path.join(tmp, 'local')
+    rfile = RcloneFile(os.path.join(local, 'f'), 'gd:/f', len(content), '2020-01-01T00:00:00Z')
+
+    def download(downloader):
+        done = threading.Event()
+        errs = []
+        downloader.download(rfile, lambda rfile, err: (errs.append(err), done.set()))
+        assert done.wait(5)
+        assert errs == [None]
+        with open(rfile.lpath, 'rb') as f:
+            assert f.read() == content
+        assert not os.path.exists(rfile.lpath + '.part')
+        assert not os.path.exists(rfile.lpath + '.part.stamp')
+        Shell.rm(rfile.lpath)
+        with open(calls) as f:
+            res = f.read().splitlines()
+        Shell.rm(calls)
+        return res
+
+    downloader = Downloader(chunk_size=1000)
+    assert download(downloader) == ['cat --offset 0 gd:/f']
+
+    # a partial download of the same version is resumed
+    Shell.mkdir(local)
+    with open(rfile.lpath + '.part', 'wb') as f:
+        f.write(content[:3000])
+    with open(rfile.lpath + '.part.stamp', 'w') as f:
+        f.write('{} {}'.format(rfile.size, rfile.mtime))
+    assert download(downloader) == ['cat --offset 3000 gd:/f']
+
+    # ... but not one of another version
+    with open(rfile.lpath + '.part', 'wb') as f:
+        f.write(b'x'*3000)
+    with open(rfile.lpath + '.part.stamp', 'w') as f:
+        f.write('{} {}'.format(rfile.size, 'older'))
+    assert download(downloader) == ['cat --offset 0 gd:/f']
+
+    # head only
+    head = Downloader.head(rfile, os.path.join(tmp, 'head/f'), 100)
+    with open(head, 'rb') as f:
+        assert f.read() == content[:100]
+    Shell.rm(calls)
+
+    # new downloads go through rcd when it's up, resumed ones through the cli
+    class Rcd(object):
+        def copyfile(self, src, dst):
+            shutil.copyfile(os.path.join(remote, src[4:]), dst)
+    rcd = Rcd()
+    downloader = Downloader(rcd=lambda: rcd)
+    Shell.touch(calls)
+    assert download(downloader) == []
+    with open(rfile.lpath + '.part', 'wb') as f:
+        f.write(content[:10])
+    with open(rfile.lpath + '.part.stamp', 'w') as f:
+        f.write('{} {}'.format(rfile.size, rfile.mtime))
+    assert download(downloader) == ['cat --offset 10 gd:/f']
+
+    os.environ['PATH'] = ori_path
+    Shell.run('rm -rf {}'.format(tmp))
+    print('== test_downloader success ==')
+
+
+def test_filecache():
+    import tempfile
+    from netranger.fs import RcloneFile
+    from netranger.remotecache import FileCache
+
+    cache_dir = tempfile.mkdtemp()
+    Shell.mkdir(os.path.join(cache_dir, '.meta'))
+    files = FileCache(cache_dir, quota=250)
+
+    def cached_file(name, size, mtime='t1'):
+        rfile = RcloneFile(os.path.join(cache_dir, name), 'gd:/'+name, size, mtime)
+        with open(rfile.lpath, 'wb') as f:
+            f.write(b'x'*size)
+        files.add(rfile)
+        return rfile
+
+    a = cached_file('a', 100)
+    time.sleep(0.01)
+    b = cached_file('b', 100)
+    assert files.is_cached(a) and files.is_cached(b)
+    assert files.total_size == 200
+    # checking doesn't count as a use
+    assert files.stats['hits'] == 0
+
+    # the least recently used file is evicted first
+    time.sleep(0.01)
+    files.hit(a)
+    assert files.stats['hits'] == 1 and files.stats['bytes_saved'] == 100
+    time.sleep(0.01)
+    c = cached_file('c', 100)
+    assert not os.path.exists(b.lpath) and not files.is_cached(b)
+    assert files.is_cached(a) and files.is_cached(c)
+    assert files.total_size == 200 and files.stats['evicted'] == 1
+
+    # a newer remote version is a miss, the old copy is dropped
+    a2 = RcloneFile(a.lpath, a.path, 100, 't2')
+    assert not files.is_cached(a2)
+    files.miss(a2)
+    assert files.stats['misses'] == 1
+    assert not os.path.exists(a.lpath) and files.total_size == 100
+
+    # a file bigger than the quota is kept until the next one comes in
+    d = cached_file('d', 300)
+    assert files.is_cached(d) and not files.is_cached(c)
+    assert files.total_size == 300
+
+    files.save()
+    files = FileCache(cache_dir, quota=250)
+    assert files.is_cached(d) and files.total_size == 300
+    assert files.stats['hits'] == 1 and files.stats['misses'] == 1 and files.stats['evicted'] == 2
+    assert 'hit rate: 50%' in files.report()
+
+    Shell.run('rm -rf {}'.format(cache_dir))
+    print('== test_filecache success ==')
+
+
+def test_transfer_many():
+    import tempfile
+
+    rclone = make_rclone({'gd:/': [['dir', True, -1, ''], ['dst', True, -1, ''],
+                                   ['a', False, 1, ''], ['b', False, 1, '']],
+                          'gd:/dir': [['c', False, 1, '']],
+                          'gd:/dst': []})
+    gd = os.path.join(rclone.cache_dir, 'gd')
+    for d in ['', 'dir', 'dst']:
+        rclone.ls(os.path.join(gd, d))
+    local = tempfile.mkdtemp()
+    Shell.mkdir(os.path.join(local, 'sub'))
+    Shell.touch(os.path.join(local, 'x'))
+    Shell.touch(os.path.join(local, 'y'))
+
+    # the content of --files-from is read while rclone would run
+    calls = []
+
+    def run_transfer(op, src, dst, *args):
+        args = list(args)
+        if '--files-from' in args:
+            ind = args.index('--files-from')+1
+            with open(args[ind]) as f:
+                args[ind] = f.read()
+        calls.append((op, src, dst, args))
+    rclone.run_transfer = run_transfer
+
+    srcs = [os.path.join(gd, p) for p in ['a', 'dir', 'b', 'dir/c']] + \
+        [os.path.join(local, p) for p in ['x', 'sub/', 'y']]
+    rclone.copy_many(srcs, os.path.join(gd, 'dst'))
+    assert calls == [('copy', 'gd:/dir', 'gd:/dst/dir', []),
+                     ('copy', os.path.join(local, 'sub'), 'gd:/dst/sub', []),
+                     ('copy', 'gd:/', 'gd:/dst', ['--files-from', 'a\nb\n']),
+                     ('copy', 'gd:/dir', 'gd:/dst', ['--files-from', 'c\n']),
+                     ('copy', local, 'gd:/dst', ['--files-from', 'x\ny\n'])], calls
+    # the destination is listed again, not the sources
+    assert not rclone.getNode(os.path.join(gd, 'dst')).cached
+    assert rclone.getNode(os.path.join(gd, 'dir')).cached
+
+    del calls[:]
+    rclone.move_many([os.path.join(gd, 'dir/c')], local)
+    assert calls == [('move', 'gd:/dir', local, ['--files-from', 'c\n'])]
+    assert not rclone.getNode(os.path.join(gd, 'dir')).cached
+
+    rclone.close()
+    Shell.run('rm -rf {} {}'.format(rclone.cache_dir, local))
+    print('== test_transfer_many success ==')
+
+
+def test_ls_stream():
+    listings = {'gd:/': [['e{}'.format(i), False, i, ''] for i in range(5)]}
+    rclone = make_rclone(listings)
+    gd = os.path.join(rclone.cache_dir, 'gd')
+
+    chunks = list(rclone.ls_stream(gd, chunk_size=2))
+    assert chunks == [['e0', 'e1'], ['e2', 'e3'], ['e4']]
+    assert [e[0] for e in rclone.meta.get('gd:/')[1]] == ['e0', 'e1', 'e2', 'e3', 'e4']
+    # listed from the cache afterwards
+    assert list(rclone.ls_stream(gd, chunk_size=2)) == [['e0', 'e1', 'e2', 'e3', 'e4']]
+
+    # entries gone from the remote are dropped, unchanged ones kept
+    e1 = rclone.getNode(os.path.join(gd, 'e1'))
+    listings['gd:/'] = [['e1', False, 1, ''], ['e3', False, 30, ''], ['new', False, 1, '']]
+    rclone.invalidate(gd)
+    assert sum(rclone.ls_stream(gd, chunk_size=2), []) == ['e1', 'e3', 'new']
+    assert sorted(rclone.getDir(gd).child) == ['e1', 'e3', 'new']
+    assert rclone.getNode(os.path.join(gd, 'e1')) is e1
+    assert rclone.getNode(os.path.join(gd, 'e3')).size == 30
+
+    # a listing not read to the end isn't cached
+    rclone.invalidate(gd)
+    stream = rclone.ls_stream(gd, chunk_size=2)
+    assert next(stream) == ['e1', 'e3']
+    stream.close()
+    assert rclone.meta.get('gd:/') is None
+    assert not rclone.getDir(gd).cached
+
+    rclone.close()
+    Shell.run('rm -rf {}'.format(rclone.cache_dir))
+    print('== test_ls_stream success ==')
+
+
+def test_prefetcher():
+    from netranger.prefetch import Prefetcher
+
+    prefetcher = Prefetcher(max_jobs=1, budget=2)
+    release = threading.Event()
+    ran = []
+
+    def job(key):
+        def fn():
+            release.wait(5)
+            ran.append(key)
+        return fn
+
+    # a key is queued once at a time, jobs stop once the budget is spent
+    assert prefetcher.prefetch('a', job('a'))
+    assert not prefetcher.prefetch('a', job('a'))
+    assert prefetcher.is_queued('a')
+    assert prefetcher.prefetch('b', job('b'))
+    release.set()
+    assert_fs(lambda: ran == ['a', 'b'])
+    assert_fs(lambda: not prefetcher.is_queued('b'))
+    assert not prefetcher.prefetch('c', job('c'))
+    prefetcher.shutdown()
+
+    # remote directories are listed in the background
+    rclone = make_rclone({'gd:/': [['dir', True, -1, '']], 'gd:/dir': [['f', False, 1, '']]})
+    gd = os.path.join(rclone.cache_dir, 'gd')
+    rclone.ls(gd)
+    rclone.prefetch(os.path.join(gd, 'dir'))
+    assert_fs(lambda: rclone.getDir(os.path.join(gd, 'dir')).cached)
+    assert rclone.meta.get('gd:/dir')[1] == [['f', False, 1, '']]
+    rclone.close()
+    Shell.run('rm -rf {}'.format(rclone.cache_dir))
+    print('== test_prefetcher success ==')
+
+
+def test_prefetch_idle():
+    from netranger.prefetch import Prefetcher
+
+    prefetcher = Prefetcher(max_jobs=2, budget=None, idle=0.3)
+    ran = []
+
+    # jobs wait for the user to be idle
+    prefetcher.touch()
+    prefetcher.prefetch('a', lambda: ran.append('a'))
+    time.sleep(0.1)
+    assert ran == []
+    prefetcher.touch()
+    time.sleep(0.25)
+    assert ran == []
+    assert_fs(lambda: ran == ['a'])
+
+    # jobs not started yet are dropped
+    prefetcher.touch()
+    prefetcher.prefetch('b', lambda: ran.append('b'))
+    prefetcher.cancel()
+    assert not prefetcher.is_queued('b')
+    time.sleep(0.5)
+    assert ran == ['a']
+    assert prefetcher.prefetch('b', lambda: ran.append('b'))
+    assert_fs(lambda: ran == ['a', 'b'])
+    prefetcher.shutdown()
+    print('== test_prefetch_idle success ==')
+
+
+def test_mount():
+    import tempfile
+    from netranger import mount
+    from netranger.mount import MountTable
+
+    mountinfo = os.path.join(tempfile.mkdtemp(), 'mountinfo')
+    with open(mountinfo, 'w') as f:
+        for mountpoint, fstype in [('/', 'ext4'), ('/mnt/nfs', 'nfs4'), ('/mnt/my\\040share', 'cifs'),
+                                   ('/mnt/nfs/local', 'ext4'), ('/home/a/remote', 'fuse.sshfs'),
+                                   ('/home/a/gd', 'fuse.rclone'), ('/mnt/sshfs', 'sshfs')]:
+            f.write('36 25 0:1 / {} rw,relatime shared:1 - {} src rw\n'.format(mountpoint, fstype))
+        f.write('malformed\n')
+
+    table = MountTable(mountinfo)
+    assert table.classify('/home/a') == mount.LOCAL
+    assert table.classify('/mnt/nfs') == mount.NETWORK
+    assert table.classify('/mnt/nfs/dir') == mount.NETWORK
+    assert table.classify('/mnt/nfsx') == mount.LOCAL
+    assert table.classify('/mnt/nfs/local/dir') == mount.LOCAL
+    assert table.classify('/mnt/my share/dir') == mount.NETWORK
+    assert table.classify('/home/a/remote') == mount.FUSE
+    assert table.classify('/mnt/sshfs') == mount.FUSE
+    assert table.classify('/home/a/gd/dir') == mount.RCLONE
+    assert MountTable(mountinfo+'.missing').classify('/mnt/nfs') == mount.LOCAL
+
+    Shell.run('rm -rf {}'.format(os.path.dirname(mountinfo)))
+    print('== test_mount success ==')
+
+
+def test_preview():
+    import tempfile
+    from netranger.fs import FS
+    from netranger.preview import Previewer, is_binary, read_head
+
+    assert is_binary(b'ab\0c') and not is_binary(b'abc')
+    assert not is_binary(b'a'*8192 + b'\0')
+
+    root = tempfile.mkdtemp()
+    text, binary = os.path.join(root, 'text'), os.path.join(root, 'binary')
+    with open(text, 'w') as f:
+        f.write('line1\nline2\nline3\n')
+    with open(binary, 'wb') as f:
+        f.write(b'\0'*2048)
+    Shell.mkdir(os.path.join(root, 'dir'))
+    assert read_head(text, 8) == b'line1\nli'
+
+    previewer = Previewer(None, None, nbytes=14, cache_size=2)
+    # the line cut by the head read isn't shown
+    assert previewer.get(text, FS()) == ['line1', 'line2']
+    assert previewer.get(binary, FS()) == ['(binary file, 2.0K)']
+    assert previewer.get(root, FS()) == ['dir/', 'binary', 'text']
+    assert previewer.get(os.path.join(root, 'missing'), FS()) == ['(not available locally)']
+
+    # least recently used previews are dropped, modified files read again
+    assert len(previewer.cache) == 2
+    content = previewer.get(binary, FS())
+    assert previewer.get(binary, FS()) is content
+    assert list(previewer.cache)[-1][0] == binary
+    with open(text, 'w') as f:
+        f.write('new\n')
+    assert previewer.get(text, FS()) == ['new']
+    assert [key[0] for key in previewer.cache] == [binary, text]
+
+    Shell.run('rm -rf {}'.format(root))
+    print('== test_preview success ==')
+
+
+def test_fuzzy():
+    import random
+    from netranger.fuzzy import Filter, score
+
+    def is_subsequence(query, name):
+        it = iter(name)
+        return all(c in it for c in query)
+
+    random.seed(0)
+    names = [''.join(random.choice('abcAB_.') for _ in range(random.randint(1, 8))) for _ in range(300)]
+    flt = Filter(names)
+    for query in ['a', 'ab', 'abc', 'ab', 'a_', 'A.b', 'x', '']:
+        expected = [i for i, n in enumerate(names) if is_subsequence(query.lower(), n.lower())]
+        assert flt.match(query) == expected, query
+
+    # positions of one character queries are recorded in the background
+    flt = Filter(names)
+    assert flt.match('b') == [i for i, n in enumerate(names) if 'b' in n.lower()]
+    flt.recorders['b'].join()
+    assert flt.results['b'][1] == [n.lower().find('b')+1 for n in names if 'b' in n.lower()]
+    # ... and waited for when the next character comes first
+    flt = Filter(names)
+    assert flt.match('ca') == [i for i, n in enumerate(names) if is_subsequence('ca', n.lower())]
+
+    flt = Filter(['xmain', 'main.py', 'README.md', 'm_a_i_n', 'Makefile'])
+    assert flt.match('mai') == [0, 1, 3, 4]
+    assert flt.top('MAI', 3) == [1, 0, 3]
+    assert flt.top('', 2) == [0, 1]
+    assert score('main', 'main.py') > score('main', 'xmain') > score('main', 'm_a_i_n')
+    assert score('mn', 'main') < score('mn', 'm_n')
+    assert score('z', 'main') == -1
+    print('== test_fuzzy success ==')
+
+
+def test_pathindex():
+    import tempfile
+    from netranger.pathindex import PathIndex, Locator
+
+    root = tempfile.mkdtemp()
+    index_dir = tempfile.mkdtemp()
+    Shell.mkdir(os.path.join(root, 'src/netranger'))
+    Shell.mkdir(os.path.join(root, 'build'))
+    for fname in ['src/netranger/fs.py', 'src/netranger/fs.pyc', 'src/main.py', 'build/fs.o', 'README']:
+        Shell.touch(os.path.join(root, fname))
+
+    index = PathIndex(index_dir, root, ignore=['*.pyc'])
+    assert index.scan()
+    assert index.query('fs') == [os.path.join(root, p) for p in ['build/fs.o', 'src/netranger/fs.py']]
+    assert index.query('fs.') == index.query('fs')
+    assert index.query('src fs') == [os.path.join(root, 'src/netranger/fs.py')]
+    assert index.query('netranger/fs') == [os.path.join(root, 'src/netranger/fs.py')]
+    assert index.query('net') == [os.path.join(root, 'src/netranger')]
+    assert index.query('readme') == [os.path.join(root, 'README')]
+    assert index.query('fs.pyc') == []
+    assert index.query('') == []
+    assert len(index.query('py', limit=1)) == 1
+
+    # only directories modified since the last scan are listed again
+    assert not index.scan()
+    Shell.touch(os.path.join(root, 'src/fsck'))
+    future = time.time() + 10
+    os.utime(os.path.join(root, 'src'), (future, future))
+    assert index.scan()
+    assert index.query('fsc') == [os.path.join(root, 'src/fsck')]
+
+    # the index is saved and shared by roots of a Locator
+    locator = Locator(index_dir)
+    index = locator.index(root)
+    index.load()
+    assert index.query('fsc') == [os.path.join(root, 'src/fsck')]
+    assert locator.query([root, root], 'main') == [os.path.join(root, 'src/main.py')]
+
+    # mount points are indexed but not entered
+    if os.path.ismount('/dev/pts'):
+        index = locator.index('/dev')
+        index.scan()
+        assert '/dev/pts' in index.query('pts')
+        assert all(not p.startswith('/dev/pts/') for p in index.query('ptmx'))
+
+    # indexed roots: the pinned root and the user's bookmarks, not the '/'
+    # placeholder written in a new bookmark file
+    import types
+    from netranger.fs import FS
+    from netranger.netranger import Netranger
+    bookmarks = types.SimpleNamespace(valid_mark='abc',
+                                      mark_dict={'/': '/', 'a': index_dir, 'b': root, 'c': '/missing'})
+    n = types.SimpleNamespace(isInNETRBuf=True, bookmarkUI=bookmarks,
+                              curBuf=types.SimpleNamespace(pinnedRoot=root, fs=FS()))
+    assert Netranger.locate_roots(n) == [root, index_dir]
+
+    Shell.run('rm -rf {} {}'.format(root, index_dir))
+    print('== test_pathindex success ==')
+
+
+def test_frecency():
+    import tempfile
+    from netranger.frecency import Frecency
+
+    db = os.path.join(tempfile.mkdtemp(), 'frecency')
+    fr = Frecency(db, max_log=100, max_total=10)
+    for path in ['/home/a/proj', '/home/a/proj', '/home/a/doc', '/tmp/proj2']:
+        fr.record(path)
+    assert fr.query() == ['/home/a/proj', '/tmp/proj2', '/home/a/doc']
+    assert fr.query('home') == ['/home/a/proj', '/home/a/doc']
+    # a name starting with the last term comes first
+    assert fr.query('do') == ['/home/a/doc']
+    assert fr.query('a pro') == ['/home/a/proj']
+    assert fr.query('pro') == ['/home/a/proj', '/tmp/proj2']
+    assert fr.query(limit=1) == ['/home/a/proj']
+
+    # older visits count less
+    now = time.time()
+    assert Frecency.score([4, now], now) > Frecency.score([4, now-7200], now) \
+        > Frecency.score([4, now-86400*2], now) > Frecency.score([4, now-86400*30], now)
+
+    # visits are logged, then compacted into the database
+    fr.flush()
+    fr.record('/home/a/doc')
+    fr.flush()
+    assert Frecency(db).entries['/home/a/doc'][0] == 2
+    fr.forget('/tmp/proj2')
+    fr.flush()
+    assert '/tmp/proj2' not in Frecency(db).entries
+
+    # counts are aged to keep the total under max_total
+    for i in range(10):
+        fr.record('/home/a/proj')
+    fr.flush()
+    assert sum(e[0] for e in fr.entries.values()) <= 10
+    assert fr.query()[0] == '/home/a/proj'
+
+    # visited directories are opened in a local buffer from remote ones
+    import types
+    from netranger.fs import FS
+    from netranger.netranger import Netranger
+    jumps = []
+    local = types.SimpleNamespace(fs=FS(), jump_to=lambda path: jumps.append(('local', path)))
+    remote = types.SimpleNamespace(fs=types.SimpleNamespace(local=False),
+                                   jump_to=lambda path: jumps.append(('remote', path)))
+    commands = []
+
+    def command(cmd):
+        commands.append(cmd)
+        n.curBuf = local
+    n = types.SimpleNamespace(curBuf=remote, isInNETRBuf=True,
+                              vim=types.SimpleNamespace(command=command, call=lambda fn, path: path))
+    target = os.path.dirname(db)
+    Netranger.jump_to(n, target)
+    assert commands == ['edit ' + target] and jumps == [('local', target)]
+    Netranger.jump_to(n, db)
+    assert commands[-1] == 'edit ' + target and jumps[-1] == ('local', db)
+    assert len(commands) == 1
+
+    Shell.run('rm -rf {}'.format(os.path.dirname(db)))
+    print('== test_frecency success ==')
+
+
+def test_sort():
+    import stat
+    from netranger.netranger import DirNode, EntryNode, SortKeys, format_stat, sort_nodes
+
+    def node(name, size=None, mtime=0, level=0):
+        if size is None:
+            res = DirNode('/'+name, name, 'dir', level)
+        else:
+            res = EntryNode('/'+name, name, 'file', level)
+            res.stat = (size, mtime, stat.S_IFREG | 0o644)
+        return res
+
+    big, small = node('a', 4096, 1), node('b', 10, 3)
+    sub, child2, child1 = node('d'), node('y', 1, 2, level=1), node('x', 5, 1, level=1)
+    nodes = [small, sub, child2, child1, big]
+    names = lambda key: [n.name for n in sort_nodes(nodes, SortKeys[key])]
+    # directories first, children stay below their (sorted) parent
+    assert names('name') == ['d', 'x', 'y', 'a', 'b']
+    assert names('size') == ['d', 'x', 'y', 'a', 'b']
+    assert names('mtime') == ['d', 'y', 'x', 'b', 'a']
+    # directories are sorted by their computed recursive size
+    other = node('c')
+    other.du = (100, True)
+    assert [n.name for n in sort_nodes([sub, other], SortKeys['size'])] == ['c', 'd']
+
+    assert format_stat(None) == '' and format_stat(()) == ''
+    assert format_stat((2048, 0, None)) == '   2.0K                -'
+    assert format_stat((-1, 0, None)) == '      -                -'
+    line = format_stat((0, 0, stat.S_IFDIR | 0o755), du=(1536, False))
+    assert line.split() == ['1.5K+', '-', 'drwxr-xr-x']
+    line = format_stat((10, time.mktime((2020, 1, 2, 3, 4, 0, 0, 0, -1)), stat.S_IFREG | 0o644))
+    assert line.split() == ['10B', '2020-01-02', '03:04', '-rw-r--r--']
+    print('== test_sort success ==')
+
+
+def test_du():
+    import tempfile
+    from netranger.du import DuEngine
+
+    root = tempfile.mkdtemp()
+    Shell.mkdir(os.path.join(root, 'a/b'))
+    Shell.mkdir(os.path.join(root, 'c'))
+    for fname, size in [('f', 10), ('a/g', 100), ('a/b/h', 1000)]:
+        with open(os.path.join(root, fname), 'wb') as f:
+            f.write(b'x'*size)
+    # hardlinked files are counted once
+    os.link(os.path.join(root, 'a/b/h'), os.path.join(root, 'c/h'))
+    os.link(os.path.join(root, 'a/b/h'), os.path.join(root, 'h'))
+
+    engine = DuEngine(max_jobs=2)
+
+    def du(path):
+        done = threading.Event()
+        res = []
+
+        def on_progress(path, total, finished):
+            if finished:
+                res.append(total)
+                done.set()
+        engine.du(path, on_progress)
+        assert done.wait(5)
+        return res[0]
+
+    assert du(root) == 1110
+    assert du(os.path.join(root, 'c')) == 1000
+    assert du(os.path.join(root, 'a')) == 1100
+
+    # cached scans are used until the directory changes
+    with open(os.path.join(root, 'a/b/i'), 'wb') as f:
+        f.write(b'x'*5)
+    future = time.time() + 10
+    os.utime(os.path.join(root, 'a/b'), (future, future))
+    assert du(root) == 1115
+    engine.shutdown()
+
+    Shell.run('rm -rf {}'.format(root))
+    print('== test_du success ==')
+
+
+def test_archive():
+    import tarfile
+    import tempfile
+    import zipfile
+    from netranger.fs import FS
+    from netranger.archive import Archive, ArchiveDir, ArchiveFS, ArchiveMember, is_archive
+
+    assert is_archive('/a/b.TAR.GZ') and is_archive('/a/b.zip') and not is_archive('/a/b.gz')
+
+    src = tempfile.mkdtemp()
+    zpath = os.path.join(src, 'a.zip')
+    with zipfile.ZipFile(zpath, 'w') as zf:
+        zf.writestr('top/', '')
+        zf.writestr('top/sub/f.txt', 'hello world')
+        zf.writestr('./g', 'g')
+        zf.writestr('../evil', 'evil')
+        zf.writestr('top/../../evil2', 'evil')
+    tpath = os.path.join(src, 'a.tar.gz')
+    with tarfile.open(tpath, 'w:gz') as tf:
+        tf.add(os.path.join(src, 'a.zip'), 'dir/a.zip')
+        link = tarfile.TarInfo('dir/link')
+        link.type = tarfile.SYMTYPE
+        link.linkname = '/etc/passwd'
+        tf.addfile(link)
+
+    root = tempfile.mkdtemp()
+    archive = Archive(zpath, root)
+    assert sorted(archive.tree.child) == ['g', 'top']
+    assert type(archive.getNode(os.path.join(root, 'top/sub'))) is ArchiveDir
+    member = archive.getNode(os.path.join(root, 'top/sub/f.txt'))
+    assert type(member) is ArchiveMember and member.size == 11
+    dst = os.path.join(root, 'top/sub/f.txt')
+    archive.extract(member, dst, count=5)
+    with open(dst) as f:
+        assert f.read() == 'hello'
+    archive.extract(member, dst)
+    with open(dst) as f:
+        assert f.read() == 'hello world'
+    assert not os.path.exists(dst + '.part')
+
+    # tar: regular files and directories only
+    archive = Archive(tpath, root)
+    assert sorted(archive.getNode(os.path.join(root, 'dir')).child) == ['a.zip']
+
+    fs = ArchiveFS(tempfile.mkdtemp())
+    aroot = fs.open(zpath)
+    assert fs.open(zpath) == aroot
+    assert fs.is_root(aroot) and not fs.is_root(os.path.join(aroot, 'top'))
+    assert fs.source(os.path.join(aroot, 'top')) == zpath
+    assert fs.owns(os.path.join(aroot, 'top')) and not fs.owns(src)
+    assert sorted(e[:2] for e in fs.list_with_attrs(aroot)) == [('g', False), ('top', True)]
+    assert fs.isdir(os.path.join(aroot, 'top')) and not fs.isdir(os.path.join(aroot, 'g'))
+    head = fs.fetch_head(os.path.join(aroot, 'top/sub/f.txt'), 5)
+    with open(head) as f:
+        assert f.read() == 'hello'
+
+    # members pasted into another buffer are extracted first, they can't be
+    # moved out of the archive
+    import types
+    from netranger.netranger import Netranger
+    pasted, errors = [], []
+    register = ([], [os.path.join(aroot, 'top'), os.path.join(aroot, 'g')])
+    archive_buf = types.SimpleNamespace(fs=fs, has_pending_paste=True, take_register=lambda: register)
+    local = types.SimpleNamespace(fs=FS(), has_pending_paste=False,
+                                  paste=lambda cut, copy, fs: pasted.append((cut, copy, fs)))
+    n = types.SimpleNamespace(curBuf=local, bufs={1: archive_buf, 2: local}, archive=fs, rclone=None,
+                              vim=types.SimpleNamespace(command=errors.append))
+    Netranger.NETRPaste(n)
+    assert pasted == [([], register[1], local.fs)] and errors == []
+    with open(os.path.join(aroot, 'top/sub/f.txt')) as f:
+        assert f.read() == 'hello world'
+    assert os.path.getsize(os.path.join(aroot, 'g')) == 1
+    register = ([os.path.join(aroot, 'g')], [])
+    Netranger.NETRPaste(n)
+    assert len(pasted) == 1 and 'read-only' in errors[0]
+
+    Shell.run('rm -rf {} {} {}'.format(src, root, fs.cache_dir))
+    print('== test_archive success ==')
+
+
+def test_compare():
+    import tempfile
+    from netranger import compare
+    from netranger.compare import Comparer
+    from netranger.fs import FS
+
+    left, right = tempfile.mkdtemp(), tempfile.mkdtemp()
+    past = time.time() - 100
+    for root in (left, right):
+        Shell.mkdir(os.path.join(root, 'same'))
+        Shell.mkdir(os.path.join(root, 'changed'))
+        Shell.mkdir(os.path.join(root, 'kind'))
+
+    def write(path, content, mtime=past):
+        with open(path, 'w') as f:
+            f.write(content)
+        os.utime(path, (mtime, mtime))
+
+    for root in (left, right):
+        write(os.path.join(root, 'same/a'), 'a')
+        write(os.path.join(root, 'changed/b'), 'b')
+    write(os.path.join(left, 'changed/c'), 'size')
+    write(os.path.join(right, 'changed/c'), 'other size')
+    # same size, different mtimes: told apart by their hashes
+    write(os.path.join(left, 'touched'), 'abc')
+    write(os.path.join(right, 'touched'), 'abc', past+50)
+    write(os.path.join(left, 'edited'), 'abc')
+    write(os.path.join(right, 'edited'), 'abd', past+50)
+    write(os.path.join(left, 'left'), '')
+    write(os.path.join(right, 'right'), '')
+    write(os.path.join(right, 'kind2'), '')
+    Shell.mkdir(os.path.join(left, 'kind2'))
+    write(os.path.join(right, 'kind/x'), '')
+
+    cache = os.path.join(tempfile.mkdtemp(), 'hashes')
+    comparer = Comparer(cache, max_jobs=2)
+    rows = comparer.compare(left, FS(), right, FS())
+    expected = [[0, 'changed', compare.Differ, True],
+                [1, 'b', compare.Same, False],
+                [1, 'c', compare.Differ, False],
+                [0, 'kind', compare.Differ, True],
+                [1, 'x', compare.RightOnly, False],
+                [0, 'kind2', compare.Differ, True],
+                [0, 'same', compare.Same, True],
+                [1, 'a', compare.Same, False],
+                [0, 'edited', compare.Differ, False],
+                [0, 'left', compare.LeftOnly, False],
+                [0, 'right', compare.RightOnly, False],
+                [0, 'touched', compare.Same, False]]
+    assert rows == expected, rows
+    # hashes are kept across comparisons
+    assert len(Comparer(cache).hashes.hashes) == 4
+    assert comparer.compare(left, FS(), right, FS()) == expected
+
+    Shell.run('rm -rf {} {} {}'.format(left, right, os.path.dirname(cache)))
+    print('== test_compare success ==')
+
+
+def test_grep():
+    import tempfile
+    from netranger.grep import Search, compile_pattern, search_data, search_files
+
+    regex = compile_pattern('foo')
+    data = b'foo\nbar\nFOO foo\n\nxfoo'
+    # smart case, one match per line, 1-based line numbers
+    assert search_data(regex, data, 10) == [(1, 'foo'), (3, 'FOO foo'), (5, 'xfoo')]
+    assert search_data(regex, data, 2) == [(1, 'foo'), (3, 'FOO foo')]
+    assert search_data(compile_pattern('Foo'), data, 10) == []
+
+    root = tempfile.mkdtemp()
+    Shell.mkdir(os.path.join(root, 'sub'))
+    Shell.mkdir(os.path.join(root, '.hidden'))
+    for fname, content in [('a', b'x\nfoo\n'), ('sub/b', b'foo'), ('sub/c.log', b'foo'),
+                           ('.hidden/d', b'foo'), ('bin', b'foo\0')]:
+        with open(os.path.join(root, fname), 'wb') as f:
+            f.write(content)
+    # binary and missing files are skipped
+    paths = [os.path.join(root, name) for name in ['a', 'bin', 'missing', 'sub/b']]
+    assert search_files('foo', paths, 10) == [(paths[0], 2, 'foo'), (paths[3], 1, 'foo')]
+
+    def run(pattern, **kwargs):
+        matches, done = [], []
+        finished = threading.Event()
+
+        def on_done(cancelled):
+            done.append(cancelled)
+            finished.set()
+        search = Search(pattern, [root], matches.extend, on_done, **kwargs)
+        search.start()
+        assert finished.wait(10)
+        return sorted(matches), done, search
+
+    matches, done, _ = run('foo', ignore=['*.log'], batch_size=1)
+    assert [os.path.relpath(m[0], root) for m in matches] == ['a', 'sub/b'] and done == [False]
+    matches, done, _ = run('foo', show_hidden=True, max_matches=2)
+    assert len(matches) == 2 and done == [True]
+
+    # a cancelled search reports it once, with no further matches
+    done = []
+    search = Search('foo', [root], lambda m: done.append('matches'), done.append)
+    search.cancel()
+    search.start()
+    time.sleep(0.2)
+    assert done == [True]
+
+    Shell.run('rm -rf {}'.format(root))
+    print('== test_grep success ==')
+
+
+def test_spawn():
+    import sys
+    import tempfile
+    import types
+    from netranger.netranger import NetRangerBuf
+
+    root = tempfile.mkdtemp()
+    out = os.path.join(root, 'argv')
+    script = os.path.join(root, 'print argv.py')
+    with open(script, 'w') as f:
+        f.write('import json, sys\njson.dump(sys.argv[1:], open({!r}, "w"))\n'.format(out))
+    # quoted command words and paths with spaces are kept whole
+    cmd = '{} "{}" -x'.format(sys.executable, script)
+    proc = Shell.spawn(cmd, ['a b', "it's"])
+    proc.wait(5)
+    with open(out) as f:
+        assert json.load(f) == ['-x', 'a b', "it's"]
+
+    # bad openers are reported rather than raised
+    errors = []
+    rifle = types.SimpleNamespace(decide_open_cmd=lambda path: 'open "unbalanced' if path == 'a' else 'no-such-opener')
+    buf = types.SimpleNamespace(rifle=rifle, vim=types.SimpleNamespace(command=errors.append))
+    NetRangerBuf.open_files(buf, ['a', 'b'])
+    assert len(errors) == 2 and all('Failed to run' in e for e in errors)
+
+    Shell.run('rm -rf {}'.format(root))
+    print('== test_spawn success ==')
+
+
+def test_backend():
+    from netranger.archive import ArchiveFS
+    from netranger.fs import FS, Backend, RClone
+
+    try:
+        Backend()
+        assert False
+    except TypeError:
+        pass
+
+    class Memory(Backend):
+        # minimal backend: one directory of files
+        files = {'/d/a': 1, '/d/b': 2}
+
+        def list_with_attrs(self, dirname):
+            return self.attrs(dirname, sorted(os.path.basename(p) for p in self.files))
+
+        def isdir(self, path):
+            return path == '/d'
+
+        def stat_many(self, paths):
+            return {path: (self.files[path], 0, None) for path in paths}
+
+        def mv(self, src, dst):
+            self.files[dst] = self.files.pop(src)
+
+        copy_many = move_many = remove_many = None
+
+    fs = Memory()
+    assert not (fs.local or fs.remote or fs.streaming or fs.fetches or fs.readonly or fs.stat_from_listing)
+    # no stats unless the listing provides them
+    assert fs.list_with_attrs('/d') == [('a', False, 'file', None), ('b', False, 'file', None)]
+    assert list(fs.list_with_attrs_stream('/d')) == [fs.list_with_attrs('/d')]
+    Memory.stat_from_listing = True
+    assert fs.list_with_attrs('/d')[1] == ('b', False, 'file', (2, 0, None))
+    assert fs.ftype('/d') == 'dir'
+    assert fs.is_fetched('/d/a') and fs.fetch_head('/d/a', 10) == '/d/a'
+    done = []
+    fs.fetch_async('/d/a', done.append)
+    assert done == [None]
+    assert fs.is_root('/') and fs.parent_dir('/') == '/' and fs.parent_dir('/d/e') == '/d'
+    assert fs.mtime('/d') == 0 and fs.dirty_mtime('/d') == (0, False)
+    fs.rename_many([('/d/a', '/d/c')])
+    assert sorted(fs.files) == ['/d/b', '/d/c']
+    assert not fs.show_hidden
+    fs.toggle_show_hidden()
+    assert fs.show_hidden
+
+    flags = ['local', 'remote', 'streaming', 'fetches', 'readonly', 'stat_from_listing']
+    assert [f for f in flags if getattr(FS, f)] == ['local']
+    assert [f for f in flags if getattr(RClone, f)] == ['remote', 'streaming', 'fetches', 'stat_from_listing']
+    assert [f for f in flags if getattr(ArchiveFS, f)] == ['fetches', 'readonly', 'stat_from_listing']
+    print('== test_backend success ==')
+
+
 if __name__ == '__main__':
     nvim = attach('socket', path='/tmp/nvim')
     ori_timeoutlen = nvim.options['timeoutlen']
     nvim.options['timeoutlen'] = 1
 
     try:
+        test_rcd()
+        test_vcs()
+        test_session()
+        test_daemon()
+        test_rifle()
+        test_metacache()
+        test_downloader()
+        test_filecache()
+        test_transfer_many()
+        test_ls_stream()
+        test_prefetcher()
+        test_prefetch_idle()
+        test_mount()
+        test_preview()
+        test_fuzzy()
+        test_pathindex()
+        test_frecency()
+        test_sort()
+        test_du()
+        test_archive()
+        test_compare()
+        test_grep()
+        test_spawn()
+        test_backend()
         # do_test(dummy,False)
         # do_test(test_navigation)
         # do_test(test_edit)
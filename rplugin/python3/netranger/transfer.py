@@ -0,0 +1,132 @@
+import os
+import subprocess
+import threading
+import time
+from netranger.util import Shell, log
+from netranger.rcd import RcdError
+
+log('')
+
+
+# Downloads remote files in background threads. At most `max_jobs` transfers
+# run at the same time, the others wait for a free slot. Data is streamed with
+# `rclone cat` into a ".part" file next to the target, so an interrupted
+# download resumes from where it stopped (`--offset`), and the ".part" file is
+# atomically renamed to the target when the transfer completes. Downloads
+# from the start go through the rcd daemon returned by `rcd()` when it's up.
+class Downloader(object):
+    def __init__(self, max_jobs=2, on_progress=None, chunk_size=1<<16, progress_interval=0.5, rcd=None):
+        self.slots = threading.Semaphore(max_jobs)
+        self.rcd = rcd
+        self.on_progress = on_progress
+        self.chunk_size = chunk_size
+        self.progress_interval = progress_interval
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.procs = set()
+        self.stopped = False
+
+    def download(self, rfile, on_done=None):
+        with self.lock:
+            if rfile.lpath in self.pending:
+                if on_done is not None:
+                    self.pending[rfile.lpath].append(on_done)
+                return
+            self.pending[rfile.lpath] = [] if on_done is None else [on_done]
+        threading.Thread(target=self._download, args=(rfile,), daemon=True).start()
+
+    def is_downloading(self, lpath):
+        return lpath in self.pending
+
+    def stop(self):
+        self.stopped = True
+        with self.lock:
+            for proc in self.procs:
+                proc.kill()
+
+    def _download(self, rfile):
+        err = None
+        with self.slots:
+            try:
+                self._transfer(rfile)
+            except Exception as e:
+                log('download failed:', rfile.path, e)
+                err = e
+
+        with self.lock:
+            callbacks = self.pending.pop(rfile.lpath)
+        for fn in callbacks:
+            fn(rfile, err)
+
+    def _transfer(self, rfile):
+        Shell.mkdir(os.path.dirname(rfile.lpath))
+        part = rfile.lpath + '.part'
+        stamp = part + '.stamp'
+        expected_stamp = '{} {}'.format(rfile.size, rfile.mtime)
+
+        # Only resume a partial download of the same remote version
+        offset = 0
+        if os.path.isfile(part) and os.path.isfile(stamp):
+            with open(stamp, 'r') as f:
+                if f.read() == expected_stamp:
+                    offset = os.path.getsize(part)
+        if offset == 0 or (rfile.size >= 0 and offset > rfile.size):
+            offset = 0
+            with open(stamp, 'w') as f:
+                f.write(expected_stamp)
+
+        if rfile.size < 0 or offset < rfile.size:
+            if self.stopped:
+                raise RuntimeError('downloader stopped')
+            if offset > 0 or not self._rcd_copy(rfile, part):
+                self._cat(rfile, part, offset)
+
+        os.replace(part, rfile.lpath)
+        os.remove(stamp)
+
+    def _rcd_copy(self, rfile, part):
+        rcd = self.rcd() if self.rcd is not None else None
+        if rcd is None:
+            return False
+        try:
+            rcd.copyfile(rfile.path, part)
+        except RcdError as e:
+            log('rcd copyfile failed, fallback to cli:', e)
+            return False
+        if self.on_progress is not None:
+            self.on_progress(rfile, os.path.getsize(part))
+        return True
+
+    def _cat(self, rfile, part, offset):
+        proc = subprocess.Popen(['rclone', 'cat', '--offset', str(offset), rfile.path],
+                                stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        with self.lock:
+            self.procs.add(proc)
+        try:
+            received = offset
+            last_report = 0
+            with open(part, 'ab' if offset>0 else 'wb') as f:
+                while True:
+                    data = proc.stdout.read(self.chunk_size)
+                    if not data:
+                        break
+                    f.write(data)
+                    received += len(data)
+                    now = time.time()
+                    if self.on_progress is not None and now - last_report > self.progress_interval:
+                        last_report = now
+                        self.on_progress(rfile, received)
+            proc.stdout.close()
+            if proc.wait() != 0:
+                raise Shell.CmdError(proc.returncode, 'rclone cat')
+        finally:
+            with self.lock:
+                self.procs.discard(proc)
+
+    @classmethod
+    def head(cls, rfile, dst, count):
+        Shell.mkdir(os.path.dirname(dst))
+        with open(dst, 'wb') as f:
+            subprocess.check_call(['rclone', 'cat', '--count', str(count), rfile.path],
+                                  stdout=f, stderr=subprocess.DEVNULL)
+        return dst
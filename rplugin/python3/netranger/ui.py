@@ -49,6 +49,75 @@ class UI(object):
         self.vim.command('setlocal nomodifiable')
 
 
+class PreviewUI(UI):
+    def __init__(self, vim):
+        UI.__init__(self, vim)
+        self.win = None
+
+    @property
+    def is_open(self):
+        return self.win is not None and self.win.valid
+
+    def open(self):
+        if self.is_open:
+            return
+        if self.buf_valid():
+            self.vim.command('botright vertical {}sb'.format(self.bufs['default'].number))
+        else:
+            self.vim.command('botright vnew')
+            self.set_buf_common_option()
+            self.bufs['default'] = self.vim.current.buffer
+        self.vim.command('setlocal nowrap')
+        self.win = self.vim.current.window
+        self.vim.command('wincmd p')
+
+    def close(self):
+        if self.is_open:
+            self.vim.command('{}close'.format(self.win.number))
+        self.win = None
+
+    def set_content(self, content):
+        buf = self.bufs['default']
+        buf.options['modifiable'] = True
+        buf[:] = content
+        buf.options['modifiable'] = False
+
+
+class LocateUI(UI):
+    def __init__(self, vim, netranger):
+        UI.__init__(self, vim)
+        self.netranger = netranger
+
+    def show_results(self, paths):
+        if self.buf_valid():
+            self.show()
+            buf = self.bufs['default']
+            buf.options['modifiable'] = True
+            buf[:] = paths
+            buf.options['modifiable'] = False
+        else:
+            self.create_buf(content=paths)
+            self.vim.command("nnoremap <buffer> <cr> :let g:_NETRRegister=[getline('.')] <cr> :quit <cr>")
+        self.netranger.pend_onuiquit(self.netranger.jump_to, 1)
+
+
+class CompareUI(UI):
+    def __init__(self, vim):
+        UI.__init__(self, vim)
+
+    def show_rows(self, left, right, rows):
+        content = ['= same  ! different  < only in {}  > only in {}  ? unknown'.format(left, right), '']
+        content += ['{} {}{}{}'.format(code, '  '*level, name, '/' if isdir else '') for level, name, code, isdir in rows]
+        if self.buf_valid():
+            self.show()
+            buf = self.bufs['default']
+            buf.options['modifiable'] = True
+            buf[:] = content
+            buf.options['modifiable'] = False
+        else:
+            self.create_buf(content=content)
+
+
 class HelpUI(UI):
     def __init__(self, vim, keymap_doc):
         UI.__init__(self, vim)
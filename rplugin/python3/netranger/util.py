@@ -1,7 +1,12 @@
+import multiprocessing
 import os
+import shlex
 import shutil
 import subprocess
 import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
 
 
 def log(*msg):
@@ -18,44 +23,55 @@ def VimErrorMsg(vim, exception):
     vim.command('echohl ErrorMsg | echo "{}" | echohl None '.format(msg.replace('"','\\"')))
 
 
-def spawnDaemon(func):
-    # do the UNIX double-fork magic, see Stevens' "Advanced
-    # Programming in the UNIX Environment" for details (ISBN 0201563177)
-    try:
-        pid = os.fork()
-        if pid > 0:
-            # parent process, return and keep running
-            return
-    except OSError as e:
-        print >>sys.stderr, "fork #1 failed: %d (%s)" % (e.errno, e.strerror)
-        sys.exit(1)
+def sizeof_fmt(num):
+    for unit in ['B', 'K', 'M', 'G', 'T']:
+        if abs(num) < 1024 or unit == 'T':
+            break
+        num /= 1024.0
+    if unit == 'B':
+        return '{}{}'.format(int(num), unit)
+    return '{:.1f}{}'.format(num, unit)
 
-    os.setsid()
 
-    # do second fork
-    try:
-        pid = os.fork()
-        if pid > 0:
-            # exit from second parent
-            sys.exit(0)
-    except OSError as e:
-        print >>sys.stderr, "fork #2 failed: %d (%s)" % (e.errno, e.strerror)
-        sys.exit(1)
-
-    # do stuff
-    func()
-
-    # all done
-    os._exit(os.EX_OK)
+def process_pool(max_workers, preload=()):
+    # Worker processes are forked from a fork server rather than from the
+    # (multithreaded) plugin host. `preload` modules are imported once in the
+    # fork server.
+    ctx = multiprocessing.get_context('forkserver')
+    ctx.set_forkserver_preload(list(preload))
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=ctx)
 
 
 class Shell():
     CmdError = subprocess.CalledProcessError
+    # programs started by spawn, not reaped yet
+    children = []
+    children_lock = threading.Lock()
+    reaper = None
 
     @classmethod
     def run(cls, cmd):
         return subprocess.check_output(cmd, shell=True).decode('utf-8')
 
+    @classmethod
+    def run_args(cls, args):
+        return subprocess.check_output(args, stderr=subprocess.STDOUT).decode('utf-8')
+
+    @classmethod
+    def stream(cls, args):
+        # Yield the output of a command line by line as it is produced
+        proc = subprocess.Popen(args, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        try:
+            for line in proc.stdout:
+                yield line.decode('utf-8')
+        except GeneratorExit:
+            proc.kill()
+            raise
+        finally:
+            proc.stdout.close()
+        if proc.wait() != 0:
+            raise Shell.CmdError(proc.returncode, args)
+
     @classmethod
     def touch(cls, name):
         Shell.run('touch ' + name)
@@ -69,8 +85,30 @@ class Shell():
         return os.stat(fname).st_mtime
 
     @classmethod
-    def spawn(cls, cmd):
-        spawnDaemon(lambda: subprocess.check_output(cmd.split(' ')).decode('utf-8'))
+    def spawn(cls, cmd, args=()):
+        # Detached in its own session, args (e.g. paths) are passed as is.
+        # Raises OSError if the program can't be started, ValueError if cmd
+        # has unbalanced quotes.
+        proc = subprocess.Popen(shlex.split(cmd) + list(args), stdin=subprocess.DEVNULL,
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                                start_new_session=True)
+        with cls.children_lock:
+            cls.children.append(proc)
+            if cls.reaper is None:
+                cls.reaper = threading.Thread(target=cls.reap, daemon=True)
+                cls.reaper.start()
+        return proc
+
+    @classmethod
+    def reap(cls, interval=1):
+        # A single thread reaps the spawned programs, until all of them exited
+        while True:
+            time.sleep(interval)
+            with cls.children_lock:
+                cls.children = [proc for proc in cls.children if proc.poll() is None]
+                if len(cls.children) == 0:
+                    cls.reaper = None
+                    return
 
     @classmethod
     def shellrc(cls):
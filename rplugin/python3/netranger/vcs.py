@@ -0,0 +1,215 @@
+import os
+import subprocess
+import threading
+import time
+from netranger.util import log
+
+log('')
+
+# Markers shown for directories containing changes, strongest first
+DirPriority = 'UMDARCT?'
+
+NoRootTTL = 10
+
+
+def status_code(xy):
+    # Worktree changes win over staged ones
+    return xy[1] if xy[1] != '.' else xy[0]
+
+
+def parse_porcelain_v2(out):
+    # Returns {relpath: code} from `git status --porcelain=v2 -z` output.
+    # Untracked/ignored directories are reported once with a trailing '/'.
+    statuses = {}
+    fields = out.split('\0')
+    i = 0
+    while i < len(fields):
+        field = fields[i]
+        i += 1
+        if len(field) == 0:
+            continue
+        kind = field[0]
+        if kind == '1':
+            parts = field.split(' ', 8)
+            statuses[parts[8]] = status_code(parts[1])
+        elif kind == '2':
+            parts = field.split(' ', 9)
+            statuses[parts[9]] = status_code(parts[1])
+            # the original path of the rename/copy
+            i += 1
+        elif kind == 'u':
+            statuses[field.split(' ', 10)[10]] = 'U'
+        elif kind in '?!':
+            statuses[field[2:]] = kind
+    return statuses
+
+
+def git_dir(root):
+    dotgit = os.path.join(root, '.git')
+    if os.path.isfile(dotgit):
+        # worktrees and submodules: "gitdir: <path>"
+        with open(dotgit, 'r') as f:
+            line = f.readline().strip()
+        if line.startswith('gitdir:'):
+            return os.path.join(root, line[len('gitdir:'):].strip())
+    return dotgit
+
+
+class Repo(object):
+    def __init__(self, root):
+        self.root = root
+        self.index_file = os.path.join(git_dir(root), 'index')
+        self.index_mtime = None
+        self.files = {}
+        self.dirs = {}
+        self.collapsed = {}
+        self.outdated = True
+        self.running = False
+
+    def set_statuses(self, statuses):
+        # Returns whether any status changed
+        files = {}
+        collapsed = {}
+        dirs = {}
+        for path, code in statuses.items():
+            if path[-1] == '/':
+                path = path[:-1]
+                collapsed[path] = code
+            else:
+                files[path] = code
+            if code == '!':
+                continue
+            parent = os.path.dirname(path)
+            while len(parent) > 0:
+                old = dirs.get(parent)
+                if old is not None and DirPriority.find(old) <= DirPriority.find(code):
+                    break
+                dirs[parent] = code
+                parent = os.path.dirname(parent)
+        changed = (files, dirs, collapsed) != (self.files, self.dirs, self.collapsed)
+        self.files, self.dirs, self.collapsed = files, dirs, collapsed
+        return changed
+
+    def lookup(self, relpath):
+        code = self.files.get(relpath)
+        if code is not None:
+            return code
+        code = self.collapsed.get(relpath)
+        if code is not None:
+            return code
+        code = self.dirs.get(relpath)
+        if code is not None:
+            return code
+        # anything inside an untracked/ignored directory
+        if len(self.collapsed) > 0:
+            parent = os.path.dirname(relpath)
+            while len(parent) > 0:
+                if parent in self.collapsed:
+                    return self.collapsed[parent]
+                parent = os.path.dirname(parent)
+        return None
+
+
+# Git status of the entries of local directories. Each repository runs a
+# single `git status --porcelain=v2 -z` in a background thread, parsed into
+# a path -> status index that rendering only reads from. A repository is
+# queried again when its index file changes or when it's invalidated (e.g. a
+# file in it was written). `on_update(root)` is called from the background
+# thread when the statuses of a repository changed. Optional locks are
+# disabled so that the index isn't rewritten behind a concurrent git command.
+class VcsStatus(object):
+    def __init__(self, on_update=None):
+        self.on_update = on_update
+        self.roots = {}
+        self.repos = {}
+        self.lock = threading.Lock()
+
+    def find_root(self, dirname):
+        # Directories outside any repository are checked again after
+        # NoRootTTL seconds, in case a repository got created above them
+        now = time.time()
+        visited = []
+        path = dirname
+        root = None
+        while True:
+            cached = self.roots.get(path)
+            if cached is not None and (cached[0] is not None or cached[1] > now):
+                root = cached[0]
+                break
+            visited.append(path)
+            if os.path.exists(os.path.join(path, '.git')):
+                root = path
+                break
+            parent = os.path.dirname(path)
+            if parent == path:
+                break
+            path = parent
+        for path in visited:
+            self.roots[path] = (root, now+NoRootTTL)
+        return root
+
+    def repo(self, dirname):
+        root = self.find_root(dirname)
+        if root is None:
+            return None
+        if root not in self.repos:
+            self.repos[root] = Repo(root)
+        return self.repos[root]
+
+    def status(self, path):
+        repo = self.repo(os.path.dirname(path))
+        if repo is None:
+            return None
+        return repo.lookup(os.path.relpath(path, repo.root))
+
+    def update(self, dirname):
+        repo = self.repo(dirname)
+        if repo is None:
+            return
+        try:
+            mtime = os.stat(repo.index_file).st_mtime
+        except OSError:
+            mtime = None
+        if mtime != repo.index_mtime:
+            repo.index_mtime = mtime
+            repo.outdated = True
+        if repo.outdated:
+            self.run(repo)
+
+    def invalidate(self, path):
+        # Only repositories already being shown are queried again
+        root = self.find_root(path if os.path.isdir(path) else os.path.dirname(path))
+        repo = self.repos.get(root)
+        if repo is None:
+            return
+        repo.outdated = True
+        self.run(repo)
+
+    def run(self, repo):
+        with self.lock:
+            if repo.running:
+                return
+            repo.running = True
+            repo.outdated = False
+
+        def job():
+            changed = False
+            while True:
+                try:
+                    out = subprocess.check_output(['git', '--no-optional-locks', '-C', repo.root, 'status',
+                                                   '--porcelain=v2', '-z', '--ignored', '--untracked-files=normal'],
+                                                  stderr=subprocess.DEVNULL)
+                    if repo.set_statuses(parse_porcelain_v2(out.decode('utf-8', 'surrogateescape'))):
+                        changed = True
+                except (OSError, subprocess.CalledProcessError) as e:
+                    log('git status failed:', repo.root, e)
+                with self.lock:
+                    # invalidated while running
+                    if not repo.outdated:
+                        repo.running = False
+                        break
+                    repo.outdated = False
+            if changed and self.on_update is not None:
+                self.on_update(repo.root)
+
+        threading.Thread(target=job, daemon=True).start()